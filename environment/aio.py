@@ -0,0 +1,60 @@
+from functools import wraps
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+
+
+def _check_user(request, perms):
+    # 触发 request.user 的惰性加载（会话和用户查询），之后模板中访问 user 不再查库
+    user = request.user
+    return user.is_authenticated, user.has_perms(perms)
+
+
+def async_permission_required(perm):
+    """异步视图版 login_required + permission_required(raise_exception=True)
+
+    Django 4.2 自带的装饰器不支持协程视图；这里只把会话、用户和权限查询放到一次 sync_to_async 中。
+    """
+    perms = (perm,) if isinstance(perm, str) else tuple(perm)
+
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            authenticated, allowed = await sync_to_async(_check_user)(request, perms)
+            if not authenticated:
+                return redirect_to_login(request.get_full_path())
+            if not allowed:
+                raise PermissionDenied
+            return await view_func(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def aget_object_or_404(model, **kwargs):
+    try:
+        return await model.objects.aget(**kwargs)
+    except model.DoesNotExist:
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+async def aiter_chunks(iterable, size=200):
+    """在 sync_to_async 中分批消费查库的同步生成器，每批拼成一个字符串产出
+
+    ASGI 下 StreamingHttpResponse 遇到同步迭代器会先在线程中整体读完再发送，
+    改为异步迭代器后按批发送，内存只保留一批。生成器始终在同一个同步线程中推进和关闭。
+    """
+    iterator = iter(iterable)
+    next_chunk = sync_to_async(lambda: ''.join(islice(iterator, size)))
+    try:
+        while True:
+            chunk = await next_chunk()
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
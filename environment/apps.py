@@ -1,6 +1,27 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class EnvironmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'environment'
+
+    def ready(self):
+        from helloDjango.authcache import connect_signals
+        from .bundle import bundle_cache
+        from .feed import change_feed
+        from .fragments import invalidate_table
+        from .history import create_baseline_snapshot
+        from .signals import changed_on_commit, variables_changed
+        post_migrate.connect(create_baseline_snapshot, sender=self)
+
+        # 单个变量的 save / delete 与批量写入一样，在事务提交后发送 variables_changed
+        variable = self.get_model('EnvironmentVariable')
+        post_save.connect(changed_on_commit, sender=variable, dispatch_uid='environment_changed_save')
+        post_delete.connect(changed_on_commit, sender=variable, dispatch_uid='environment_changed_delete')
+        variables_changed.connect(bundle_cache.invalidate, dispatch_uid='environment_bundle')
+        variables_changed.connect(invalidate_table, dispatch_uid='environment_fragment')
+        variables_changed.connect(change_feed.notify, dispatch_uid='environment_feed')
+
+        # 用户、用户组和权限变化时清除登录用户缓存
+        connect_signals()
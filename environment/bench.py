@@ -0,0 +1,272 @@
+"""
+environment 应用的离线基准测试（manage.py env_bench）。
+
+在独立的测试数据库（SQLite 临时文件或本地 PostgreSQL 的 test_ 库）中生成 N 行变量，
+系统文件路径、指标目录和共享缓存都指向临时目录，不会触碰 /etc 和生产数据；
+在进程内直接调用 ASGI 应用（与 uvicorn 相同的 ASGIHandler 和完整中间件链），
+用多个并发协程模拟客户端，按场景统计吞吐量、p50/p95/p99 延迟和每请求查询次数，
+并与保存的基线比较。
+"""
+import asyncio
+import math
+import random
+import string
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.urls import reverse
+
+from helloDjango.metrics.registry import registry
+
+from .models import EnvironmentVariable
+from .pagination import encode_cursor
+
+WORDS = (
+    'alpha', 'bravo', 'cache', 'delta', 'echo', 'fox', 'gateway', 'host', 'index', 'java',
+    'kafka', 'log', 'mysql', 'nginx', 'oauth', 'proxy', 'queue', 'redis', 'secret', 'token',
+)
+
+
+# ---------- 隔离环境 ----------
+
+def isolated_settings(workdir):
+    """基准测试期间覆盖的设置：所有文件路径指向临时目录"""
+    workdir = Path(workdir)
+    (workdir / 'profile.d').mkdir(exist_ok=True)
+    (workdir / 'environment').touch()
+
+    caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+    for alias, config in caches.items():
+        if config['BACKEND'].endswith('FileBasedCache'):
+            config['LOCATION'] = str(workdir / f'cache-{alias}')
+        config['KEY_PREFIX'] = 'bench'
+    return {
+        'ENV_SYSTEM_FILE': str(workdir / 'environment'),
+        'ENV_PROFILE_DIR': str(workdir / 'profile.d'),
+        'ENV_WRITE_LOCK': str(workdir / 'environment.lock'),
+        'METRICS_DIR': str(workdir / 'metrics'),
+        'CACHES': caches,
+        'ENV_PROPAGATION_ENABLED': False,
+        # 哈希清单需要先 collectstatic；静态文件不在测试范围内
+        'STORAGES': {
+            **settings.STORAGES,
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        },
+    }
+
+
+def sqlite_test_name(workdir):
+    """SQLite 默认的测试库在内存中，这里改用临时文件，锁和 I/O 行为与实际部署一致"""
+    return str(Path(workdir) / 'bench.sqlite3')
+
+
+def seed(rows, rng, batch_size=1000):
+    """生成 rows 个变量：值长度 8~400 不等，描述中带可搜索的单词"""
+    objects = []
+    for i in range(rows):
+        words = rng.sample(WORDS, 3)
+        length = rng.choice((8, 16, 32, 64, 128, 400))
+        objects.append(EnvironmentVariable(
+            key=f'BENCH_VAR_{i:06d}',
+            value=''.join(rng.choices(string.ascii_letters + string.digits, k=length)),
+            description=f'benchmark {" ".join(words)} #{i}',
+        ))
+    EnvironmentVariable.objects.bulk_create([var.packed() for var in objects], batch_size=batch_size)
+    return rows
+
+
+# ---------- 进程内 ASGI 客户端 ----------
+
+class ASGIClient:
+    """直接调用 ASGI 应用，不经过网络；带登录会话和 CSRF cookie"""
+
+    def __init__(self, application, cookies):
+        self.application = application
+        self.csrf_token = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+        cookies = dict(cookies, **{settings.CSRF_COOKIE_NAME: self.csrf_token})
+        self.cookie_header = '; '.join(f'{name}={value}' for name, value in cookies.items()).encode()
+
+    async def request(self, method, path, query=None, data=None):
+        body = urlencode(data).encode() if data else b''
+        headers = [
+            (b'host', b'bench.local'),
+            (b'cookie', self.cookie_header),
+            (b'accept-encoding', b'gzip'),
+        ]
+        if method == 'POST':
+            headers += [
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'content-length', str(len(body)).encode()),
+                (b'x-csrftoken', self.csrf_token.encode()),
+            ]
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': urlencode(query or {}).encode(),
+            'root_path': '',
+            'headers': headers,
+            'client': ('127.0.0.1', 50000),
+            'server': ('bench.local', 80),
+        }
+        done = asyncio.Event()
+        sent_body = False
+        response = {'status': None, 'size': 0}
+
+        async def receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Django 在响应期间监听断开事件；响应结束后才返回
+            await done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+                if not message.get('more_body'):
+                    done.set()
+
+        await self.application(scope, receive, send)
+        done.set()
+        return response['status'], response['size']
+
+
+# ---------- 场景 ----------
+
+class Scenario:
+    def __init__(self, name, build, writes=False, expect=(200,)):
+        self.name = name
+        self.build = build  # build(i) -> (method, path, query, data)
+        self.writes = writes
+        self.expect = expect
+
+
+def default_scenarios(rows, rng):
+    list_url = reverse('environment:list')
+    keys = [f'BENCH_VAR_{i:06d}' for i in range(rows)]
+    # 深页游标：从表的后半部分取若干个起点
+    cursors = [encode_cursor([keys[rng.randrange(rows // 2, rows)]], 'next') for _ in range(20)] if rows else ['']
+    pks = list(EnvironmentVariable.objects.filter(key__in=rng.sample(keys, min(rows, 50))).values_list('pk', flat=True))
+
+    def edit(i):
+        pk = pks[i % len(pks)]
+        variable = EnvironmentVariable.objects.get(pk=pk)
+        return 'POST', reverse('environment:edit', args=[pk]), None, {
+            'key': variable.key,
+            'value': f'bench-{i}',
+            'description': variable.description,
+            'scope': 'global',
+        }
+
+    return [
+        Scenario('list', lambda i: ('GET', list_url, None, None)),
+        Scenario('list_deep', lambda i: ('GET', list_url, {'cursor': cursors[i % len(cursors)]}, None)),
+        Scenario('search', lambda i: ('GET', list_url, {'search': WORDS[i % len(WORDS)]}, None)),
+        Scenario('bundle', lambda i: ('GET', reverse('environment:bundle'), {'format': 'json'}, None)),
+        Scenario('export', lambda i: ('GET', reverse('environment:export'), {'format': 'env'}, None)),
+        Scenario('history', lambda i: ('GET', reverse('environment:history'), None, None)),
+        Scenario('edit', edit, writes=True, expect=(302,)),
+        Scenario('refresh', lambda i: ('GET', list_url, {'refresh': '1'}, None), writes=True, expect=(302,)),
+    ]
+
+
+def percentile(values, q):
+    """最近秩法"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def _queries_per_request():
+    snapshot = registry.snapshot()
+    total = count = 0
+    for name, view, series in snapshot['histograms']:
+        if name == 'django_request_db_queries':
+            total += series[-2]
+            count += series[-1]
+    return total / count if count else 0.0
+
+
+async def run_scenario(client, scenario, requests, concurrency, warmup):
+    from asgiref.sync import sync_to_async
+
+    build = sync_to_async(scenario.build)  # 构造请求时可能查库（如编辑前读取当前值）
+    for i in range(warmup):
+        await client.request(*await build(i))
+    registry.reset()
+
+    latencies = []
+    errors = 0
+    counter = iter(range(warmup, warmup + requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, path, query, data = await build(i)
+            started = time.perf_counter()
+            status, _ = await client.request(method, path, query, data)
+            latencies.append(time.perf_counter() - started)
+            if status not in scenario.expect:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries': round(_queries_per_request(), 2),
+    }
+
+
+def login_cookies(username='bench'):
+    from django.contrib.auth import get_user_model
+    from django.test import Client
+
+    user_model = get_user_model()
+    user = user_model.objects.filter(username=username).first()
+    if user is None:
+        user = user_model.objects.create_superuser(username, 'bench@example.com', None)
+    client = Client()
+    client.force_login(user)
+    return {name: morsel.value for name, morsel in client.cookies.items()}
+
+
+# ---------- 基线比较 ----------
+
+def compare(results, baseline, tolerance):
+    """返回 [(场景, 指标, 基线值, 当前值)]：延迟升高或吞吐下降超过 tolerance，或查询次数增加"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if current[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], current[metric]))
+        if current['rps'] < base['rps'] / (1 + tolerance):
+            regressions.append((name, 'rps', base['rps'], current['rps']))
+        if current['queries'] > base['queries'] + 0.01:
+            regressions.append((name, 'queries', base['queries'], current['queries']))
+    return regressions
+
+
+def temp_workdir():
+    return tempfile.TemporaryDirectory(prefix='env-bench-')
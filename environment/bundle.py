@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import EnvironmentVariable, VariableRevision
+from .transfer import format_line, resolved_lookup
+
+try:
+    import brotli
+except ImportError:  # 未安装时只提供 gzip
+    brotli = None
+
+BUNDLE_FORMATS = {
+    'env': 'text/plain; charset=utf-8',
+    'json': 'application/json',
+}
+
+
+def _latest_revision():
+    """历史版本号的最大值，主键索引上的一次查找"""
+    return VariableRevision.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def _encode_variants(body):
+    variants = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=5)
+    return variants
+
+
+def _build(revision):
+    rows = list(EnvironmentVariable.objects.order_by('key').values_full('key', 'value'))
+    lookup = resolved_lookup()
+    if lookup is not None:
+        rows = [(key, lookup(key, value)) for key, value in rows]
+    bodies = {
+        'env': ''.join(format_line(key, value, None, 'env') for key, value in rows).encode(),
+        'json': json.dumps(dict(rows), ensure_ascii=False, separators=(',', ':')).encode(),
+    }
+    entry = {'revision': revision, 'count': len(rows), 'formats': {}}
+    for fmt, body in bodies.items():
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        entry['formats'][fmt] = {
+            'etag': digest,
+            'variants': _encode_variants(body),
+        }
+    return entry
+
+
+class BundleCache:
+    """全部变量的 .env / JSON 打包结果，按进程缓存在内存中
+
+    本进程的保存、删除和批量写入通过信号 / 提交回调立即失效；
+    其他 worker 的修改通过每 ENV_BUNDLE_RECHECK 秒比较一次最新历史版本号发现，
+    与轮询的客户端数量无关。另按 ENV_BUNDLE_MAX_AGE 秒兜底重建
+    （并发事务可能以较小的版本号晚提交），内容未变时 ETag 不变。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None
+        self._checked_at = 0.0
+        self._built_at = 0.0
+        self.builds = 0
+
+    def invalidate(self, *args, **kwargs):
+        # 也作为信号接收函数使用
+        self._checked_at = 0.0
+        self._built_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        entry = self._entry
+        if entry is not None and now - self._checked_at < settings.ENV_BUNDLE_RECHECK:
+            return entry
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and now - self._checked_at < settings.ENV_BUNDLE_RECHECK:
+                return entry
+            revision = _latest_revision()
+            stale = now - self._built_at >= settings.ENV_BUNDLE_MAX_AGE
+            if entry is None or entry['revision'] != revision or stale:
+                entry = _build(revision)
+                self._entry = entry
+                self._built_at = now
+                self.builds += 1
+            self._checked_at = now
+            return entry
+
+
+bundle_cache = BundleCache()
+
+
+def accepted_encodings(header):
+    """解析 Accept-Encoding，返回客户端接受的编码集合（q=0 视为拒绝）"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    return accepted
+
+
+def choose_encoding(header, variants):
+    accepted = accepted_encodings(header or '')
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and (encoding in accepted or '*' in accepted):
+            return encoding
+    return 'identity'
+
+
+def variant_etag(digest, encoding):
+    """强 ETag：不同编码的表示各不相同"""
+    return f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+
+
+def etag_matches(header, digest):
+    """If-None-Match 使用弱比较：同一内容的任一编码变体都视为未修改"""
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag == digest or tag.split('-', 1)[0] == digest:
+            return True
+    return False
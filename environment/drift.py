@@ -0,0 +1,61 @@
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .interpolation import get_resolver
+from .models import EnvironmentVariable, value_hash
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _system_snapshot():
+    """当前进程环境变量的 {key: md5(value)}，与 load_from_system 一样跳过 _ 开头的变量"""
+    return {
+        key: value_hash(value)
+        for key, value in os.environ.items()
+        if not key.startswith('_')
+    }
+
+
+def _db_fingerprint():
+    """表内容的廉价指纹：行数 + 最近更新时间，一条聚合查询"""
+    stats = EnvironmentVariable.objects.aggregate(count=Count('id'), latest=Max('updated_at'))
+    return stats['count'], stats['latest']
+
+
+def compute_drift():
+    """系统环境与数据库的差异
+
+    只从数据库读取 key 和写入时保存的 value_hash，不读取值本身；
+    结果按 (系统环境指纹, 数据库指纹) 缓存，二者都未变化时直接复用。
+    返回 added（系统有、库中没有）、changed（值不同）、missing（库中有、系统没有）。
+    """
+    system = _system_snapshot()
+    system_fingerprint = hashlib.md5(repr(sorted(system.items())).encode()).hexdigest()
+    db_fingerprint = _db_fingerprint()
+    fingerprint = (system_fingerprint, db_fingerprint)
+
+    with _lock:
+        if _cache.get('fingerprint') == fingerprint:
+            return _cache['result']
+
+    stored = dict(EnvironmentVariable.objects.values_list('key', 'value_hash'))
+    if settings.ENV_INTERPOLATION:
+        # 系统中是解析后的值：含引用的变量改用解析结果的哈希
+        resolver = get_resolver()
+        for key, refs in list(resolver.deps.items()):
+            if refs and key in stored:
+                stored[key] = value_hash(resolver.resolve(key))
+    result = {
+        'added': sorted(key for key in system if key not in stored),
+        'changed': sorted(key for key in system if key in stored and stored[key] != system[key]),
+        'missing': sorted(key for key in stored if key not in system),
+    }
+    with _lock:
+        _cache['fingerprint'] = fingerprint
+        _cache['result'] = result
+    return result
@@ -0,0 +1,210 @@
+import errno
+import fcntl
+import logging
+import os
+import shlex
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from helloDjango.metrics import timer
+
+from .probe import is_writable
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SCRIPT_NAME = 'custom_environment.sh'
+
+_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'}
+_UNESCAPES = {'\\': '\\', '"': '"', 'n': '\n', 'r': '\r'}
+
+
+def quote_dotenv(value):
+    """双引号包裹，转义规则与 python-dotenv 一致"""
+    return '"' + ''.join(_ESCAPES.get(ch, ch) for ch in value) + '"'
+
+
+def unquote_dotenv(value):
+    if len(value) < 2 or value[0] != '"' or value[-1] != '"':
+        return value
+    chars = iter(value[1:-1])
+    result = []
+    for ch in chars:
+        if ch == '\\':
+            nxt = next(chars, '')
+            result.append(_UNESCAPES.get(nxt, '\\' + nxt))
+        else:
+            result.append(ch)
+    return ''.join(result)
+
+
+def check_value(value):
+    """写入系统文件的值不能包含换行和 NUL：两个文件都按行解析，profile 脚本由 root 执行"""
+    if any(ch in value for ch in '\n\r\0'):
+        raise ValueError('值不能包含换行或 NUL 字符')
+    return value
+
+
+def parse_env_line(line):
+    """解析一行 KEY="value" / export KEY='value'，注释和空行返回 None"""
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#') or '=' not in stripped:
+        return None
+    key, value = stripped.split('=', 1)
+    key = key.strip()
+    if key.startswith('export '):
+        key = key[len('export '):].strip()
+    value = value.strip()
+    if value.startswith("'"):
+        # profile 脚本中按 shlex.quote 写入的值
+        try:
+            parts = shlex.split(value)
+        except ValueError:
+            return key, value
+        return key, parts[0] if parts else ''
+    return key, unquote_dotenv(value)
+
+
+@contextmanager
+def file_lock(path=None):
+    """跨进程文件锁，保证多个 uvicorn worker 串行修改系统文件"""
+    path = path or settings.ENV_WRITE_LOCK
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def atomic_write(path, content, mode=0o644):
+    """写临时文件后 os.replace 原子替换；目标被 bind mount 等无法替换时退回原地写入"""
+    directory = os.path.dirname(path) or '.'
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.')
+    except PermissionError:
+        # 目录不可写但文件可写
+        _write_in_place(path, content, mode)
+        return
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        try:
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if e.errno not in (errno.EBUSY, errno.EXDEV):
+                raise
+            _write_in_place(path, content, mode)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_in_place(path, content, mode):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+class EnvFileWriter:
+    """批量修改 /etc/environment 和 profile.d 的写入器
+
+    收集一批 set/unset 操作，在文件锁内每个文件只解析、写入一次：
+    /etc/environment 通过临时文件 + os.replace 原子替换，
+    profile.d 下所有托管变量合并到同一个脚本 custom_environment.sh。
+    """
+
+    def __init__(self, env_file=None, profile_dir=None):
+        self.env_file = env_file or settings.ENV_SYSTEM_FILE
+        self.profile_dir = profile_dir or settings.ENV_PROFILE_DIR
+        self._ops = {}  # key -> value，None 表示删除
+        self.skipped = []  # 上次 commit 因没有写权限而跳过的目标
+
+    def set(self, key, value):
+        self._ops[key] = check_value(value)
+        return self
+
+    def unset(self, key):
+        self._ops[key] = None
+        return self
+
+    def __len__(self):
+        return len(self._ops)
+
+    @property
+    def profile_script(self):
+        return os.path.join(self.profile_dir, PROFILE_SCRIPT_NAME)
+
+    def commit(self):
+        """应用全部操作，返回实际写入的文件列表
+
+        不可写的目标跳过并记录在 skipped 中（profile.d 不存在时不算目标）；
+        没有任何目标可写时抛出 PermissionError，操作保留以便重试。
+        """
+        if not self._ops:
+            return []
+        targets = [(self.env_file, self.env_file, self._write_env_file)]
+        if os.path.isdir(self.profile_dir):
+            targets.append((self.profile_dir, self.profile_script, self._write_profile_script))
+        written, skipped = [], []
+        with timer('file_io_time'), file_lock():
+            for check, path, write in targets:
+                if is_writable(check):
+                    write()
+                    written.append(path)
+                else:
+                    skipped.append(path)
+        self.skipped = skipped
+        if not written:
+            raise PermissionError(f'没有写权限: {", ".join(skipped)}')
+        if skipped:
+            logger.warning('没有写权限，已跳过 %s', ', '.join(skipped), extra={'env_keys': sorted(self._ops)})
+        self._ops = {}
+        return written
+
+    @staticmethod
+    def _read_lines(path):
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            return f.readlines()
+
+    def _apply(self, lines, render):
+        """在原有行上应用操作：替换或删除已有键，保留注释和其他行，新键追加到末尾"""
+        pending = dict(self._ops)
+        new_lines = []
+        for line in lines:
+            parsed = parse_env_line(line)
+            if parsed and parsed[0] in self._ops:
+                key = parsed[0]
+                if key in pending and pending[key] is not None:
+                    new_lines.append(render(key, pending[key]))
+                pending.pop(key, None)  # 同一个键重复出现时只保留第一处
+                continue
+            new_lines.append(line if line.endswith('\n') else line + '\n')
+        for key, value in pending.items():
+            if value is not None:
+                new_lines.append(render(key, value))
+        return new_lines
+
+    def _write_env_file(self):
+        lines = self._read_lines(self.env_file)
+        if lines:
+            # 备份原文件（每批一次）
+            with open(f'{self.env_file}.bak', 'w') as f:
+                f.writelines(lines)
+        new_lines = self._apply(lines, lambda key, value: f'{key}={quote_dotenv(value)}\n')
+        atomic_write(self.env_file, ''.join(new_lines))
+
+    def _write_profile_script(self):
+        lines = self._read_lines(self.profile_script)
+        new_lines = self._apply(lines, lambda key, value: f'export {key}={shlex.quote(value)}\n')
+        atomic_write(self.profile_script, ''.join(new_lines))
+        # 清理旧版本按变量生成的 custom_<KEY>.sh，避免与合并脚本冲突
+        for key in self._ops:
+            legacy = os.path.join(self.profile_dir, f'custom_{key}.sh')
+            if os.path.exists(legacy):
+                os.remove(legacy)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Max
+
+from .logtail import committed_prefix
+from .models import VariableRevision
+
+logger = logging.getLogger(__name__)
+
+
+def _latest_revision():
+    return VariableRevision.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def _revisions_after(version, limit):
+    """version 之后按 id 顺序可以交付的变更（在尚未提交的事务留下的空洞前截断），
+    返回 (rows, truncated)"""
+    rows = list(
+        VariableRevision.objects.filter(id__gt=version)
+        .order_by('id')
+        .only('id', 'key', 'operation', 'created_at')[:limit]
+    )
+    committed = committed_prefix(rows, version)
+    return [(rev.pk, rev.key, rev.operation) for rev in committed], len(committed) < len(rows)
+
+
+def format_event(event):
+    data = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {event["version"]}\nevent: change\ndata: {data}\n\n'
+
+
+class ChangeFeed:
+    """变更事件的进程内分发中心（SSE）
+
+    每个 worker 只有一个后台协程按历史版本号拉取新变更，再分发给所有连接的队列，
+    连接数不影响数据库查询次数，也不占用线程。本进程提交后立即唤醒，
+    其他 worker 的修改最多 ENV_FEED_POLL 秒内发现。事件严格按版本号顺序发出：
+    版本号出现空洞（事务先拿到版本号、后提交）时等空洞填上再继续，最多等 ENV_LOG_GAP_TIMEOUT 秒。
+    最近 ENV_FEED_BUFFER 条事件保存在环形缓冲区中，用于 Last-Event-ID 断线重放；
+    历史版本号全局递增，客户端重连到任一 worker 都可以续传。
+    """
+
+    def __init__(self):
+        self.version = None
+        self.buffer = None
+        self.floor = None  # 缓冲区能完整重放的起点（不含）
+        self._subscribers = set()
+        self._loop = None
+        self._wakeup = None
+        self._ready = None
+        self._task = None
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._ready = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    def notify(self, *args, **kwargs):
+        """可在任意线程调用（也作为 variables_changed 接收函数），唤醒分发协程立即拉取"""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        try:
+            if self.version is None:
+                # 从当前版本开始，之前的变更不进入缓冲区
+                self.version = await sync_to_async(_latest_revision)()
+                self.floor = self.version
+                self.buffer = deque(maxlen=settings.ENV_FEED_BUFFER)
+        finally:
+            self._ready.set()
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.ENV_FEED_POLL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._fetch()
+            except Exception:
+                logger.exception('拉取环境变量变更失败，稍后重试')
+
+    async def _fetch(self):
+        rows, truncated = await sync_to_async(_revisions_after)(self.version, settings.ENV_FEED_BUFFER)
+        for version, key, operation in rows:
+            event = {'version': version, 'key': key, 'operation': operation}
+            if len(self.buffer) == self.buffer.maxlen:
+                self.floor = self.buffer[0]['version']
+            self.buffer.append(event)
+            self.version = version
+            for queue in list(self._subscribers):
+                self._deliver(queue, event)
+        if len(rows) == settings.ENV_FEED_BUFFER and not truncated:
+            self._wakeup.set()  # 还有未拉取的变更
+
+    def _deliver(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 消费过慢：丢弃积压并通知客户端全量刷新
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+            self._subscribers.discard(queue)
+
+    def subscribe(self, last_id=None):
+        """注册连接，返回 (queue, replay)；replay 为 None 表示缺失的事件已不在缓冲区中"""
+        queue = asyncio.Queue(maxsize=settings.ENV_FEED_QUEUE)
+        self._subscribers.add(queue)
+        if last_id is None or self.buffer is None:
+            return queue, []
+        if last_id < self.floor:
+            return queue, None
+        return queue, [event for event in self.buffer if event['version'] > last_id]
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def stats(self):
+        return {
+            'version': self.version,
+            'subscribers': len(self._subscribers),
+            'buffered': len(self.buffer) if self.buffer is not None else 0,
+            'floor': self.floor,
+        }
+
+    async def stream(self, last_id=None):
+        """单个连接的 SSE 输出
+
+        空闲时每 ENV_FEED_HEARTBEAT 秒发送注释行保活；连接最长保持 ENV_FEED_MAX_AGE 秒后结束，
+        由 EventSource 带着 Last-Event-ID 自动重连（也回收客户端已断开但未被察觉的连接）。
+        """
+        self.ensure_started()
+        await self._ready.wait()  # 分发协程确定起始版本后再注册
+        queue, replay = self.subscribe(last_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.ENV_FEED_MAX_AGE
+        try:
+            yield f'retry: {int(settings.ENV_FEED_RETRY * 1000)}\n\n'
+            if replay is None:
+                yield f'event: reset\ndata: {json.dumps({"version": self.version})}\n\n'
+            for event in replay or ():
+                yield format_event(event)
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), min(settings.ENV_FEED_HEARTBEAT, remaining))
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    yield f'event: reset\ndata: {json.dumps({"version": self.version})}\n\n'
+                    break
+                yield format_event(event)
+        finally:
+            self.unsubscribe(queue)
+
+
+change_feed = ChangeFeed()
@@ -1,12 +1,32 @@
+import json
+
 from django import forms
+from django.conf import settings
+from .envfile import check_value, parse_env_line
 from .models import EnvironmentVariable
 
+SCOPE_CHOICES = [
+    ('global', '全局（所有用户）'),
+    ('session', '当前会话'),
+]
+
+
+def validate_env_key(key):
+    if not key.isidentifier():
+        raise forms.ValidationError('变量名必须是有效的标识符（字母、数字、下划线，不以数字开头）')
+    return key
+
+
+def validate_env_value(value):
+    try:
+        return check_value(value)
+    except ValueError as e:
+        raise forms.ValidationError(str(e))
+
+
 class EnvironmentVariableForm(forms.ModelForm):
     scope = forms.ChoiceField(
-        choices=[
-            ('global', '全局（所有用户）'),
-            ('session', '当前会话'),
-        ],
+        choices=SCOPE_CHOICES,
         initial='global',
         label='生效范围'
     )
@@ -21,7 +41,137 @@ class EnvironmentVariableForm(forms.ModelForm):
         }
 
     def clean_key(self):
-        key = self.cleaned_data['key']
-        if not key.isidentifier():
-            raise forms.ValidationError('变量名必须是有效的标识符（字母、数字、下划线，不以数字开头）')
-        return key
\ No newline at end of file
+        return validate_env_key(self.cleaned_data['key'])
+
+    def clean_value(self):
+        return validate_env_value(self.cleaned_data['value'])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        key, value = cleaned_data.get('key'), cleaned_data.get('value')
+        if settings.ENV_INTERPOLATION and key and value is not None:
+            from .interpolation import CycleError, get_resolver
+            try:
+                get_resolver().preview({key: value})
+            except CycleError as e:
+                self.add_error('value', str(e))
+        return cleaned_data
+
+
+class BulkVariableRowForm(forms.Form):
+    """批量编辑中的一行，校验规则与 EnvironmentVariableForm 一致"""
+    key = forms.CharField(
+        max_length=100, required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'})
+    )
+    value = forms.CharField(
+        required=False, strip=False,
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'})
+    )
+    description = forms.CharField(
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control form-control-sm'})
+    )
+
+    def clean_key(self):
+        key = self.cleaned_data['key'].strip()
+        return validate_env_key(key) if key else key
+
+    def clean_value(self):
+        return validate_env_value(self.cleaned_data['value'])
+
+
+BulkVariableFormSet = forms.formset_factory(BulkVariableRowForm, extra=5)
+
+
+def parse_bulk_payload(text):
+    """解析粘贴的 JSON 或 .env 文本，返回 [(key, value, description)]
+
+    JSON 支持 {"KEY": "value"} 或 [{"key": ..., "value": ..., "description": ...}]，
+    .env 每行一个 KEY=value，description 为 None 表示保留原描述。
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if text[0] in '{[':
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise forms.ValidationError(f'JSON 格式错误: {e}')
+        if isinstance(data, dict):
+            return [(str(key), str(value), None) for key, value in data.items()]
+        entries = []
+        for item in data:
+            if not isinstance(item, dict) or 'key' not in item or 'value' not in item:
+                raise forms.ValidationError('JSON 数组中的每一项都必须包含 key 和 value')
+            entries.append((str(item['key']), str(item['value']), item.get('description')))
+        return entries
+
+    entries = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.strip().startswith('#'):
+            continue
+        parsed = parse_env_line(line)
+        if parsed is None:
+            raise forms.ValidationError(f'第 {lineno} 行格式错误，应为 KEY=value')
+        entries.append((parsed[0], parsed[1], None))
+    return entries
+
+
+class BulkEditForm(forms.Form):
+    payload = forms.CharField(
+        required=False,
+        label='粘贴 JSON 或 .env',
+        widget=forms.Textarea(attrs={'class': 'form-control font-monospace', 'rows': 8,
+                                     'placeholder': 'KEY=value\n或 {"KEY": "value"}'})
+    )
+    scope = forms.ChoiceField(
+        choices=SCOPE_CHOICES,
+        initial='global',
+        label='生效范围',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean_payload(self):
+        entries = parse_bulk_payload(self.cleaned_data['payload'])
+        invalid = [key for key, _, _ in entries if not key.isidentifier() or len(key) > 100]
+        if invalid:
+            raise forms.ValidationError(f'以下变量名无效: {", ".join(invalid)}')
+        for key, value, _ in entries:
+            try:
+                check_value(value)
+            except ValueError as e:
+                raise forms.ValidationError(f'{key}: {e}')
+        return entries
+
+
+class RollbackForm(forms.Form):
+    """按版本号或时间点回滚，二者填写其一"""
+    revision = forms.IntegerField(
+        required=False,
+        min_value=0,
+        label='版本号',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': '如 128'})
+    )
+    at = forms.DateTimeField(
+        required=False,
+        label='时间点',
+        input_formats=['%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'],
+        widget=forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'})
+    )
+    scope = forms.ChoiceField(
+        choices=SCOPE_CHOICES,
+        required=False,
+        initial='global',
+        label='生效范围',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+
+    def clean_scope(self):
+        return self.cleaned_data['scope'] or 'global'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if (cleaned_data.get('revision') is None) == (cleaned_data.get('at') is None):
+            raise forms.ValidationError('请填写版本号或时间点中的一个')
+        return cleaned_data
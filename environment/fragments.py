@@ -0,0 +1,47 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+# 版本号放在共享缓存中（所有 worker 可见），渲染好的片段放在本进程内存中
+VERSION_KEY = 'environment:table_version'
+
+
+def _shared():
+    return caches['shared']
+
+
+def _local():
+    return caches['default']
+
+
+def table_version():
+    """变量表的版本号；缓存被清空时重新生成，不会回到旧值而命中过期片段"""
+    version = _shared().get(VERSION_KEY)
+    if version is None:
+        _shared().add(VERSION_KEY, time.time_ns(), None)
+        version = _shared().get(VERSION_KEY)
+    return version
+
+
+def bump_table_version():
+    _shared().set(VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate_table(*args, **kwargs):
+    """variables_changed 接收函数：信号在事务提交后发送，其他请求不会把提交前的旧数据缓存到新版本下"""
+    bump_table_version()
+
+
+def fragment_key(name, version, *parts):
+    digest = hashlib.md5('\0'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'environment:fragment:{name}:{version}:{digest}'
+
+
+def get_fragment(key):
+    return _local().get(key)
+
+
+def set_fragment(key, value):
+    _local().set(key, value, settings.ENV_FRAGMENT_CACHE_TTL)
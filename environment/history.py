@@ -0,0 +1,158 @@
+import json
+import zlib
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Max
+
+from .models import EnvironmentVariable, VariableRevision, VariableSnapshot, value_hash
+
+
+def _pack(value):
+    """值编码为 bytes，超过阈值时 zlib 压缩，返回 (payload, compressed)"""
+    if value is None:
+        return None, False
+    raw = value.encode()
+    if len(raw) > settings.ENV_HISTORY_COMPRESS_THRESHOLD:
+        packed = zlib.compress(raw)
+        if len(packed) < len(raw):
+            return packed, True
+    return raw, False
+
+
+def _unpack(payload, compressed):
+    if payload is None:
+        return None
+    raw = bytes(payload)  # PostgreSQL 返回 memoryview
+    return (zlib.decompress(raw) if compressed else raw).decode()
+
+
+def revision_value(revision):
+    return _unpack(revision.payload, revision.compressed)
+
+
+def record_revisions(entries, source=''):
+    """记录一批变更的历史版本
+
+    entries 为 (key, value, description)，value 为 None 表示删除，
+    description 为 None 表示沿用上一版本；source 为复制来源实例。调用方负责只传入真正变化的键；
+    距上次快照累计超过 ENV_SNAPSHOT_INTERVAL 条时自动生成快照，缩短回放链。
+    """
+    rows = []
+    for key, value, description in entries:
+        payload, compressed = _pack(value)
+        rows.append(VariableRevision(
+            key=key,
+            operation='set' if value is not None else 'delete',
+            payload=payload,
+            compressed=compressed,
+            description=description,
+            source=source,
+        ))
+    if not rows:
+        return []
+    rows = VariableRevision.objects.bulk_create(rows)
+
+    latest = VariableRevision.objects.aggregate(latest=Max('id'))['latest'] or 0
+    last_snapshot = VariableSnapshot.objects.aggregate(last=Max('revision_id'))['last'] or 0
+    if latest - last_snapshot >= settings.ENV_SNAPSHOT_INTERVAL:
+        take_snapshot()
+    return rows
+
+
+def take_snapshot():
+    """按当前表内容生成快照，revision_id 为已包含的最新历史版本"""
+    with transaction.atomic():
+        revision_id = VariableRevision.objects.aggregate(latest=Max('id'))['latest'] or 0
+        data = {
+            key: [value, description]
+            for key, value, description in EnvironmentVariable.objects.values_full(
+                'key', 'value', 'description'
+            )
+        }
+        return VariableSnapshot.objects.create(
+            revision_id=revision_id,
+            count=len(data),
+            data=zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()),
+        )
+
+
+def _load_snapshot(snapshot):
+    return {key: tuple(item) for key, item in json.loads(zlib.decompress(bytes(snapshot.data))).items()}
+
+
+def resolve_revision(at=None, revision=None):
+    """把时间点换算为该时刻之前（含）最新的历史版本号"""
+    if revision is not None:
+        return int(revision)
+    qs = VariableRevision.objects.all()
+    if at is not None:
+        qs = qs.filter(created_at__lte=at)
+    return qs.aggregate(latest=Max('id'))['latest'] or 0
+
+
+def state_at(at=None, revision=None):
+    """重建某一时间点（或版本号）的全部变量，返回 {key: (value, description)}
+
+    从不晚于目标版本的最近快照出发，只回放其后的增量。
+    """
+    target = resolve_revision(at, revision)
+    snapshot = (VariableSnapshot.objects.filter(revision_id__lte=target)
+                .order_by('-revision_id').first())
+    if snapshot is None:
+        state, start = {}, 0
+    else:
+        state, start = _load_snapshot(snapshot), snapshot.revision_id
+
+    revisions = (VariableRevision.objects
+                 .filter(id__gt=start, id__lte=target)
+                 .order_by('id')
+                 .iterator(chunk_size=2000))
+    for rev in revisions:
+        if rev.operation == 'delete':
+            state.pop(rev.key, None)
+            continue
+        previous = state.get(rev.key, (None, ''))[1]
+        description = rev.description if rev.description is not None else previous
+        state[rev.key] = (revision_value(rev), description)
+    return state
+
+
+def rollback_to(at=None, revision=None, scope='global', batch_size=500):
+    """回滚到某一时间点（或版本号）
+
+    只计算与当前表的差异（按哈希比较），通过 bulk_apply 在一个事务中写库、记录历史，
+    并经批量写入器一次性更新系统文件；回滚本身也会成为新的历史版本。
+    """
+    target = state_at(at, revision)
+    # 当前表只读取哈希，不读取值本身
+    current = {
+        key: (digest, description)
+        for key, digest, description in EnvironmentVariable.objects.values_list(
+            'key', 'value_hash', 'description'
+        )
+    }
+    entries = [
+        (key, value, description)
+        for key, (value, description) in target.items()
+        if current.get(key) != (value_hash(value), description)
+    ]
+    removed = [key for key in current if key not in target]
+    return EnvironmentVariable.bulk_apply(
+        entries, scope=scope, batch_size=batch_size, removed_keys=removed
+    )
+
+
+def create_baseline_snapshot(sender, using='default', **kwargs):
+    """post_migrate：还没有任何快照时以现有数据生成基线，之前的数据也能被重建
+
+    迁移到较早的版本（回退）时表结构与当前模型不一致，跳过。
+    """
+    if using != 'default':
+        return
+    executor = MigrationExecutor(connections[using])
+    if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+        return
+    if not VariableSnapshot.objects.exists():
+        take_snapshot()
@@ -0,0 +1,228 @@
+import re
+import threading
+from collections import defaultdict, deque
+
+from .logtail import GapTracker
+from .models import EnvironmentVariable, VariableRevision
+
+# ${NAME} 引用；$$ 转义为字面量 $（$${NAME} 得到 ${NAME}）
+REFERENCE = re.compile(r'\$\$|\$\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+class CycleError(ValueError):
+    def __init__(self, keys):
+        self.keys = keys
+        super().__init__(f'变量存在循环引用: {" -> ".join(keys)}')
+
+
+def references(value):
+    """值中引用的变量名集合"""
+    if '${' not in value:
+        return frozenset()
+    return frozenset(name for name in REFERENCE.findall(value) if name)
+
+
+def substitute(value, lookup):
+    """替换 ${NAME}，lookup(name) 返回解析后的值，未定义时返回 None（替换为空串）"""
+    if '$' not in value:
+        return value
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            return '$'
+        resolved = lookup(name)
+        return '' if resolved is None else resolved
+
+    return REFERENCE.sub(replace, value)
+
+
+class Resolver:
+    """变量插值的依赖图与解析缓存
+
+    deps 记录每个变量引用了谁，dependents 是反向边。每个变量解析后缓存在 memo 中，
+    某个变量变化时只清除它及其传递依赖者的缓存；解析用显式栈做深度优先遍历，
+    每个变量只计算一次，整体与变量数和引用数成线性关系，并在遍历中检测循环引用。
+    """
+
+    def __init__(self):
+        self.raw = {}
+        self.deps = {}
+        self.dependents = defaultdict(set)
+        self.memo = {}
+        self.version = None
+        self.tail = GapTracker()
+        self._lock = threading.RLock()
+
+    # ---------- 依赖图维护 ----------
+
+    def _set_raw(self, key, value):
+        self._drop_raw(key)
+        refs = references(value)
+        self.raw[key] = value
+        self.deps[key] = refs
+        for ref in refs:
+            self.dependents[ref].add(key)
+
+    def _drop_raw(self, key):
+        self.raw.pop(key, None)
+        for ref in self.deps.pop(key, ()):
+            users = self.dependents.get(ref)
+            if users is not None:
+                users.discard(key)
+                if not users:
+                    del self.dependents[ref]
+
+    def affected(self, keys):
+        """keys 及所有直接或间接引用它们的变量"""
+        seen = set(keys)
+        queue = deque(seen)
+        while queue:
+            for user in self.dependents.get(queue.popleft(), ()):
+                if user not in seen:
+                    seen.add(user)
+                    queue.append(user)
+        return seen
+
+    def load(self, values, version=None):
+        with self._lock:
+            self.raw, self.deps, self.memo = {}, {}, {}
+            self.dependents = defaultdict(set)
+            for key, value in values.items():
+                self._set_raw(key, value)
+            self.version = version
+
+    def update(self, sets=None, deleted=()):
+        """应用一批变化，只清除受影响变量的缓存，返回受影响的键"""
+        sets = sets or {}
+        with self._lock:
+            affected = self.affected(set(sets) | set(deleted))
+            for key in affected:
+                self.memo.pop(key, None)
+            for key in deleted:
+                self._drop_raw(key)
+            for key, value in sets.items():
+                self._set_raw(key, value)
+            return affected
+
+    # ---------- 解析 ----------
+
+    @staticmethod
+    def _evaluate(root, raw, memo, external=None):
+        """解析 root：raw 为本次参与解析的原始值，结果写入 memo；
+        不在 raw 中的引用交给 external（未定义则为 None）"""
+        if root in memo:
+            return memo[root]
+
+        def lookup(name):
+            if name in memo:
+                return memo[name]
+            return external(name) if external is not None else None
+
+        path = [root]
+        on_path = {root}
+        stack = [iter(references(raw[root]))]
+        while stack:
+            key = path[-1]
+            for ref in stack[-1]:
+                if ref in memo or ref not in raw:
+                    continue
+                if ref in on_path:
+                    raise CycleError(path[path.index(ref):] + [ref])
+                path.append(ref)
+                on_path.add(ref)
+                stack.append(iter(references(raw[ref])))
+                break
+            else:
+                stack.pop()
+                path.pop()
+                on_path.discard(key)
+                memo[key] = substitute(raw[key], lookup)
+        return memo[root]
+
+    def _resolve_base(self, key, errors=None):
+        try:
+            return self._evaluate(key, self.raw, self.memo)
+        except CycleError as e:
+            # 循环中的变量保留原值（同样缓存，直到其中某个变量被修改）
+            for cyclic in e.keys:
+                self.memo[cyclic] = self.raw[cyclic]
+                if errors is not None:
+                    errors[cyclic] = str(e)
+            return self._evaluate(key, self.raw, self.memo)
+
+    def resolve(self, key):
+        """解析后的值，未定义的变量返回 None，循环引用中的变量返回原值"""
+        with self._lock:
+            if key not in self.raw:
+                return None
+            return self._resolve_base(key)
+
+    def resolve_all(self):
+        """全部变量的解析结果，返回 (values, errors)，errors 列出循环引用的变量"""
+        errors = {}
+        with self._lock:
+            for key in self.raw:
+                if key not in self.memo:
+                    self._resolve_base(key, errors)
+            return dict(self.memo), errors
+
+    def preview(self, sets=None, deleted=()):
+        """假设应用这批变化后，受影响变量的解析结果 {key: value}，删除的键为 None
+
+        不修改缓存；存在循环引用时抛出 CycleError。
+        """
+        sets = sets or {}
+        with self._lock:
+            affected = self.affected(set(sets) | set(deleted))
+            raw = {}
+            for key in affected:
+                if key in sets:
+                    raw[key] = sets[key]
+                elif key in self.raw and key not in deleted:
+                    raw[key] = self.raw[key]
+
+            def external(name):
+                # 不在 raw 中的受影响键即被删除的键
+                if name in self.raw and name not in affected:
+                    return self._resolve_base(name)
+                return None
+
+            memo = {}
+            result = {}
+            for key in affected:
+                if key in raw:
+                    result[key] = self._evaluate(key, raw, memo, external)
+                else:
+                    result[key] = None
+            return result
+
+    # ---------- 与数据库同步 ----------
+
+    def sync(self):
+        """按历史版本号增量同步：只重新读取版本号之后（及尚未提交的空洞中）变化过的键"""
+        with self._lock:
+            if self.version is None:
+                # 先确定水位再读全表，读取期间提交的变更下次同步时再读一遍（按键重读，结果相同）
+                latest = self.tail.start(VariableRevision.objects.all())
+                self.load(dict(EnvironmentVariable.objects.values_full('key', 'value')), latest)
+                return
+            rows = list(VariableRevision.objects.filter(self.tail.pending()).values_list('id', 'key'))
+            if not rows:
+                return
+            keys = set()
+            for pk, key in rows:
+                self.tail.seen(pk)
+                keys.add(key)
+            current = dict(EnvironmentVariable.objects.filter(key__in=keys).values_full('key', 'value'))
+            self.update(current, [key for key in keys if key not in current])
+            self.version = self.tail.position
+
+
+resolver = Resolver()
+
+
+def get_resolver():
+    """与数据库同步后的进程内解析器"""
+    resolver.sync()
+    return resolver
@@ -0,0 +1,102 @@
+"""
+按自增 id 增量读取日志表（历史版本、变更日志）时的提交安全水位。
+
+id 在插入时分配，提交顺序却不一定与 id 顺序一致：事务 A 先拿到 id 10，
+事务 B 拿到 id 11 并先提交，只按 id > 水位 读取的一方读到 11 后就再也看不到 10。
+两种处理方式，空洞超过 ENV_LOG_GAP_TIMEOUT 秒仍未出现都视为事务已回滚（序列号不回收）：
+- GapTracker：照常推进，把读到的 id 之间的空洞记下来，之后每次连同空洞一起查询；
+- committed_prefix：不记状态，在可能仍未提交的空洞前截断，等空洞填上后再继续（保持 id 顺序）。
+同一个变量的两次修改会在变量行上互相等待，后提交的一方 id 也更大，
+因此晚到的记录不会覆盖同一变量更新的修改。
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils import timezone
+
+MAX_GAPS = 100  # 最多跟踪的空洞区间数，超过时丢弃最早的
+
+
+class GapTracker:
+    """记录已读到的最大 id 和其下尚未出现的 id 区间"""
+
+    def __init__(self, position=0):
+        self.position = position
+        self._gaps = []  # [(first, last, 发现时间)]
+
+    def start(self, queryset):
+        """从日志表当前末尾开始，最近 ENV_LOG_GAP_TIMEOUT 秒内的记录之间的空洞同样跟踪"""
+        since = timezone.now() - timedelta(seconds=settings.ENV_LOG_GAP_TIMEOUT)
+        recent = list(queryset.filter(created_at__gte=since).order_by('id').values_list('id', flat=True))
+        before = queryset.filter(id__lt=recent[0]) if recent else queryset
+        self.position = before.aggregate(last=Max('id'))['last'] or 0
+        self._gaps = []
+        for pk in recent:
+            self.seen(pk)
+        return self.position
+
+    def pending(self):
+        """待读取的记录：id 大于水位，或落在仍在等待的空洞中"""
+        self.expire()
+        condition = Q(id__gt=self.position)
+        for first, last, _ in self._gaps:
+            condition |= Q(id__range=(first, last))
+        return condition
+
+    def seen(self, pk):
+        """登记读到的 id，返回 True 表示它填补了空洞（晚提交的事务）"""
+        if pk > self.position:
+            if pk > self.position + 1:
+                self._gaps.append((self.position + 1, pk - 1, time.monotonic()))
+                del self._gaps[:-MAX_GAPS]
+            self.position = pk
+            return False
+        for index, (first, last, found) in enumerate(self._gaps):
+            if first <= pk <= last:
+                parts = []
+                if pk > first:
+                    parts.append((first, pk - 1, found))
+                if pk < last:
+                    parts.append((pk + 1, last, found))
+                self._gaps[index:index + 1] = parts
+                return True
+        return False
+
+    def expire(self):
+        cutoff = time.monotonic() - settings.ENV_LOG_GAP_TIMEOUT
+        self._gaps = [gap for gap in self._gaps if gap[2] >= cutoff]
+
+    @property
+    def gaps(self):
+        return len(self._gaps)
+
+
+def _writers_in_progress(using):
+    """PostgreSQL 上除本连接外是否还有已写入数据、尚未结束的事务"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_stat_activity '
+            'WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid())'
+        )
+        return cursor.fetchone()[0]
+
+
+def committed_prefix(rows, since, using='default'):
+    """按 id 升序读到的 rows（since 之后）中可以按顺序交付、安全推进水位的前缀
+
+    遇到空洞且空洞之后的记录写入不足 ENV_LOG_GAP_TIMEOUT 秒时，空洞中的事务可能还没提交，
+    在空洞前截断，下次从空洞处重新读取；更早的空洞，或当前已没有其他写事务时，视为已回滚。
+    SQLite 同一时间只有一个写事务，id 按提交顺序分配，不需要截断。
+    """
+    if not rows or connections[using].vendor != 'postgresql':
+        return rows
+    cutoff = timezone.now() - timedelta(seconds=settings.ENV_LOG_GAP_TIMEOUT)
+    previous = since
+    for index, row in enumerate(rows):
+        if row.pk != previous + 1 and row.created_at > cutoff:
+            return rows[:index] if _writers_in_progress(using) else rows
+        previous = row.pk
+    return rows
@@ -0,0 +1,163 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from helloDjango.prefork import Prefork, preload
+
+# 同一数据库上所有容器共用的迁移锁编号（任意常量）
+MIGRATE_LOCK_ID = 72630001
+
+
+@contextmanager
+def migrate_lock(using=DEFAULT_DB_ALIAS):
+    """PostgreSQL 上用会话级咨询锁，多个容器同时启动时只有一个执行迁移；其他数据库退回文件锁"""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [MIGRATE_LOCK_ID])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [MIGRATE_LOCK_ID])
+        return
+    with open(settings.BOOT_MIGRATE_LOCK, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pending_migrations(using=DEFAULT_DB_ALIAS):
+    executor = MigrationExecutor(connections[using])
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+class Command(BaseCommand):
+    help = '容器快速启动：启动日志写入进程，按需迁移、创建管理员、预加载应用后 fork uvicorn worker，并输出各阶段耗时'
+    requires_system_checks = []  # 系统检查在构建和开发时执行，不放在每次启动的关键路径上
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--workers', type=int, default=int(os.getenv('UVICORN_WORKERS', 10)))
+        parser.add_argument('--report', default=settings.BOOT_REPORT, help='启动报告（JSON）的写入路径')
+        parser.add_argument('--no-serve', action='store_true', help='只做启动准备并输出报告，不启动 uvicorn')
+
+    def handle(self, *args, **options):
+        self.phases = []
+        started = time.time()
+        # start.sh 导出 BOOT_T0，覆盖解释器启动、导入 Django 和加载设置的耗时
+        boot_t0 = os.getenv('BOOT_T0')
+        if boot_t0:
+            try:
+                self.phases.append({'phase': 'bootstrap', 'seconds': round(started - float(boot_t0), 3)})
+                started = float(boot_t0)
+            except ValueError:
+                pass
+
+        server = None
+        if not options['no_serve']:
+            server = Prefork('helloDjango.asgi:application', options['host'], options['port'], options['workers'])
+            # 日志写入进程最先启动并由主进程监管，迁移等阶段的日志也能写入
+            if settings.LOG_COLLECTOR_ENABLED:
+                with self.phase('log_collector') as detail:
+                    server.add_service('log_collector', partial(call_command, 'log_collector'))
+                    detail['socket'] = settings.LOG_COLLECTOR_SOCKET
+
+        try:
+            with self.phase('migrate') as detail:
+                self.migrate(detail)
+            with self.phase('superuser') as detail:
+                self.create_superuser(detail)
+            with self.phase('collectstatic') as detail:
+                self.collectstatic(detail)
+            with self.phase('preload') as detail:
+                detail.update(preload())
+
+            if server is not None:
+                with self.phase('bind') as detail:
+                    server.bind()
+                    detail['address'] = f'{options["host"]}:{options["port"]}'
+                with self.phase('fork') as detail:
+                    server.start()
+                    detail['workers'] = options['workers']
+        except BaseException:
+            # 启动准备失败时不留下无人监管的日志写入进程
+            if server is not None:
+                server.shutdown()
+            raise
+
+        self.report(options['report'], time.time() - started)
+        if server is not None:
+            server.wait()
+
+    @contextmanager
+    def phase(self, name):
+        detail = {}
+        started = time.perf_counter()
+        yield detail
+        self.phases.append({'phase': name, 'seconds': round(time.perf_counter() - started, 3), **detail})
+
+    def migrate(self, detail):
+        # 迁移文件随代码提交；没有待执行的迁移时只做一次查询，不加锁
+        if not pending_migrations():
+            detail['pending'] = 0
+            return
+        with migrate_lock():
+            # 等锁期间其他容器可能已完成迁移
+            plan = pending_migrations()
+            detail['pending'] = len(plan)
+            if plan:
+                # 早期版本在启动时生成迁移，已有表但没有迁移记录时按已执行处理
+                call_command('migrate', interactive=False, fake_initial=True, verbosity=0)
+
+    def create_superuser(self, detail):
+        username = settings.BOOT_SUPERUSER_USERNAME
+        if not username:
+            detail['skipped'] = True
+            return
+        user_model = get_user_model()
+        if user_model.objects.filter(username=username).exists():
+            detail['created'] = False
+            return
+        try:
+            user_model.objects.create_superuser(
+                username, settings.BOOT_SUPERUSER_EMAIL, settings.BOOT_SUPERUSER_PASSWORD
+            )
+            detail['created'] = True
+        except IntegrityError:
+            # 另一个容器同时创建了
+            detail['created'] = False
+
+    def collectstatic(self, detail):
+        # 镜像构建时已收集；只有清单缺失（如未使用构建好的镜像）时才在启动时收集
+        manifest = getattr(staticfiles_storage, 'manifest_name', None)
+        if manifest is None or staticfiles_storage.exists(manifest):
+            detail['skipped'] = True
+            return
+        call_command('collectstatic', interactive=False, ignore_patterns=['css/fonts/*.css'], verbosity=0)
+        detail['skipped'] = False
+
+    def report(self, path, total):
+        report = {'pid': os.getpid(), 'total_seconds': round(total, 3), 'phases': self.phases}
+        width = max(len(p['phase']) for p in self.phases)
+        for p in self.phases:
+            extra = ', '.join(f'{k}={v}' for k, v in p.items() if k not in ('phase', 'seconds'))
+            self.stdout.write(f'  {p["phase"]:<{width}}  {p["seconds"]:>7.3f}s  {extra}')
+        self.stdout.write(self.style.SUCCESS(f'启动完成，共 {total:.3f}s'))
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
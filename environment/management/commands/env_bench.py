@@ -0,0 +1,109 @@
+import asyncio
+import json
+import logging
+import random
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from environment.bench import (
+    ASGIClient, compare, default_scenarios, isolated_settings, login_cookies, run_scenario, seed,
+    sqlite_test_name, temp_workdir,
+)
+
+
+class Command(BaseCommand):
+    help = '离线基准测试：在独立测试库中生成数据，进程内并发调用 ASGI 应用，输出延迟/吞吐/查询次数并与基线比较'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='生成的变量行数')
+        parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+        parser.add_argument('--concurrency', type=int, default=10, help='并发客户端数（写场景在 SQLite 上固定为 1）')
+        parser.add_argument('--warmup', type=int, default=5, help='每个场景不计入统计的预热请求数')
+        parser.add_argument('--only', nargs='*', help='只运行指定场景')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子，保证每次生成相同的数据和请求序列')
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'env_bench.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='延迟/吞吐允许的相对退化')
+        parser.add_argument('--output', help='另存本次结果（JSON）')
+        parser.add_argument('--keepdb', action='store_true', help='保留测试库（PostgreSQL 上可跳过重建）')
+
+    def handle(self, *args, **options):
+        with temp_workdir() as workdir, override_settings(**isolated_settings(workdir)):
+            # 业务日志（每次写入都会记录）不计入测试，也不刷屏
+            logging.disable(logging.INFO)
+            if connection.vendor == 'sqlite':
+                connection.settings_dict.setdefault('TEST', {})['NAME'] = sqlite_test_name(workdir)
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+            try:
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+                logging.disable(logging.NOTSET)
+
+        self.report(results)
+        if options['output']:
+            self.write_json(options['output'], results)
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            self.write_json(baseline_path, results)
+            self.stdout.write(self.style.SUCCESS(f'已保存基线: {baseline_path}'))
+            return
+        if not baseline_path.exists():
+            self.stdout.write(f'没有基线 {baseline_path}，使用 --save-baseline 保存本次结果')
+            return
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        regressions = compare(results['scenarios'], baseline.get('scenarios', {}), options['tolerance'])
+        if baseline.get('rows') != options['rows']:
+            self.stdout.write(self.style.WARNING(f'基线的数据量为 {baseline.get("rows")} 行，与本次不同'))
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'  {name}.{metric}: {before} -> {after}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} 项指标相对基线退化')
+        self.stdout.write(self.style.SUCCESS('与基线相比没有退化'))
+
+    def run(self, options):
+        from django.core.asgi import get_asgi_application
+
+        rng = random.Random(options['seed'])
+        count = seed(options['rows'], rng)
+        self.stdout.write(f'已生成 {count} 行，数据库: {connection.vendor}')
+
+        client = ASGIClient(get_asgi_application(), login_cookies())
+        scenarios = default_scenarios(options['rows'], rng)
+        if options['only']:
+            unknown = set(options['only']) - {s.name for s in scenarios}
+            if unknown:
+                raise CommandError(f'未知场景: {", ".join(sorted(unknown))}')
+            scenarios = [s for s in scenarios if s.name in options['only']]
+
+        results = {}
+        for scenario in scenarios:
+            concurrency = 1 if scenario.writes and connection.vendor == 'sqlite' else options['concurrency']
+            results[scenario.name] = asyncio.run(
+                run_scenario(client, scenario, options['requests'], concurrency, options['warmup'])
+            )
+            self.stdout.write(f'  {scenario.name} 完成')
+        return {'rows': options['rows'], 'vendor': connection.vendor, 'scenarios': results}
+
+    def report(self, results):
+        # 列名与结果 JSON 中的字段一致
+        self.stdout.write(
+            f'{"scenario":<12}{"conc":>6}{"requests":>10}{"errors":>8}{"rps":>10}'
+            f'{"p50_ms":>10}{"p95_ms":>10}{"p99_ms":>10}{"queries":>10}'
+        )
+        for name, r in results['scenarios'].items():
+            self.stdout.write(
+                f'{name:<12}{r["concurrency"]:>6}{r["requests"]:>10}{r["errors"]:>8}{r["rps"]:>10}'
+                f'{r["p50_ms"]:>10}{r["p95_ms"]:>10}{r["p99_ms"]:>10}{r["queries"]:>10}'
+            )
+
+    def write_json(self, path, results):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+
+from environment.history import resolve_revision, rollback_to, state_at, take_snapshot
+
+
+class Command(BaseCommand):
+    help = '环境变量历史版本：生成快照、查看或回滚到某一版本号 / 时间点'
+    requires_system_checks = []  # 避免加载路由时的输出混入 show 的结果
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['snapshot', 'show', 'rollback'])
+        parser.add_argument('--revision', type=int, help='版本号')
+        parser.add_argument('--at', help='时间点，ISO 格式，如 2024-05-01T12:00:00')
+        parser.add_argument('--scope', choices=['global', 'session', 'db'], default='global',
+                            help='回滚时的生效范围，db 表示只写数据库')
+
+    def _target(self, options):
+        at = None
+        if options['at']:
+            at = parse_datetime(options['at'])
+            if at is None:
+                raise CommandError(f'无法解析时间: {options["at"]}')
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+        if (at is None) == (options['revision'] is None):
+            raise CommandError('请指定 --revision 或 --at 中的一个')
+        return at, options['revision']
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'snapshot':
+            snapshot = take_snapshot()
+            self.stderr.write(self.style.SUCCESS(
+                f'已生成快照：截至版本 r{snapshot.revision_id}，{snapshot.count} 个变量'
+            ))
+            return
+
+        at, revision = self._target(options)
+        if action == 'show':
+            state = state_at(at, revision)
+            self.stdout.write(json.dumps(
+                {key: {'value': value, 'description': description}
+                 for key, (value, description) in sorted(state.items())},
+                ensure_ascii=False, indent=2,
+            ))
+            self.stderr.write(f'版本 r{resolve_revision(at, revision)}，{len(state)} 个变量')
+            return
+
+        scope = None if options['scope'] == 'db' else options['scope']
+        try:
+            results = rollback_to(at, revision, scope=scope)
+        except PermissionError as e:
+            raise CommandError(f'权限不足: {e}')
+        counts = {}
+        for status in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        self.stderr.write(self.style.SUCCESS(
+            f'回滚完成：新建 {counts.get("created", 0)} 个，更新 {counts.get("updated", 0)} 个，'
+            f'删除 {counts.get("deleted", 0)} 个'
+        ))
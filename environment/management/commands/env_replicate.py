@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from environment.replication import CONFLICT_RULES, PeerClient, ReplicationError, Replicator
+
+
+class Command(BaseCommand):
+    help = '从另一个实例拉取水位之后的环境变量变更并分批应用，中断后从上次提交的位置继续'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--peer', default=settings.ENV_REPLICATION_PEER,
+                            help='对端 environment 应用的地址，如 http://app1:8000/o/app/env/')
+        parser.add_argument('--token', default=settings.ENV_REPLICATION_TOKEN, help='对端的 ENV_BUNDLE_TOKEN')
+        parser.add_argument('--conflict', choices=CONFLICT_RULES, default=settings.ENV_REPLICATION_CONFLICT,
+                            help='本地也修改过的变量：source 对端优先，local 保留本地，newer 按修改时间')
+        parser.add_argument('--scope', choices=['global', 'session', 'db'], default='global',
+                            help='生效范围，db 表示只写数据库')
+        parser.add_argument('--batch', type=int, default=settings.ENV_REPLICATION_BATCH, help='每页条数')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='大于 0 时持续运行，每隔该秒数拉取一次')
+        parser.add_argument('--reset', action='store_true', help='丢弃进度，从对端快照重新全量同步')
+
+    def handle(self, *args, **options):
+        if not options['peer']:
+            raise CommandError('请通过 --peer 或 ENV_REPLICATION_PEER 指定对端地址')
+        replicator = Replicator(
+            PeerClient(options['peer'], options['token']),
+            conflict=options['conflict'],
+            scope=None if options['scope'] == 'db' else options['scope'],
+            batch_size=options['batch'],
+        )
+        if options['reset']:
+            replicator.reset()
+
+        while True:
+            try:
+                summary = replicator.run()
+            except (ReplicationError, PermissionError) as e:
+                if not options['interval']:
+                    raise CommandError(f'复制失败: {e}')
+                self.stderr.write(self.style.ERROR(f'复制失败: {e}'))
+            else:
+                self.stderr.write(self.style.SUCCESS(
+                    f'已同步到对端 r{summary["watermark"]}：{summary["pages"]} 页，'
+                    f'应用 {summary["applied"]} 个，未变 {summary["unchanged"]} 个，'
+                    f'冲突保留本地 {summary["skipped"]} 个'
+                ))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from environment.transfer import EXPORT_FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = '导出所有环境变量为 .env / JSON Lines / shell export 格式（流式输出）'
+    requires_system_checks = []  # 避免加载路由时的输出混入导出内容
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='env')
+        parser.add_argument('--output', '-o', default='-', help='输出文件，默认标准输出')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--raw', action='store_true', help='导出原值，不解析 ${VAR} 引用（用于备份后再导入）')
+
+    def handle(self, *args, **options):
+        lines = export_lines(
+            options['format'],
+            chunk_size=options['chunk_size'],
+            resolved=False if options['raw'] else None,
+        )
+        if options['output'] == '-':
+            sys.stdout.writelines(lines)
+            return
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        self.stderr.write(self.style.SUCCESS(f'已导出到 {options["output"]}'))
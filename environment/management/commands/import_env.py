@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from environment.transfer import import_entries, iter_entries
+
+
+class Command(BaseCommand):
+    help = '从 .env / JSON Lines / shell export 文件增量导入环境变量（在一个事务中边解析边分批 upsert，任一行出错整体回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='导入文件，- 表示标准输入')
+        parser.add_argument('--format', choices=['auto', 'env', 'jsonl', 'shell'], default='auto')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--scope', choices=['global', 'session'], default=None,
+                            help='同时应用到系统；默认只写数据库')
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            source = sys.stdin
+        else:
+            source = open(options['path'], 'r', encoding='utf-8')
+        try:
+            summary = import_entries(
+                iter_entries(source, options['format']),
+                batch_size=options['batch_size'],
+                scope=options['scope'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        except PermissionError as e:
+            raise CommandError(f'权限不足: {e}')
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'导入完成：新建 {summary["created"]} 个，更新 {summary["updated"]} 个，未变 {summary["unchanged"]} 个'
+        ))
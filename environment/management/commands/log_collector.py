@@ -0,0 +1,81 @@
+import logging
+import os
+import signal
+import socketserver
+import threading
+from logging.handlers import MemoryHandler, RotatingFileHandler
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from helloDjango.logpipe import read_records
+
+
+class Command(BaseCommand):
+    help = '日志写入进程：接收所有 worker 转发的日志，批量写入 django.log 并负责轮转（生产环境由 boot 启动并监管）'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.LOG_COLLECTOR_SOCKET)
+        parser.add_argument('--file', default=settings.LOG_FILE)
+
+    def handle(self, *args, **options):
+        address = options['socket']
+        formatter = logging.Formatter(
+            settings.LOGGING['formatters']['verbose']['format'], style='{'
+        )
+        file_handler = RotatingFileHandler(
+            options['file'], maxBytes=settings.LOG_MAX_BYTES, backupCount=settings.LOG_BACKUP_COUNT,
+            encoding='utf-8',
+        )
+        file_handler.setFormatter(formatter)
+        # 攒够 LOG_BATCH_SIZE 条、遇到 ERROR 或每 LOG_FLUSH_INTERVAL 秒写一次盘
+        buffer = MemoryHandler(settings.LOG_BATCH_SIZE, flushLevel=logging.ERROR, target=file_handler)
+
+        # 本进程自己的日志直接写入，不再经过 socket 转发
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(buffer)
+        logging.getLogger('django').handlers = [buffer]
+
+        class RecordHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for data in read_records(self.connection):
+                    buffer.handle(logging.makeLogRecord(data))
+
+        if os.path.exists(address):
+            os.remove(address)
+        # 先收紧 umask 再 bind：socket 文件创建时即为 0600，其他本地用户没有可以连接的窗口
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(address, RecordHandler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+
+        def terminate(signum, frame):
+            raise KeyboardInterrupt
+
+        # boot 停止服务时发送 SIGTERM，与 Ctrl+C 一样写完缓冲区再退出
+        signal.signal(signal.SIGTERM, terminate)
+
+        stop = threading.Event()
+
+        def flush_periodically():
+            while not stop.wait(settings.LOG_FLUSH_INTERVAL):
+                buffer.flush()
+
+        threading.Thread(target=flush_periodically, name='log-flush', daemon=True).start()
+        self.stderr.write(f'日志写入进程已启动: {address} -> {options["file"]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            server.server_close()
+            buffer.flush()
+            file_handler.close()
+            if os.path.exists(address):
+                os.remove(address)
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from helloDjango.staticfiles import nginx_location, nginx_map
+
+
+class Command(BaseCommand):
+    help = '生成 nginx 静态文件配置（预压缩副本 + 哈希文件名 immutable 缓存），用于 nginx-demo.conf'
+    requires_system_checks = []  # 避免加载路由时的输出混入生成的配置
+
+    def add_arguments(self, parser):
+        parser.add_argument('--location', default=settings.STATIC_URL, help='URL 前缀，默认 STATIC_URL')
+        parser.add_argument('--alias', default=settings.STATIC_ROOT, help='宿主机上 collectstatic 输出目录，默认 STATIC_ROOT')
+        parser.add_argument('--no-map', action='store_true', help='不输出 map（同一 nginx 中已有其他应用输出过）')
+
+    def handle(self, *args, **options):
+        if not options['no_map']:
+            self.stdout.write('# 放在 server 之外（http 上下文），所有应用共用')
+            self.stdout.write(nginx_map())
+            self.stdout.write('')
+        self.stdout.write('# 放在 server 中')
+        self.stdout.write(nginx_location(options['location'], options['alias']))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from environment.watcher import EnvFileSync, collect, make_watcher
+
+
+class Command(BaseCommand):
+    help = '监听 /etc/environment 和 profile.d/custom_*.sh，只把变化的键同步到数据库'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debounce', type=float, default=0.5,
+                            help='合并连续写入的等待秒数')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='不支持 inotify 时的轮询间隔秒数')
+        parser.add_argument('--force-poll', action='store_true', help='强制使用轮询')
+        parser.add_argument('--sync-on-start', action='store_true',
+                            help='启动时先把系统文件中的全部变量同步一次')
+
+    def handle(self, *args, **options):
+        sync = EnvFileSync()
+        baseline = sync.load()
+        if options['sync_on_start']:
+            results, _ = sync.apply(baseline, [])
+            self._report('启动同步', results, 0)
+
+        watcher, mode = make_watcher(sync, options['poll_interval'], options['force_poll'])
+        self.stdout.write(f'开始监听（{mode}）: {sync.env_file}, {sync.profile_dir}/custom_*.sh')
+        try:
+            while True:
+                paths = collect(watcher, options['debounce'])
+                sets, deleted = sync.changes_for(paths)
+                if not sets and not deleted:
+                    continue
+                results, removed = sync.apply(sets, deleted)
+                self._report(', '.join(sorted(paths)), results, removed)
+                connection.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def _report(self, source, results, removed):
+        changed = sum(1 for status in results.values() if status != 'unchanged')
+        self.stdout.write(f'{source}: 更新 {changed} 个，删除 {removed} 个')
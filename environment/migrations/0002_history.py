@@ -0,0 +1,59 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('environment', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvironmentChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100)),
+                ('operation', models.CharField(choices=[('set', '设置'), ('delete', '删除')], default='set', max_length=10)),
+                ('value', models.TextField(blank=True, null=True)),
+                ('scope', models.CharField(default='session', max_length=20)),
+                ('origin', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '环境变量变更',
+                'verbose_name_plural': '环境变量变更',
+            },
+        ),
+        migrations.CreateModel(
+            name='VariableRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(db_index=True, max_length=100)),
+                ('operation', models.CharField(choices=[('set', '设置'), ('delete', '删除')], default='set', max_length=10)),
+                ('payload', models.BinaryField(null=True)),
+                ('compressed', models.BooleanField(default=False)),
+                ('description', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': '环境变量历史版本',
+                'verbose_name_plural': '环境变量历史版本',
+            },
+        ),
+        migrations.CreateModel(
+            name='VariableSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revision_id', models.BigIntegerField(db_index=True)),
+                ('count', models.IntegerField(default=0)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': '环境变量快照',
+                'verbose_name_plural': '环境变量快照',
+            },
+        ),
+    ]
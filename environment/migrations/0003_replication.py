@@ -0,0 +1,36 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('environment', '0002_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplicationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peer', models.CharField(max_length=200, unique=True)),
+                ('watermark', models.BigIntegerField(blank=True, null=True)),
+                ('snapshot_revision', models.BigIntegerField(blank=True, null=True)),
+                ('snapshot_after', models.CharField(blank=True, max_length=100)),
+                ('applied', models.BigIntegerField(default=0)),
+                ('skipped', models.BigIntegerField(default=0)),
+                ('last_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': '环境变量复制进度',
+                'verbose_name_plural': '环境变量复制进度',
+            },
+        ),
+        migrations.AddField(
+            model_name='variablerevision',
+            name='source',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2.23 on 2026-10-17 22:54
+
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# 迁移编写时 environment.models 中的存储规则，复制到这里，之后修改模型中的实现不影响本迁移
+def pack_value(value):
+    raw = value.encode()
+    if len(raw) > getattr(settings, 'ENV_VALUE_COMPRESS_THRESHOLD', 4096):
+        data = zlib.compress(raw)
+        if len(data) < len(raw):
+            return value[:getattr(settings, 'ENV_VALUE_PREVIEW_CHARS', 200)], data, hashlib.md5(raw).hexdigest(), len(value)
+    return value, None, hashlib.md5(raw).hexdigest(), len(value)
+
+
+def unpack_value(stored, data):
+    if data is None:
+        return stored
+    return zlib.decompress(bytes(data)).decode()
+
+
+def pack_existing(apps, schema_editor):
+    """已有的行：计算哈希和长度，大值改为压缩存储"""
+    Variable = apps.get_model('environment', 'EnvironmentVariable')
+    batch = []
+    for variable in Variable.objects.only('id', 'value').iterator(chunk_size=500):
+        variable.value, variable.value_data, variable.value_hash, variable.value_length = pack_value(variable.value)
+        batch.append(variable)
+        if len(batch) >= 500:
+            Variable.objects.bulk_update(batch, ['value', 'value_data', 'value_hash', 'value_length'])
+            batch = []
+    if batch:
+        Variable.objects.bulk_update(batch, ['value', 'value_data', 'value_hash', 'value_length'])
+
+
+def unpack_existing(apps, schema_editor):
+    """回退前把压缩存储的值还原到 value 列"""
+    Variable = apps.get_model('environment', 'EnvironmentVariable')
+    rows = Variable.objects.filter(value_data__isnull=False).only('id', 'value', 'value_data')
+    for variable in rows.iterator(chunk_size=500):
+        variable.value = unpack_value(variable.value, variable.value_data)
+        variable.save(update_fields=['value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('environment', '0003_replication'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='environmentvariable',
+            name='value_data',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='environmentvariable',
+            name='value_hash',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='environmentvariable',
+            name='value_length',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(pack_existing, unpack_existing),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.23 on 2026-10-17 23:25
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres import operations
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+import environment.search
+
+
+class TrigramExtension(operations.TrigramExtension):
+    """Django 4.2 回退时不检查数据库类型，SQLite 上查询 pg_extension 会出错"""
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('environment', '0004_value_storage'),
+    ]
+
+    operations = [
+        # 非 PostgreSQL 时不执行任何操作
+        TrigramExtension(),
+        # 之前由 post_migrate 回调以同样的名称创建，交给下面的 AddIndex 重新创建并记录在迁移中
+        migrations.RunSQL(
+            'DROP INDEX IF EXISTS environment_key_trgm;'
+            'DROP INDEX IF EXISTS environment_value_trgm;'
+            'DROP INDEX IF EXISTS environment_description_fts;',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='environmentvariable',
+            index=environment.search.SearchIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('key', models.TextField())), name='gin_trgm_ops'), name='environment_key_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='environmentvariable',
+            index=environment.search.SearchIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('value', models.TextField())), name='gin_trgm_ops'), name='environment_value_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='environmentvariable',
+            index=environment.search.SearchIndex(django.contrib.postgres.search.SearchVector('description', config='simple'), name='environment_description_fts'),
+        ),
+    ]
@@ -1,145 +1,439 @@
+import hashlib
+import logging
 import os
 import subprocess
-from django.db import models
+import zlib
+from django.conf import settings
+from django.contrib.postgres.indexes import OpClass
+from django.db import models, transaction
+from django.db.models.functions import Cast, Substr, Upper
+
+from .envfile import EnvFileWriter
+from .probe import probe
+from .search import SearchIndex, description_vector
+from .signals import changed_on_commit
+
+logger = logging.getLogger(__name__)
+
+
+def value_hash(value):
+    """值的内容哈希（md5），与系统环境、其他实例比较时不需要读取值本身"""
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def pack_value(value):
+    """写库时的存储形式，返回 (value 列, value_data 列, 哈希, 长度)
+
+    超过 ENV_VALUE_COMPRESS_THRESHOLD 字节且压缩有收益时，完整值以 zlib 压缩存入 value_data，
+    value 列只保留前 ENV_VALUE_PREVIEW_CHARS 个字符（列表预览和搜索使用）。
+    """
+    raw = value.encode()
+    if len(raw) > settings.ENV_VALUE_COMPRESS_THRESHOLD:
+        data = zlib.compress(raw)
+        if len(data) < len(raw):
+            return value[:settings.ENV_VALUE_PREVIEW_CHARS], data, hashlib.md5(raw).hexdigest(), len(value)
+    return value, None, hashlib.md5(raw).hexdigest(), len(value)
+
+
+def unpack_value(stored, data):
+    if data is None:
+        return stored
+    return zlib.decompress(bytes(data)).decode()  # PostgreSQL 返回 memoryview
+
+
+class EnvironmentVariableQuerySet(models.QuerySet):
+
+    def with_preview(self):
+        """列表和搜索用：不读取完整值，只在数据库中截取前缀（value_preview），长度取 value_length"""
+        return self.defer('value', 'value_data').annotate(
+            value_preview=Substr('value', 1, settings.ENV_VALUE_PREVIEW_CHARS)
+        )
+
+    def values_full(self, *fields, chunk_size=2000):
+        """按 values_list 逐行返回，其中 value 为完整值（压缩存储的值在这里解压）"""
+        index = fields.index('value')
+        for row in self.values_list(*fields, 'value_data').iterator(chunk_size=chunk_size):
+            row = list(row)
+            data = row.pop()
+            row[index] = unpack_value(row[index], data)
+            yield tuple(row)
 
 
 class EnvironmentVariable(models.Model):
     key = models.CharField(max_length=100, unique=True)
+    # 完整值；压缩存储时只是前缀，完整值在 value_data 中，读取模型实例时自动还原
     value = models.TextField()
+    value_data = models.BinaryField(null=True, blank=True)
+    value_hash = models.CharField(max_length=32, blank=True)
+    value_length = models.IntegerField(default=0)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = EnvironmentVariableQuerySet.as_manager()
+
+    STORAGE_FIELDS = ['value', 'value_data', 'value_hash', 'value_length']
+
     class Meta:
         verbose_name = "环境变量"
         verbose_name_plural = "环境变量"
+        # 搜索索引（只在 PostgreSQL 上创建）：icontains 生成 UPPER(列::text) LIKE UPPER(...)，按同样的表达式建 trigram 索引
+        indexes = [
+            SearchIndex(OpClass(Upper(Cast('key', models.TextField())), name='gin_trgm_ops'), name='environment_key_trgm'),
+            SearchIndex(OpClass(Upper(Cast('value', models.TextField())), name='gin_trgm_ops'), name='environment_value_trgm'),
+            SearchIndex(description_vector(), name='environment_description_fts'),
+        ]
 
     def __str__(self):
         return f"{self.key}={self.value}"
 
     @classmethod
-    def load_from_system(cls):
-        """从系统环境变量加载到数据库"""
-        for key, value in os.environ.items():
-            if not key.startswith('_'):  # 跳过一些系统变量
-                obj, created = cls.objects.get_or_create(
-                    key=key,
-                    defaults={'value': value, 'description': f'系统环境变量: {key}'}
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if instance.__dict__.get('value_data') is not None:
+            instance.value = unpack_value(instance.value, instance.value_data)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # 延迟加载 value 时一并读取 value_data，否则压缩存储的值只能拿到前缀
+        if fields is not None and 'value' in fields and 'value_data' not in fields:
+            fields = [*fields, 'value_data']
+        super().refresh_from_db(using, fields, **kwargs)
+
+    def save(self, *args, **kwargs):
+        full = self.value
+        self.value, self.value_data, self.value_hash, self.value_length = pack_value(full)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'value' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *self.STORAGE_FIELDS}
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            self.value = full
+
+    def packed(self):
+        """bulk_create 用的写库副本（bulk_create 不经过 save），原对象保留完整值"""
+        stored, data, digest, length = pack_value(self.value)
+        return type(self)(
+            key=self.key, value=stored, value_data=data, value_hash=digest, value_length=length,
+            description=self.description,
+        )
+
+    @classmethod
+    def load_from_system(cls, prune=False, batch_size=500):
+        """从系统环境变量加载到数据库（批量对账）
+
+        一次查询读出库中全部键值，在内存中划分新增/变更/未变/缺失四类，
+        新增和变更通过一条 upsert 写入；未变的行不做任何写入，
+        updated_at 只在值真正变化时刷新。prune=True 时删除系统中已不存在的变量。
+        返回各类数量的汇总字典。
+        """
+        from .history import record_revisions
+
+        system_env = {
+            key: value for key, value in os.environ.items()
+            if not key.startswith('_')  # 跳过一些系统变量
+        }
+
+        with transaction.atomic():
+            # 按哈希比较，不读取库中的值
+            existing = dict(cls.objects.values_list('key', 'value_hash'))
+
+            inserted = [key for key in system_env if key not in existing]
+            changed = [
+                key for key in system_env
+                if key in existing and existing[key] != value_hash(system_env[key])
+            ]
+            removed = [key for key in existing if key not in system_env]
+
+            upserts = [
+                cls(key=key, value=system_env[key], description=f'系统环境变量: {key}')
+                for key in inserted + changed
+            ]
+            if upserts:
+                # 冲突时只覆盖值和更新时间，保留已有描述
+                cls.objects.bulk_create(
+                    [var.packed() for var in upserts],
+                    batch_size=batch_size,
+                    update_conflicts=True,
+                    unique_fields=['key'],
+                    update_fields=[*cls.STORAGE_FIELDS, 'updated_at'],
                 )
-                if not created:
-                    obj.value = value
-                    obj.save()
+            if prune and removed:
+                cls.objects.filter(key__in=removed).delete()
+
+            # 历史版本：已有变量的描述未改动，记为 None
+            revisions = record_revisions(
+                [(var.key, var.value, var.description) for var in upserts[:len(inserted)]]
+                + [(key, system_env[key], None) for key in changed]
+                + ([(key, None, None) for key in removed] if prune else [])
+            )
+            if revisions:
+                changed_on_commit(cls)
+
+        return {
+            'inserted': len(inserted),
+            'changed': len(changed),
+            'unchanged': len(system_env) - len(inserted) - len(changed),
+            'removed': len(removed) if prune else 0,
+            'missing': len(removed),
+        }
 
-    def apply_to_system(self, scope='global'):
-        """将变量应用到系统 - 修正版本"""
+    @classmethod
+    def bulk_apply(cls, entries, scope='global', batch_size=500, removed_keys=(), source=''):
+        """批量写入并应用一组变量
+
+        entries 为 (key, value, description) 序列，description 为 None 时保留原描述，
+        同一个键出现多次时以最后一次为准；removed_keys 中的变量被删除。
+        启用插值时写入系统的是解析后的值，引用了这些变量的其他变量一并更新。
+        数据库在一个事务内 upsert / 删除并记录历史版本，
+        有变化的变量一次性写入系统文件（scope 为 None 时只写数据库）；
+        应用失败时回滚并抛出 PermissionError。source 为复制来源实例，记录在历史版本中。
+        返回 {key: 'created' | 'updated' | 'unchanged' | 'deleted'}。
+        """
+        from .history import record_revisions
+        from .propagation import record_changes
+
+        entries = {key: (value, description) for key, value, description in entries}
+        removed_keys = [key for key in removed_keys if key not in entries]
+        results = {}
+        with transaction.atomic():
+            # 按哈希判断是否变化，不读取库中的值
+            existing = {
+                key: (digest, description)
+                for key, digest, description in cls.objects.filter(
+                    key__in=list(entries) + removed_keys
+                ).values_list('key', 'value_hash', 'description')
+            }
+
+            upserts = []
+            for key, (value, description) in entries.items():
+                if key in existing:
+                    if description is None:
+                        description = existing[key][1]
+                    if (value_hash(value), description) == existing[key]:
+                        results[key] = 'unchanged'
+                        continue
+                    results[key] = 'updated'
+                else:
+                    results[key] = 'created'
+                upserts.append(cls(key=key, value=value, description=description or ''))
+            deleted = [key for key in removed_keys if key in existing]
+            # 先计算写入系统的值，启用插值时循环引用在写库前即报错
+            values = cls.system_values(upserts, deleted) if upserts or deleted else {}
+
+            if upserts:
+                cls.objects.bulk_create(
+                    [var.packed() for var in upserts],
+                    batch_size=batch_size,
+                    update_conflicts=True,
+                    unique_fields=['key'],
+                    update_fields=[*cls.STORAGE_FIELDS, 'description', 'updated_at'],
+                )
+            if deleted:
+                cls.objects.filter(key__in=deleted).delete()
+                results.update((key, 'deleted') for key in deleted)
+            if upserts or deleted:
+                record_revisions(
+                    [(var.key, var.value, var.description) for var in upserts]
+                    + [(key, None, None) for key in deleted],
+                    source=source,
+                )
+                changed_on_commit(cls)
+                if scope is not None:
+                    if not cls.apply_batch_to_system(upserts, deleted, scope=scope, values=values):
+                        raise PermissionError("需要sudo权限来修改系统环境变量文件")
+                    # 通知其他 worker 同步进程环境（随事务一起提交）
+                    record_changes(list(values.items()), scope=scope)
+        return results
+
+    @classmethod
+    def system_values(cls, variables=(), removed_keys=()):
+        """应用到系统时实际写入的值 {key: value}，删除的键为 None
+
+        启用 ENV_INTERPOLATION 时为解析 ${VAR} 后的值，
+        并包含所有（直接或间接）引用了这些变量的其他变量。
+        """
+        if not settings.ENV_INTERPOLATION:
+            values = {var.key: var.value for var in variables}
+            values.update((key, None) for key in removed_keys)
+            return values
+        from .interpolation import get_resolver
+        return get_resolver().preview({var.key: var.value for var in variables}, removed_keys)
+
+    def apply_to_system(self, scope='global', values=None):
+        """将变量应用到系统 - 修正版本
+
+        values 为预先计算的 system_values 结果（在 IO 线程中调用时避免查库）。
+        """
         try:
+            if values is None:
+                values = self.system_values([self])
             if scope == 'global':
-                success = self._set_global_env()
+                success = self._set_global_env(values)
                 if success:
                     # 设置当前进程的环境变量（立即生效）
-                    os.environ[self.key] = self.value
+                    self._set_process_env(values)
                     return True
                 return False
             elif scope == 'session':
                 # 只设置当前会话环境变量
-                os.environ[self.key] = self.value
+                self._set_process_env(values)
                 return True
                 
-        except Exception as e:
-            print(f"应用环境变量时出错: {e}")
+        except Exception:
+            logger.exception('应用环境变量 %s 时出错', self.key, extra={'env_key': self.key, 'scope': scope})
             return False
 
-    def _set_global_env(self):
+    @staticmethod
+    def _set_process_env(values):
+        for key, value in values.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def _set_global_env(self, values=None):
         """设置全局环境变量"""
         try:
-            # 方法1: 写入 /etc/environment
-            env_file = '/etc/environment'
-            if os.access(env_file, os.W_OK):
-                self._update_env_file(env_file)
-
-            # 方法2: 创建单独的配置文件
-            profile_dir = '/etc/profile.d'
-            if os.path.exists(profile_dir) and os.access(profile_dir, os.W_OK):
-                self._create_profile_script(profile_dir)
+            # 写入 /etc/environment 和 profile.d 合并脚本
+            writer = EnvFileWriter()
+            for key, value in (values or {self.key: self.value}).items():
+                if value is None:
+                    writer.unset(key)
+                else:
+                    writer.set(key, value)
+            writer.commit()
 
             # 立即生效（可选）
             self._reload_environment()
 
         except PermissionError:
-            # 需要sudo权限
+            # 需要sudo权限，权限可能已变化，下次请求重新探测
+            probe.invalidate()
             return False
         return True
 
-    def _update_env_file(self, file_path):
-        """更新环境变量文件 - 修正版本"""
+    @classmethod
+    def apply_batch_to_system(cls, variables=(), removed_keys=(), scope='global', values=None):
+        """批量应用到系统：一次加锁、每个系统文件只解析和写入一次
+
+        values 为预先计算的 system_values 结果，省略时按 variables / removed_keys 计算。
+        """
+        if values is None:
+            values = cls.system_values(variables, removed_keys)
         try:
-            # 备份原文件
-            if os.path.exists(file_path):
-                import shutil
-                backup_path = f"{file_path}.bak"
-                shutil.copy2(file_path, backup_path)
-            
-            lines = []
-            if os.path.exists(file_path):
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-            
-            # 查找并更新或添加变量
-            found = False
-            new_lines = []
-            for line in lines:
-                stripped_line = line.strip()
-                # 跳过空行和注释
-                if not stripped_line or stripped_line.startswith('#'):
-                    new_lines.append(line)
-                    continue
-                
-                # 解析键值对
-                if '=' in stripped_line:
-                    current_key = stripped_line.split('=', 1)[0].strip()
-                    if current_key == self.key:
-                        new_lines.append(f'{self.key}="{self.value}"\n')
-                        found = True
-                        continue
-                
-                new_lines.append(line)
-            
-            if not found:
-                new_lines.append(f'{self.key}="{self.value}"\n')
-            
-            # 写入文件
-            with open(file_path, 'w') as f:
-                f.writelines(new_lines)
-                
-            # 设置正确的文件权限
-            os.chmod(file_path, 0o644)
-            
+            if scope == 'global':
+                writer = EnvFileWriter()
+                for key, value in values.items():
+                    if value is None:
+                        writer.unset(key)
+                    else:
+                        writer.set(key, value)
+                writer.commit()
+                logger.info(
+                    '%d 个环境变量已更新，需要重新登录或重启服务才能生效', len(values),
+                    extra={'env_keys': sorted(values), 'scope': scope},
+                )
+            cls._set_process_env(values)
+            return True
         except PermissionError:
-            raise PermissionError("需要sudo权限来修改系统环境变量文件")
-        except Exception as e:
-            # 恢复备份
-            if os.path.exists(backup_path):
-                shutil.copy2(backup_path, file_path)
-            raise e
-
-    def _create_profile_script(self, profile_dir):
-        """创建profile脚本"""
-        script_path = os.path.join(profile_dir, f'custom_{self.key}.sh')
-        script_content = f'export {self.key}="{self.value}"\n'
-
-        with open(script_path, 'w') as f:
-            f.write(script_content)
-        os.chmod(script_path, 0o644)  # 设置可读权限
+            probe.invalidate()
+            return False
 
     def _reload_environment(self):
         """重新加载环境变量 - 修正版本"""
         try:
             # 方法1: 通过启动新的shell会话重新加载
             # 这只是一个示意，实际全局环境变量需要用户重新登录才能生效
-            print(f"环境变量 {self.key} 已更新，需要重新登录或重启服务才能生效")
+            logger.info('环境变量 %s 已更新，需要重新登录或重启服务才能生效', self.key, extra={'env_key': self.key})
             
             # 方法2: 通知相关服务重新加载配置（如果有的话）
             # 例如：重启某些服务或者发送信号
             
-        except Exception as e:
-            print(f"重新加载环境变量时出错: {e}")
\ No newline at end of file
+        except Exception:
+            logger.exception('重新加载环境变量 %s 时出错', self.key, extra={'env_key': self.key})
+
+
+class EnvironmentChange(models.Model):
+    """已应用到进程环境的变更日志，自增 id 即全局递增的版本号"""
+    OPERATION_CHOICES = [
+        ('set', '设置'),
+        ('delete', '删除'),
+    ]
+
+    key = models.CharField(max_length=100)
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES, default='set')
+    value = models.TextField(null=True, blank=True)
+    scope = models.CharField(max_length=20, default='session')
+    origin = models.CharField(max_length=100, blank=True)  # 产生变更的 主机名:进程号
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "环境变量变更"
+        verbose_name_plural = "环境变量变更"
+
+    def __str__(self):
+        return f"#{self.pk} {self.operation} {self.key}"
+
+
+class VariableRevision(models.Model):
+    """单个变量的一次变更（只记录变化的键），自增 id 即历史版本号
+
+    value 超过 ENV_HISTORY_COMPRESS_THRESHOLD 字节时以 zlib 压缩存储；
+    description 为 None 表示沿用上一版本的描述；source 为复制来源实例，本地修改为空。
+    """
+    OPERATION_CHOICES = EnvironmentChange.OPERATION_CHOICES
+
+    key = models.CharField(max_length=100, db_index=True)
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES, default='set')
+    payload = models.BinaryField(null=True)
+    compressed = models.BooleanField(default=False)
+    description = models.TextField(null=True, blank=True)
+    source = models.CharField(max_length=200, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "环境变量历史版本"
+        verbose_name_plural = "环境变量历史版本"
+
+    def __str__(self):
+        return f"r{self.pk} {self.operation} {self.key}"
+
+
+class VariableSnapshot(models.Model):
+    """截至 revision_id（含）的全表快照，压缩后的 JSON {key: [value, description]}"""
+    revision_id = models.BigIntegerField(db_index=True)
+    count = models.IntegerField(default=0)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "环境变量快照"
+        verbose_name_plural = "环境变量快照"
+
+    def __str__(self):
+        return f"快照 r{self.revision_id} ({self.count})"
+
+
+class ReplicationState(models.Model):
+    """从某个对端实例拉取变更的进度（manage.py env_replicate）
+
+    watermark 为已应用的对端最新历史版本号，为空表示还未完成首次全量同步；
+    首次同步按对端快照分页进行，snapshot_revision / snapshot_after 记录中断时的位置。
+    """
+    peer = models.CharField(max_length=200, unique=True)
+    watermark = models.BigIntegerField(null=True, blank=True)
+    snapshot_revision = models.BigIntegerField(null=True, blank=True)
+    snapshot_after = models.CharField(max_length=100, blank=True)
+    applied = models.BigIntegerField(default=0)
+    skipped = models.BigIntegerField(default=0)
+    last_sync_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "环境变量复制进度"
+        verbose_name_plural = "环境变量复制进度"
+
+    def __str__(self):
+        return f"{self.peer} @ r{self.watermark}"
@@ -0,0 +1,188 @@
+import base64
+import hashlib
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Q
+
+from .fragments import table_version
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values, direction):
+    raw = json.dumps({'v': values, 'd': direction}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """解析 URL 中的游标，返回 (values, direction)"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        values, direction = data['v'], data['d']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor(token)
+    if direction not in ('next', 'prev') or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(token)
+    return values, direction
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, per_page, fields):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.per_page = per_page
+        self.fields = fields
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _cursor(self, obj, direction):
+        return encode_cursor([getattr(obj, field) for field in self.fields], direction)
+
+    @property
+    def next_cursor(self):
+        if self.has_next:
+            return self._cursor(self.object_list[-1], 'next')
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous:
+            return self._cursor(self.object_list[0], 'prev')
+
+
+class KeysetPaginator:
+    """基于排序键的游标分页
+
+    ordering 的最后一个字段必须唯一（默认只按唯一的 key 排序）。
+    WHERE key > last_key ORDER BY key LIMIT n+1，任意深度的页都只走一次索引范围扫描，
+    不需要 OFFSET，也不需要 COUNT(*)；多字段排序（如搜索时的 -rank, key）按元组比较展开。
+    """
+
+    def __init__(self, queryset, per_page, ordering=('key',)):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = list(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+
+    def _seek(self, values, reverse):
+        """构造“排在游标之后”的条件：(a, b) > (x, y) 即 a > x OR (a = x AND b > y)"""
+        condition = Q()
+        for i, ordering in enumerate(self.ordering):
+            descending = ordering.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            term = Q(**{f'{self.fields[i]}__{lookup}': values[i]})
+            for field, value in zip(self.fields[:i], values[:i]):
+                term &= Q(**{field: value})
+            condition |= term
+        return condition
+
+    def _prepare(self, cursor):
+        if cursor:
+            values, direction = decode_cursor(cursor, len(self.fields))
+        else:
+            values, direction = None, 'next'
+
+        reverse = direction == 'prev'
+        if reverse:
+            order_by = [f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering]
+        else:
+            order_by = self.ordering
+        qs = self.queryset.order_by(*order_by)
+        if values is not None:
+            qs = qs.filter(self._seek(values, reverse))
+        return qs[:self.per_page + 1], values, reverse
+
+    def _build(self, rows, values, reverse):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if not reverse:
+            return KeysetPage(rows, has_more, values is not None, self.per_page, self.fields)
+        rows.reverse()
+        return KeysetPage(rows, True, has_more, self.per_page, self.fields)
+
+    def page(self, cursor=None):
+        qs, values, reverse = self._prepare(cursor)
+        return self._build(list(qs), values, reverse)
+
+    async def apage(self, cursor=None):
+        qs, values, reverse = self._prepare(cursor)
+        return self._build([obj async for obj in qs], values, reverse)
+
+
+def _estimate_table_rows(model, using):
+    """PostgreSQL 统计信息中的行数估算，不扫描表"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+def _count_cache_key(queryset, search, version):
+    digest = hashlib.md5(search.encode()).hexdigest()
+    return f'environment:count:{queryset.model._meta.db_table}:{version}:{digest}'
+
+
+def cached_count(queryset, search='', version=None):
+    """缓存的总数，返回 (count, estimated)
+
+    无过滤条件且表足够大时在 PostgreSQL 上直接使用统计估算值，
+    其余情况执行一次 COUNT(*) 并缓存 ENV_COUNT_CACHE_TTL 秒。
+    缓存键包含表版本号（version 为空时读取当前版本），变量有修改后不会再返回旧的总数。
+    """
+    if version is None:
+        version = table_version()
+    cache_key = _count_cache_key(queryset, search, version)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    result = None
+    using = queryset.db
+    if not search and connections[using].vendor == 'postgresql':
+        estimate = _estimate_table_rows(queryset.model, using)
+        if estimate >= settings.ENV_COUNT_ESTIMATE_THRESHOLD:
+            result = (estimate, True)
+    if result is None:
+        result = (queryset.count(), False)
+    cache.set(cache_key, result, settings.ENV_COUNT_CACHE_TTL)
+    return result
+
+
+async def acached_count(queryset, search='', version=None):
+    """cached_count 的异步版本，COUNT(*) 走异步 ORM"""
+    if version is None:
+        version = await sync_to_async(table_version)()
+    cache_key = _count_cache_key(queryset, search, version)
+    cached = cache.get(cache_key)  # 本地内存缓存，直接读取不会阻塞
+    if cached is not None:
+        return cached
+
+    result = None
+    using = queryset.db
+    if not search and connections[using].vendor == 'postgresql':
+        estimate = await sync_to_async(_estimate_table_rows)(queryset.model, using)
+        if estimate >= settings.ENV_COUNT_ESTIMATE_THRESHOLD:
+            result = (estimate, True)
+    if result is None:
+        result = (await queryset.acount(), False)
+    cache.set(cache_key, result, settings.ENV_COUNT_CACHE_TTL)
+    return result
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+from django.conf import settings
+from helloDjango.metrics import timer
+
+
+def is_writable(path):
+    """判断路径是否可写；文件不存在时检查其所在目录"""
+    target = path if os.path.exists(path) else os.path.dirname(path)
+    if not target or not os.access(target, os.W_OK):
+        return False
+    try:
+        # 只读挂载时 os.access 仍可能返回 True
+        return not os.statvfs(target).f_flag & os.ST_RDONLY
+    except OSError:
+        return False
+
+
+class CapabilityProbe:
+    """系统文件写权限探测（按进程缓存）
+
+    只通过 os.access / os.statvfs 判断可写性，不创建任何文件；
+    按目标分别记录，与写入器一致：/etc/environment 和（存在时）profile.d 中任一可写即允许修改，
+    不可写的目标由写入器跳过。
+    结果在 TTL 内复用，写入失败（PermissionError）后调用 invalidate() 强制重新探测。
+    """
+
+    def __init__(self, ttl=None):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._result = None
+        self._targets = {}
+        self._checked_at = None
+        self._duration = 0.0
+        self._probe_count = 0
+        self._invalidations = 0
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'ENV_PROBE_TTL', 300)
+
+    @staticmethod
+    def _targets_to_check():
+        targets = [getattr(settings, 'ENV_SYSTEM_FILE', '/etc/environment')]
+        profile_dir = getattr(settings, 'ENV_PROFILE_DIR', '/etc/profile.d')
+        if os.path.isdir(profile_dir):  # 目录不存在时写入器不写 profile 脚本
+            targets.append(profile_dir)
+        return targets
+
+    def _expired(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.ttl
+
+    def _probe(self):
+        started = time.monotonic()
+        with timer('file_io_time'):
+            targets = {path: is_writable(path) for path in self._targets_to_check()}
+        self._targets = targets
+        self._result = any(targets.values())
+        self._checked_at = time.monotonic()
+        self._duration = self._checked_at - started
+        self._probe_count += 1
+
+    def is_writable(self):
+        """返回系统文件是否可写，必要时重新探测"""
+        if self._expired():
+            with self._lock:
+                if self._expired():
+                    self._probe()
+        return self._result
+
+    def invalidate(self):
+        """写入失败后调用，下一次检查时重新探测"""
+        with self._lock:
+            self._checked_at = None
+            self._invalidations += 1
+
+    def state(self):
+        """探测状态和耗时，供调试和监控使用"""
+        age = None if self._checked_at is None else time.monotonic() - self._checked_at
+        return {
+            'pid': os.getpid(),
+            'writable': self._result,
+            'targets': dict(self._targets),
+            'ttl': self.ttl,
+            'age_seconds': None if age is None else round(age, 3),
+            'last_probe_ms': round(self._duration * 1000, 3),
+            'probe_count': self._probe_count,
+            'invalidations': self._invalidations,
+        }
+
+
+probe = CapabilityProbe()
@@ -0,0 +1,212 @@
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .logtail import GapTracker
+from .models import EnvironmentChange
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'environment_changes'
+PRUNE_INTERVAL = 3600  # 每个 worker 清理过期变更日志的间隔秒数
+
+
+def origin():
+    """当前进程标识 主机名:进程号（在调用时计算，fork 后的子进程各不相同）"""
+    return f'{socket.gethostname()}:{os.getpid()}'[:100]
+
+
+def record_changes(changes, scope='session', using='default'):
+    """记录一批已在本进程生效的变更并通知其他 worker
+
+    changes 为 [(key, value)]，value 为 None 表示删除。在事务中调用时，
+    PostgreSQL 的 NOTIFY 会在提交后才发出，回滚时其他 worker 不会看到这批变更。
+    """
+    rows = EnvironmentChange.objects.using(using).bulk_create([
+        EnvironmentChange(
+            key=key,
+            operation='set' if value is not None else 'delete',
+            value=value,
+            scope=scope,
+            origin=origin(),
+        )
+        for key, value in changes
+    ])
+    db = connections[using]
+    if rows and db.vendor == 'postgresql':
+        with db.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, origin()])
+    return rows
+
+
+def prune_changes(days=None):
+    """删除 days 天前的变更日志，每个键的最新一条始终保留（新 worker 启动时据此回放）"""
+    days = settings.ENV_CHANGE_RETENTION_DAYS if days is None else days
+    latest = EnvironmentChange.objects.values('key').annotate(last_id=Max('id')).values('last_id')
+    deleted, _ = EnvironmentChange.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=days),
+    ).exclude(id__in=latest).delete()
+    return deleted
+
+
+class Propagator:
+    """把其他 worker 的环境变量变更同步到本进程的 os.environ
+
+    每个进程记录已应用的版本号（变更日志的最大 id），每次只拉取并应用更新的增量；
+    id 之间的空洞（尚未提交的事务）继续跟踪，晚提交的变更同样会被应用。
+    PostgreSQL 上通过 LISTEN/NOTIFY 即时唤醒，其他数据库按 ENV_PROPAGATION_POLL 秒轮询。
+    """
+
+    def __init__(self):
+        self.tail = GapTracker()
+        self.mode = None
+        self._pruned_at = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {
+            'syncs': 0,
+            'applied': 0,
+            'remote_applied': 0,
+            'last_lag_ms': None,
+            'max_lag_ms': 0.0,
+            'total_lag_ms': 0.0,
+            'last_sync_at': None,
+            'late_applied': 0,
+            'errors': 0,
+        }
+
+    @property
+    def version(self):
+        return self.tail.position
+
+    def bootstrap(self):
+        """启动时按每个键的最新变更回放，使新启动的 worker 与其他 worker 一致"""
+        with self._lock:
+            # 先确定水位再回放：回放期间提交的变更留给下一次 sync
+            self.tail.start(EnvironmentChange.objects.all())
+            latest = EnvironmentChange.objects.filter(id__lte=self.tail.position) \
+                .values('key').annotate(last_id=Max('id')).values('last_id')
+            for change in EnvironmentChange.objects.filter(id__in=latest).order_by('id'):
+                self._apply(change)
+
+    @staticmethod
+    def _apply(change):
+        if change.operation == 'delete':
+            os.environ.pop(change.key, None)
+        else:
+            os.environ[change.key] = change.value or ''
+
+    def sync(self):
+        """拉取并应用 version 之后的增量，返回应用的条数"""
+        with self._lock:
+            changes = list(EnvironmentChange.objects.filter(self.tail.pending()).order_by('id'))
+            now = timezone.now()
+            current = origin()
+            for change in changes:
+                self._apply(change)
+                if self.tail.seen(change.pk):
+                    self._stats['late_applied'] += 1
+                if change.origin != current:
+                    lag = (now - change.created_at).total_seconds() * 1000
+                    self._stats['remote_applied'] += 1
+                    self._stats['last_lag_ms'] = round(lag, 3)
+                    self._stats['max_lag_ms'] = max(self._stats['max_lag_ms'], round(lag, 3))
+                    self._stats['total_lag_ms'] += lag
+            self._stats['syncs'] += 1
+            self._stats['applied'] += len(changes)
+            self._stats['last_sync_at'] = now.isoformat()
+        return len(changes)
+
+    def state(self):
+        remote = self._stats['remote_applied']
+        return {
+            'origin': origin(),
+            'version': self.version,
+            'gaps': self.tail.gaps,
+            'mode': self.mode,
+            'running': bool(self._thread and self._thread.is_alive()),
+            **{k: v for k, v in self._stats.items() if k != 'total_lag_ms'},
+            'avg_lag_ms': round(self._stats['total_lag_ms'] / remote, 3) if remote else None,
+        }
+
+    def start(self):
+        """在后台线程中监听变更；重复调用无副作用"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='environment-propagation', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self.bootstrap()
+        except Exception:
+            logger.exception('环境变量变更回放失败')
+        finally:
+            connection.close()
+
+        while not self._stop.is_set():
+            try:
+                if connection.vendor == 'postgresql':
+                    self.mode = 'listen'
+                    self._listen()
+                else:
+                    self.mode = 'poll'
+                    self._safe_sync()
+                    self._stop.wait(settings.ENV_PROPAGATION_POLL)
+            except Exception:
+                self._stats['errors'] += 1
+                logger.exception('环境变量变更监听出错，稍后重试')
+                self._stop.wait(settings.ENV_PROPAGATION_POLL)
+
+    def _safe_sync(self):
+        try:
+            self.sync()
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                self._pruned_at = time.monotonic()
+                prune_changes()
+        finally:
+            # 归还连接（连接池模式下不长期占用）
+            connection.close()
+
+    def _listen(self):
+        import psycopg2
+
+        params = connection.get_connection_params()
+        listener = psycopg2.connect(**params)
+        try:
+            listener.autocommit = True
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            self._safe_sync()  # 覆盖建立监听前的空窗
+            while not self._stop.is_set():
+                # 超时后也同步一次，兜底丢失的通知
+                ready, _, _ = select.select([listener], [], [], settings.ENV_PROPAGATION_POLL * 10)
+                if ready:
+                    listener.poll()
+                    listener.notifies.clear()
+                self._safe_sync()
+        finally:
+            listener.close()
+
+
+propagator = Propagator()
+
+
+def start_listener():
+    """由 asgi.py / wsgi.py 在每个 worker 进程中调用"""
+    if settings.ENV_PROPAGATION_ENABLED:
+        propagator.start()
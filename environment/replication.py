@@ -0,0 +1,307 @@
+"""
+实例之间的环境变量复制（manage.py env_replicate）。
+
+同一项目的多个部署（如 /o/app/ 和 /t/app/）各自有独立的数据库。
+对端通过 history/changes/ 按历史版本号分页提供变更日志，本实例记住已应用的版本号（水位），
+每次只拉取水位之后的增量：
+1. 首次同步时按对端最新快照分页拉取全表（快照之前的数据不在变更日志中），完成后水位为快照的版本号；
+   首次同步只写入对端有的变量，不删除本地独有的变量；
+2. 之后按版本号顺序拉取变更，每页在同页内按键合并，经 bulk_apply 在一个事务中写库，
+   水位随数据一起提交，中断后从最后一个已提交的页继续；对端只返回到第一个可能尚未提交的
+   版本号空洞为止，先拿到版本号、后提交的变更不会被水位跳过。
+冲突规则：
+- source：对端优先，始终覆盖本地；
+- local：上次从该对端复制之后本地改过的键保留本地值；
+- newer：按修改时间，本地修改晚于对端时保留本地值（依赖两台主机的时钟）。
+复制写入的历史版本记录来源（source），据此按键区分本地修改和复制来的修改；
+相同的值不产生新的历史版本，两个实例互相拉取时不会来回复制。
+"""
+import bisect
+import gzip
+import json
+import logging
+import time
+from functools import lru_cache
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .history import _load_snapshot, revision_value
+from .logtail import committed_prefix
+from .models import EnvironmentVariable, ReplicationState, VariableRevision, VariableSnapshot
+
+logger = logging.getLogger(__name__)
+
+CONFLICT_RULES = ('source', 'local', 'newer')
+MAX_PAGE = 1000  # 单页最多返回的条数（也受 SQLite 单条语句参数个数限制）
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def _latest_revision():
+    return VariableRevision.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+
+# ---------- 对端：变更日志接口 ----------
+
+def changes_page(since, limit):
+    """版本号大于 since 的最多 limit 条变更，按版本号升序
+
+    在可能尚未提交的版本号空洞前截断（见 logtail.committed_prefix），
+    对端据此推进的水位之下不会再出现晚提交的变更。
+    """
+    rows = list(VariableRevision.objects.filter(id__gt=since).order_by('id')[:limit])
+    revisions = committed_prefix(rows, since)
+    latest = _latest_revision()
+    next_revision = revisions[-1].pk if revisions else since
+    return {
+        'mode': 'changes',
+        'changes': [
+            {
+                'id': rev.pk,
+                'key': rev.key,
+                'operation': rev.operation,
+                'value': revision_value(rev),
+                'description': rev.description,
+                'created_at': rev.created_at.isoformat(),
+            }
+            for rev in revisions
+        ],
+        'next': next_revision,
+        'latest': latest,
+        # 截断时等下次同步再继续，不在本次同步中反复请求
+        'more': next_revision < latest and len(revisions) == len(rows),
+    }
+
+
+@lru_cache(maxsize=1)
+def _snapshot_items(revision_id):
+    """快照按键排序后的 [(key, value, description)] 和生成时间；快照不会修改，按版本号缓存"""
+    snapshot = VariableSnapshot.objects.filter(revision_id=revision_id).order_by('-id').first()
+    if snapshot is None:
+        return None
+    items = sorted((key, value, description) for key, (value, description) in _load_snapshot(snapshot).items())
+    return [item[0] for item in items], items, snapshot.created_at.isoformat()
+
+
+def snapshot_page(revision, after, limit):
+    """快照中键名排在 after 之后的最多 limit 个变量；revision 为空时使用最新快照"""
+    if revision is None:
+        revision = VariableSnapshot.objects.aggregate(last=Max('revision_id'))['last']
+    loaded = _snapshot_items(revision) if revision is not None else None
+    if loaded is None:
+        if revision is not None:
+            raise ReplicationError(f'快照 r{revision} 不存在')
+        # 还没有任何快照：从头回放变更日志
+        return {'mode': 'snapshot', 'snapshot': 0, 'created_at': None,
+                'variables': [], 'after': '', 'more': False}
+    keys, items, created_at = loaded
+    start = bisect.bisect_right(keys, after) if after else 0
+    page = items[start:start + limit]
+    return {
+        'mode': 'snapshot',
+        'snapshot': revision,
+        'created_at': created_at,
+        'variables': [{'key': key, 'value': value, 'description': description}
+                      for key, value, description in page],
+        'after': page[-1][0] if page else after,
+        'more': start + len(page) < len(items),
+    }
+
+
+# ---------- 本端：拉取和应用 ----------
+
+class PeerClient:
+    """对端 environment 应用的 HTTP 客户端，网络错误和 5xx 按退避重试"""
+
+    def __init__(self, url, token='', timeout=None, retries=3):
+        self.base_url = url.rstrip('/') + '/'
+        self.url = self.base_url + 'history/changes/'
+        self.token = token
+        self.timeout = timeout if timeout is not None else settings.ENV_REPLICATION_TIMEOUT
+        self.retries = retries
+
+    def _get(self, params):
+        request = Request(f'{self.url}?{urlencode(params)}', headers={'Accept-Encoding': 'gzip'})
+        if self.token:
+            request.add_header('Authorization', f'Bearer {self.token}')
+        for attempt in range(self.retries + 1):
+            try:
+                with urlopen(request, timeout=self.timeout) as response:
+                    body = response.read()
+                    if response.headers.get('Content-Encoding') == 'gzip':
+                        body = gzip.decompress(body)
+                return json.loads(body)
+            except HTTPError as e:
+                if e.code < 500 or attempt == self.retries:
+                    raise ReplicationError(f'对端返回 HTTP {e.code}: {self.url}') from e
+            except (URLError, OSError) as e:
+                if attempt == self.retries:
+                    raise ReplicationError(f'无法连接对端 {self.url}: {e}') from e
+            time.sleep(min(2 ** attempt, 30))
+
+    def changes(self, since, limit):
+        return self._get({'since': since, 'limit': limit})
+
+    def snapshot(self, revision, after, limit):
+        params = {'snapshot': revision if revision is not None else 'latest', 'limit': limit}
+        if after:
+            params['after'] = after
+        return self._get(params)
+
+
+class Replicator:
+    """把对端的变更按页应用到本实例，进度保存在 ReplicationState 中"""
+
+    def __init__(self, client, peer=None, conflict='source', scope=None, batch_size=None):
+        if conflict not in CONFLICT_RULES:
+            raise ValueError(f'未知的冲突规则: {conflict}')
+        self.client = client
+        self.peer = (peer or client.base_url)[:200]
+        self.conflict = conflict
+        self.scope = scope
+        self.batch_size = min(batch_size or settings.ENV_REPLICATION_BATCH, MAX_PAGE)
+
+    def reset(self):
+        """丢弃进度，下次从对端快照重新全量同步"""
+        ReplicationState.objects.filter(peer=self.peer).delete()
+
+    def run(self):
+        """拉取到对端的最新版本为止，返回本次的汇总"""
+        summary = {'pages': 0, 'applied': 0, 'unchanged': 0, 'skipped': 0}
+        state, _ = ReplicationState.objects.get_or_create(peer=self.peer)
+        try:
+            while True:
+                if state.watermark is None:
+                    page = self.client.snapshot(state.snapshot_revision, state.snapshot_after, self.batch_size)
+                    more = True  # 快照最后一页之后继续拉取快照之后的变更
+                    state = self._apply_snapshot(state, page, summary)
+                else:
+                    page = self.client.changes(state.watermark, self.batch_size)
+                    if page['latest'] < state.watermark:
+                        raise ReplicationError(
+                            f'对端最新版本 r{page["latest"]} 早于本地水位 r{state.watermark}，'
+                            '对端数据库可能已重建，请使用 --reset 重新全量同步'
+                        )
+                    if not page['changes']:
+                        break
+                    more = page['more']
+                    state = self._apply_changes(state, page, summary)
+                summary['pages'] += 1
+                if not more:
+                    break
+        except Exception as e:
+            ReplicationState.objects.filter(pk=state.pk).update(last_error=str(e)[:2000])
+            raise
+        summary['watermark'] = state.watermark
+        return summary
+
+    def _apply_snapshot(self, state, page, summary):
+        remote_at = parse_datetime(page['created_at']) if page['created_at'] else None
+        entries = {item['key']: ('set', item['value'], item['description'], remote_at)
+                   for item in page['variables']}
+
+        def advance(locked):
+            if (locked.watermark is not None or locked.snapshot_revision != state.snapshot_revision
+                    or locked.snapshot_after != state.snapshot_after):
+                return False
+            if page['more']:
+                locked.snapshot_revision = page['snapshot']
+                locked.snapshot_after = page['after']
+            else:
+                locked.watermark = page['snapshot']
+                locked.snapshot_revision = None
+                locked.snapshot_after = ''
+            return True
+
+        return self._apply(state, entries, advance, summary)
+
+    def _apply_changes(self, state, page, summary):
+        # 同一页内按键合并：最后一次操作为准，未改描述时沿用本页内更早的描述
+        entries = {}
+        for change in page['changes']:
+            key, description = change['key'], change['description']
+            previous = entries.get(key)
+            if description is None and previous is not None and previous[0] == 'set':
+                description = previous[2]
+            entries[key] = (change['operation'], change['value'], description, parse_datetime(change['created_at']))
+
+        def advance(locked):
+            if locked.watermark != state.watermark:
+                return False
+            locked.watermark = page['next']
+            return True
+
+        return self._apply(state, entries, advance, summary)
+
+    def _local_changes(self, keys):
+        """本地在上次从该对端复制之后修改过的键 {key: 修改时间}
+
+        按键比较：最新的非本对端历史版本晚于最新的本对端历史版本即为本地修改；
+        没有任何历史版本的已有变量（历史功能之前的数据）也算本地修改。
+        """
+        revisions = VariableRevision.objects.filter(key__in=keys)
+        replicated = dict(
+            revisions.filter(source=self.peer).values('key').annotate(last=Max('id')).values_list('key', 'last')
+        )
+        changed = {
+            key: at
+            for key, last, at in revisions.exclude(source=self.peer).values('key')
+            .annotate(last=Max('id'), at=Max('created_at')).values_list('key', 'last', 'at')
+            if last > replicated.get(key, 0)
+        }
+        known = set(revisions.values_list('key', flat=True).distinct())
+        changed.update(
+            EnvironmentVariable.objects.filter(key__in=keys).exclude(key__in=known).values_list('key', 'updated_at')
+        )
+        return changed
+
+    def _apply(self, state, entries, advance, summary):
+        with transaction.atomic():
+            locked = ReplicationState.objects.select_for_update().get(pk=state.pk)
+            if not advance(locked):
+                # 另一个进程同时在复制同一个对端，放弃本页，从它提交的位置继续
+                logger.warning('复制进度已被其他进程推进，跳过本页', extra={'peer': self.peer})
+                return locked
+
+            skipped = set()
+            if self.conflict != 'source':
+                local = self._local_changes(list(entries))
+                for key, at in local.items():
+                    remote_at = entries[key][3]
+                    if self.conflict == 'local' or remote_at is None or at >= remote_at:
+                        skipped.add(key)
+
+            results = EnvironmentVariable.bulk_apply(
+                [(key, value, description)
+                 for key, (operation, value, description, _) in entries.items()
+                 if operation == 'set' and key not in skipped],
+                scope=self.scope,
+                batch_size=self.batch_size,
+                removed_keys=[key for key, (operation, *_) in entries.items()
+                              if operation == 'delete' and key not in skipped],
+                source=self.peer,
+            )
+            applied = sum(1 for status in results.values() if status != 'unchanged')
+
+            locked.applied += applied
+            locked.skipped += len(skipped)
+            locked.last_sync_at = timezone.now()
+            locked.last_error = ''
+            locked.save()
+
+        summary['applied'] += applied
+        summary['unchanged'] += len(results) - applied
+        summary['skipped'] += len(skipped)
+        if skipped:
+            logger.info('%d 个变量本地有修改，按 %s 规则保留本地值', len(skipped), self.conflict,
+                        extra={'peer': self.peer, 'env_keys': sorted(skipped)})
+        return locked
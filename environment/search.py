@@ -0,0 +1,69 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connections
+from django.db.backends.ddl_references import Statement
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+
+class SearchIndex(GinIndex):
+    """只在 PostgreSQL 上创建的 GIN 索引（pg_trgm / 全文检索）
+
+    本地 SQLite 没有 gin 和 pg_trgm：建表、重建表和迁移时生成空语句跳过，迁移状态仍与模型一致。
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return Statement('')
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return Statement('')
+        return super().remove_sql(model, schema_editor, **kwargs)
+
+
+def description_vector():
+    """description 的全文检索向量，中文描述不分词，使用 simple 配置；与索引表达式一致规划器才会使用索引"""
+    return SearchVector('description', config='simple')
+
+
+def search_variables(queryset, query):
+    """按 key / value / description 搜索并附加 rank 注解，结果按 rank 降序、key 升序
+
+    PostgreSQL 上 key、value 的子串匹配走 pg_trgm GIN 索引，description 走全文索引，
+    rank 由三者的相似度加权得到；其他数据库（本地 SQLite）退化为 icontains 加规则打分。
+    """
+    query = query.strip()
+    if not query:
+        return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    if connections[queryset.db].vendor == 'postgresql':
+        ts_query = SearchQuery(query, config='simple')
+        return queryset.annotate(
+            description_vector=description_vector(),
+        ).filter(
+            Q(key__icontains=query) | Q(value__icontains=query) | Q(description_vector=ts_query)
+        ).annotate(
+            # 相似度和 ts_rank 都是 real（float4），转为 double precision 后
+            # 游标中保存的 Python float 与库中的值逐位一致，按 rank 定位时不会漏行或重复
+            rank=Cast(
+                TrigramSimilarity('key', query) * 2
+                + TrigramSimilarity('value', query)
+                + SearchRank(F('description_vector'), ts_query),
+                FloatField(),
+            ),
+        )
+
+    return queryset.filter(
+        Q(key__icontains=query) | Q(value__icontains=query) | Q(description__icontains=query)
+    ).annotate(
+        rank=Case(
+            When(key__iexact=query, then=Value(4.0)),
+            When(key__istartswith=query, then=Value(3.0)),
+            When(key__icontains=query, then=Value(2.0)),
+            When(value__icontains=query, then=Value(1.0)),
+            default=Value(0.5),
+            output_field=FloatField(),
+        ),
+    )
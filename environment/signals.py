@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+# 变量表（连同历史版本）的修改已提交；打包缓存、列表片段版本号和 SSE 推送在 apps.ready 中订阅
+variables_changed = Signal()
+
+
+def changed_on_commit(sender, using='default', **kwargs):
+    """当前事务提交后发送 variables_changed，不在事务中时立即发送
+
+    bulk_create 和查询集批量删除不触发模型信号，批量写入路径（bulk_apply、load_from_system）直接调用；
+    同时作为 EnvironmentVariable 的 post_save / post_delete 接收函数。
+    """
+    transaction.on_commit(lambda: variables_changed.send(sender=sender), using=using)
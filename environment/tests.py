@@ -1,3 +1,1086 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import logging
+import pickle
+import os
+import shlex
+import shutil
+import socket
+import struct
+import sys
+import subprocess
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from helloDjango.authcache import CachedModelBackend
+from helloDjango.logpipe import CollectorHandler, read_records
+from helloDjango.metrics.registry import registry
+from helloDjango.staticfiles import IMMUTABLE, serve_static, trim_icon_css
+
+from . import interpolation
+from .bundle import bundle_cache, choose_encoding
+from .drift import compute_drift
+from .feed import ChangeFeed
+from .envfile import EnvFileWriter, parse_env_line
+from .forms import EnvironmentVariableForm
+from .fragments import bump_table_version, table_version
+from .interpolation import CycleError, Resolver
+from .logtail import GapTracker
+from .models import EnvironmentChange, EnvironmentVariable, VariableRevision
+from .pagination import InvalidCursor, KeysetPaginator, cached_count, decode_cursor, encode_cursor
+from .probe import probe
+from .propagation import Propagator, prune_changes
+from .replication import Replicator
+from .search import search_variables
+from .signals import variables_changed
+from .transfer import export_lines, import_entries, iter_entries
+from .watcher import EnvFileSync, InotifyWatcher, PollingWatcher
+
+# 测试中两级缓存都用进程内内存，静态文件不依赖 collectstatic 生成的清单
+TEST_SETTINGS = dict(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-default'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-shared'},
+    },
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    ENV_PROPAGATION_ENABLED=False,
+)
+
+
+class SystemFilesMixin:
+    """把 /etc/environment 和 profile.d 换成临时目录中的文件"""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.env_file = os.path.join(self.tmp, 'environment')
+        self.profile_dir = os.path.join(self.tmp, 'profile.d')
+        os.mkdir(self.profile_dir)
+        with open(self.env_file, 'w') as f:
+            f.write('PATH="/usr/bin"\n')
+        override = override_settings(
+            ENV_SYSTEM_FILE=self.env_file,
+            ENV_PROFILE_DIR=self.profile_dir,
+            ENV_WRITE_LOCK=os.path.join(self.tmp, 'lock'),
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        probe.invalidate()
+        self.addCleanup(probe.invalidate)
+
+    def read_env_file(self):
+        with open(self.env_file) as f:
+            return f.read()
+
+
+@override_settings(**TEST_SETTINGS)
+class BulkApplyTests(SystemFilesMixin, TestCase):
+
+    def test_upsert_reports_changes_by_hash(self):
+        results = EnvironmentVariable.bulk_apply([('A', '1', 'first'), ('B', '2', '')], scope=None)
+        self.assertEqual(results, {'A': 'created', 'B': 'created'})
+
+        results = EnvironmentVariable.bulk_apply([('A', '1', None), ('B', '3', None)], scope=None)
+        self.assertEqual(results, {'A': 'unchanged', 'B': 'updated'})
+        # description 为 None 时保留原描述
+        self.assertEqual(EnvironmentVariable.objects.get(key='A').description, 'first')
+        self.assertEqual(EnvironmentVariable.objects.get(key='B').value_hash, hashlib.md5(b'3').hexdigest())
+        # 未变化的键不产生新的历史版本
+        self.assertEqual(VariableRevision.objects.filter(key='A').count(), 1)
+        self.assertEqual(VariableRevision.objects.filter(key='B').count(), 2)
+
+    def test_remove_and_apply_to_system(self):
+        EnvironmentVariable.bulk_apply([('KEEP', 'k', ''), ('DROP', 'd', '')], scope='global')
+        self.assertIn('DROP="d"', self.read_env_file())
+
+        results = EnvironmentVariable.bulk_apply([], scope='global', removed_keys=['DROP', 'MISSING'])
+        self.assertEqual(results, {'DROP': 'deleted'})
+        content = self.read_env_file()
+        self.assertNotIn('DROP=', content)
+        self.assertIn('KEEP="k"', content)
+        self.assertIn('PATH="/usr/bin"', content)
+
+
+@override_settings(**TEST_SETTINGS)
+class VariablesChangedTests(TestCase):
+
+    def setUp(self):
+        self.received = []
+        variables_changed.connect(self.receiver)
+        self.addCleanup(variables_changed.disconnect, self.receiver)
+
+    def receiver(self, sender, **kwargs):
+        self.received.append(sender)
+
+    def test_sent_after_commit_for_every_write_path(self):
+        writes = [
+            lambda: EnvironmentVariable.bulk_apply([('SIG_A', '1', '')], scope=None),
+            lambda: EnvironmentVariable.bulk_apply([], removed_keys=['SIG_A'], scope=None),
+            # 不经过 bulk_apply / record_revisions 的单行写入
+            lambda: EnvironmentVariable.objects.create(key='SIG_B', value='1'),
+            lambda: EnvironmentVariable.objects.get(key='SIG_B').delete(),
+        ]
+        for write in writes:
+            with self.captureOnCommitCallbacks() as callbacks:
+                write()
+            self.assertEqual(self.received, [])
+            for callback in callbacks:
+                callback()
+            self.assertTrue(self.received)
+            self.received.clear()
+
+    def test_unchanged_batch_sends_nothing(self):
+        EnvironmentVariable.bulk_apply([('SIG_C', '1', '')], scope=None)
+        with self.captureOnCommitCallbacks() as callbacks:
+            EnvironmentVariable.bulk_apply([('SIG_C', '1', None)], scope=None)
+        self.assertEqual(callbacks, [])
+
+    def test_receivers_invalidate_caches(self):
+        version = table_version()
+        bundle_cache._checked_at = bundle_cache._built_at = 1.0
+        with self.captureOnCommitCallbacks(execute=True):
+            EnvironmentVariable.bulk_apply([('SIG_D', '1', '')], scope=None)
+        self.assertNotEqual(table_version(), version)
+        self.assertEqual((bundle_cache._checked_at, bundle_cache._built_at), (0.0, 0.0))
+
+
+@override_settings(**TEST_SETTINGS)
+class KeysetPaginationTests(TestCase):
+
+    def walk(self, paginator):
+        pages, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            pages.append([var.key for var in page])
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages, page
+
+    def test_seek_with_ties(self):
+        # description 大量重复，最后按唯一的 key 排序
+        EnvironmentVariable.objects.bulk_create([
+            EnvironmentVariable(key=f'K{i:02d}', value='v', description=f'd{i % 3}').packed()
+            for i in range(23)
+        ])
+        expected = list(EnvironmentVariable.objects.order_by('-description', 'key').values_list('key', flat=True))
+        paginator = KeysetPaginator(EnvironmentVariable.objects.all(), 4, ('-description', 'key'))
+
+        pages, last = self.walk(paginator)
+        self.assertEqual([key for page in pages for key in page], expected)
+        self.assertTrue(all(len(page) == 4 for page in pages[:-1]))
+
+        # 从最后一页往回翻，得到同样的分页
+        backwards, page = [], last
+        while page.previous_cursor:
+            page = paginator.page(page.previous_cursor)
+            backwards.append([var.key for var in page])
+        self.assertEqual(backwards[::-1], pages[:-1])
+
+    def test_seek_by_search_rank(self):
+        EnvironmentVariable.objects.bulk_create([
+            EnvironmentVariable(key=f'TIE_{i:02d}', value='x').packed() for i in range(7)
+        ] + [
+            EnvironmentVariable(key=f'OTHER_{i}', value='has tie inside').packed() for i in range(3)
+        ])
+        queryset = search_variables(EnvironmentVariable.objects.all(), 'tie')
+        expected = list(queryset.order_by('-rank', 'key').values_list('key', flat=True))
+        pages, _ = self.walk(KeysetPaginator(queryset, 3, ('-rank', 'key')))
+        self.assertEqual([key for page in pages for key in page], expected)
+        self.assertEqual(len(expected), 10)
+
+    def test_count_cached_until_table_changes(self):
+        caches['default'].clear()
+        EnvironmentVariable.bulk_apply([(f'CNT_{i}', 'v', '') for i in range(3)], scope=None)
+        queryset = EnvironmentVariable.objects.all()
+        self.assertEqual(cached_count(queryset), (3, False))
+        self.assertEqual(cached_count(queryset.filter(key='CNT_0'), 'CNT_0'), (1, False))
+        with self.assertNumQueries(0):
+            self.assertEqual(cached_count(queryset), (3, False))
+
+        # 提交后的 variables_changed 更新表版本号，旧的总数不再命中
+        with self.captureOnCommitCallbacks(execute=True):
+            EnvironmentVariable.bulk_apply([('CNT_3', 'v', '')], scope=None)
+        self.assertEqual(cached_count(queryset), (4, False))
+
+    def test_invalid_cursor(self):
+        # 非 base64、缺字段、字段数与排序键不符、方向无效
+        for token in ('not base64!', 'e30', encode_cursor(['a', 'b'], 'next'), encode_cursor(['a'], 'up')):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(token, 1)
+        self.assertEqual(decode_cursor(encode_cursor(['a'], 'prev'), 1), (['a'], 'prev'))
+
+
+@override_settings(**TEST_SETTINGS)
+class SearchTests(TestCase):
+
+    def test_rank_order(self):
+        EnvironmentVariable.bulk_apply([
+            ('PATH', '/usr/bin', ''),
+            ('PATH_EXTRA', 'x', ''),
+            ('MY_PATH', 'x', ''),
+            ('OTHER', '/path/to', ''),
+            ('NOTE', 'x', 'the path setting'),
+            ('UNRELATED', 'x', ''),
+        ], scope=None)
+        queryset = search_variables(EnvironmentVariable.objects.all(), ' path ').order_by('-rank', 'key')
+        self.assertEqual(
+            list(queryset.values_list('key', flat=True)),
+            ['PATH', 'PATH_EXTRA', 'MY_PATH', 'OTHER', 'NOTE'],
+        )
+        self.assertEqual(search_variables(EnvironmentVariable.objects.all(), '').count(), 6)
+
+    def test_indexes_skipped_outside_postgres(self):
+        editor = connection.schema_editor()
+        for index in EnvironmentVariable._meta.indexes:
+            self.assertEqual(str(index.create_sql(EnvironmentVariable, editor)), '')
+            self.assertEqual(str(index.remove_sql(EnvironmentVariable, editor)), '')
+
+
+@override_settings(**TEST_SETTINGS, ENV_VALUE_COMPRESS_THRESHOLD=100, ENV_VALUE_PREVIEW_CHARS=10)
+class ValueStorageTests(TestCase):
+
+    def test_compression_round_trip(self):
+        big = 'MIIB' * 500
+        var = EnvironmentVariable.objects.create(key='BIG', value=big)
+        EnvironmentVariable.objects.create(key='SMALL', value='short')
+
+        stored = EnvironmentVariable.objects.values('value', 'value_data', 'value_length').get(pk=var.pk)
+        self.assertEqual(stored['value'], big[:10])
+        self.assertIsNotNone(stored['value_data'])
+        self.assertEqual(stored['value_length'], len(big))
+        self.assertIsNone(EnvironmentVariable.objects.get(key='SMALL').value_data)
+
+        self.assertEqual(EnvironmentVariable.objects.get(pk=var.pk).value, big)
+        self.assertEqual(dict(EnvironmentVariable.objects.values_full('key', 'value'))['BIG'], big)
+        self.assertEqual(var.value_hash, hashlib.md5(big.encode()).hexdigest())
+
+        preview = EnvironmentVariable.objects.with_preview().get(pk=var.pk)
+        self.assertEqual(preview.value_preview, big[:10])
+
+
+@override_settings(**TEST_SETTINGS)
+class ValueEtagTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def test_not_modified_until_value_changes(self):
+        var = EnvironmentVariable.objects.create(key='ETAG_K', value='v1')
+        url = reverse('environment:value', args=[var.pk])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'v1')
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        var.value = 'v2'
+        var.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'v2')
+
+
+@override_settings(**TEST_SETTINGS)
+class ResolverTests(TestCase):
+
+    def test_cycles_keep_raw_values(self):
+        resolver = Resolver()
+        resolver.load({'A': '${B}', 'B': '${A}', 'C': 'x-${D}', 'D': 'd', 'E': '$${D}'})
+        values, errors = resolver.resolve_all()
+        self.assertEqual(set(errors), {'A', 'B'})
+        self.assertEqual(values['A'], '${B}')
+        self.assertEqual(values['C'], 'x-d')
+        self.assertEqual(values['E'], '${D}')
+
+    def test_preview_rejects_new_cycle(self):
+        resolver = Resolver()
+        resolver.load({'C': 'x-${D}', 'D': 'd'})
+        with self.assertRaises(CycleError):
+            resolver.preview({'D': '${C}'})
+        self.assertEqual(resolver.preview({'D': 'e'}), {'C': 'x-e', 'D': 'e'})
+        self.assertEqual(resolver.resolve('C'), 'x-d')
+
+    @override_settings(ENV_INTERPOLATION=True)
+    def test_bulk_apply_rejects_cycle_before_writing(self):
+        interpolation.resolver.load({})  # 丢弃其他测试留下的进程内状态，下次使用时从数据库重新加载
+        with self.assertRaises(CycleError):
+            EnvironmentVariable.bulk_apply([('X', '${Y}', ''), ('Y', '${X}', '')], scope=None)
+        self.assertFalse(EnvironmentVariable.objects.filter(key__in=['X', 'Y']).exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class DriftTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {'DRIFT_SAME': 'a', 'DRIFT_CHANGED': 'new', 'DRIFT_ADDED': 'x'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        EnvironmentVariable.bulk_apply(
+            [('DRIFT_SAME', 'a', ''), ('DRIFT_CHANGED', 'old', ''), ('DRIFT_MISSING', 'm', '')], scope=None,
+        )
+
+    def drift(self):
+        return {name: [key for key in keys if key.startswith('DRIFT_')] for name, keys in compute_drift().items()}
+
+    def test_compares_hashes_and_recomputes_after_writes(self):
+        self.assertEqual(self.drift(), {
+            'added': ['DRIFT_ADDED'], 'changed': ['DRIFT_CHANGED'], 'missing': ['DRIFT_MISSING'],
+        })
+        # 库中的值改变（行数不变）和系统环境改变都要重新计算
+        EnvironmentVariable.bulk_apply([('DRIFT_CHANGED', 'new', '')], scope=None)
+        self.assertEqual(self.drift()['changed'], [])
+        os.environ['DRIFT_SAME'] = 'b'
+        self.assertEqual(self.drift()['changed'], ['DRIFT_SAME'])
+
+    def test_view_returns_json(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        response = self.client.get(reverse('environment:drift'), HTTP_ACCEPT='application/json')
+        self.assertIn('DRIFT_MISSING', response.json()['missing'])
+        self.assertContains(self.client.get(reverse('environment:drift')), 'DRIFT_ADDED')
+
+
+@override_settings(**TEST_SETTINGS)
+class EnvironmentViewTests(SystemFilesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 事务提交后的缓存失效回调在 TestCase 中不执行，每个测试从空缓存开始
+        for alias in ('default', 'shared'):
+            caches[alias].clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+
+    def post_edit(self, url, key, value, scope='global'):
+        return self.client.post(url, {'key': key, 'value': value, 'description': 'd', 'scope': scope})
+
+    def test_list_search_and_pages(self):
+        EnvironmentVariable.bulk_apply([(f'LIST_{i:02d}', f'v{i}', '') for i in range(12)], scope=None)
+        response = self.client.get(reverse('environment:list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'LIST_00')
+        self.assertNotContains(response, 'LIST_11')
+
+        response = self.client.get(reverse('environment:list'), {'search': 'LIST_11'})
+        self.assertContains(response, 'LIST_11')
+        self.assertNotContains(response, 'LIST_00')
+
+    def test_list_fragment_cached_until_table_changes(self):
+        url = reverse('environment:list')
+        EnvironmentVariable.bulk_apply([('FRAG_A', 'v', '')], scope=None)
+        self.assertContains(self.client.get(url), 'FRAG_A')
+        self.assertContains(self.client.get(url, {'cursor': 'garbage'}), 'FRAG_A')
+
+        # 未经 variables_changed 的写入看不到：片段按表版本号缓存
+        with self.captureOnCommitCallbacks() as callbacks:
+            EnvironmentVariable.bulk_apply([('FRAG_B', 'v', '')], scope=None)
+        self.assertNotContains(self.client.get(url), 'FRAG_B')
+        for callback in callbacks:
+            callback()
+        self.assertContains(self.client.get(url), 'FRAG_B')
+
+        # 其他 worker 更新共享缓存中的版本号后，本进程的片段同样失效
+        EnvironmentVariable.objects.filter(key='FRAG_A').update(key='FRAG_C')
+        self.assertContains(self.client.get(url), 'FRAG_A')
+        bump_table_version()
+        self.assertContains(self.client.get(url), 'FRAG_C')
+
+    def test_create_rename_and_delete(self):
+        response = self.post_edit(reverse('environment:add'), 'NEWK', 'say "hi"')
+        self.assertRedirects(response, reverse('environment:refresh'), fetch_redirect_response=False)
+        var = EnvironmentVariable.objects.get(key='NEWK')
+        self.assertIn('NEWK="say \\"hi\\""', self.read_env_file())
+        self.assertEqual(os.environ.get('NEWK'), 'say "hi"')
+
+        # 改名：旧变量从库、系统文件和进程环境中删除，历史中记为删除
+        self.post_edit(reverse('environment:edit', args=[var.pk]), 'RENAMED', 'v2')
+        self.assertEqual(list(EnvironmentVariable.objects.values_list('key', flat=True)), ['RENAMED'])
+        content = self.read_env_file()
+        self.assertNotIn('NEWK=', content)
+        self.assertIn('RENAMED="v2"', content)
+        with open(os.path.join(self.profile_dir, 'custom_environment.sh')) as f:
+            self.assertNotIn('NEWK=', f.read())
+        self.assertNotIn('NEWK', os.environ)
+        self.assertEqual(
+            list(VariableRevision.objects.filter(key='NEWK').values_list('operation', flat=True)),
+            ['set', 'delete'],
+        )
+
+        var = EnvironmentVariable.objects.get(key='RENAMED')
+        response = self.client.post(reverse('environment:delete', args=[var.pk]))
+        self.assertRedirects(response, reverse('environment:list'), fetch_redirect_response=False)
+        self.assertFalse(EnvironmentVariable.objects.exists())
+        self.assertNotIn('RENAMED=', self.read_env_file())
+        self.assertNotIn('RENAMED', os.environ)
+
+    def test_failed_system_write_changes_nothing(self):
+        EnvironmentVariable.bulk_apply([('KEEP', 'v1', '')], scope='global')
+        var = EnvironmentVariable.objects.get(key='KEEP')
+        revisions = VariableRevision.objects.count()
+
+        with mock.patch('environment.envfile.is_writable', return_value=False):
+            self.post_edit(reverse('environment:edit', args=[var.pk]), 'MOVED', 'v2')
+            response = self.client.post(reverse('environment:delete', args=[var.pk]), follow=True)
+        self.assertContains(response, '未删除')
+
+        self.assertEqual(list(EnvironmentVariable.objects.values_list('key', 'value')), [('KEEP', 'v1')])
+        self.assertEqual(VariableRevision.objects.count(), revisions)
+        self.assertIn('KEEP="v1"', self.read_env_file())
+
+    def test_session_scope_skips_system_files(self):
+        self.post_edit(reverse('environment:add'), 'SESS_K', 'v', scope='session')
+        self.assertEqual(os.environ.pop('SESS_K'), 'v')
+        self.assertNotIn('SESS_K', self.read_env_file())
+
+
+class FakePeer:
+    """按 history/changes/ 接口格式返回预先登记的变更"""
+
+    base_url = 'http://peer.test/env/'
+
+    def __init__(self):
+        self.log = []
+
+    def add(self, key, value, at=None):
+        self.log.append({
+            'id': len(self.log) + 1,
+            'key': key,
+            'operation': 'set' if value is not None else 'delete',
+            'value': value,
+            'description': None,
+            'created_at': (at or timezone.now()).isoformat(),
+        })
+
+    def snapshot(self, revision, after, limit):
+        return {'mode': 'snapshot', 'snapshot': 0, 'created_at': None, 'variables': [], 'after': '', 'more': False}
+
+    def changes(self, since, limit):
+        page = [change for change in self.log if change['id'] > since][:limit]
+        next_revision = page[-1]['id'] if page else since
+        return {'mode': 'changes', 'changes': page, 'next': next_revision,
+                'latest': len(self.log), 'more': next_revision < len(self.log)}
+
+
+@override_settings(**TEST_SETTINGS)
+class ReplicationConflictTests(TestCase):
+
+    def replicate(self, peer, conflict):
+        return Replicator(peer, conflict=conflict).run()
+
+    def value(self, key):
+        return EnvironmentVariable.objects.get(key=key).value
+
+    def edited_locally(self, conflict):
+        """K 从对端复制过来后在本地修改，对端随后又修改了 K 并新增 N"""
+        peer = FakePeer()
+        peer.add('K', 'remote-1')
+        self.replicate(peer, conflict)
+        self.assertEqual(self.value('K'), 'remote-1')
+
+        EnvironmentVariable.bulk_apply([('K', 'local', None)], scope=None)
+        peer.add('K', 'remote-2', at=timezone.now() - timedelta(hours=1))
+        peer.add('N', 'new')
+        return peer, self.replicate(peer, conflict)
+
+    def test_source_rule_overwrites(self):
+        _, summary = self.edited_locally('source')
+        self.assertEqual(self.value('K'), 'remote-2')
+        self.assertEqual(summary['skipped'], 0)
+
+    def test_local_rule_keeps_local_edit(self):
+        _, summary = self.edited_locally('local')
+        self.assertEqual(self.value('K'), 'local')
+        self.assertEqual(self.value('N'), 'new')
+        self.assertEqual(summary['skipped'], 1)
+
+    def test_newer_rule_compares_times(self):
+        peer, summary = self.edited_locally('newer')
+        # 对端的修改早于本地修改：保留本地值
+        self.assertEqual(self.value('K'), 'local')
+        self.assertEqual(summary['skipped'], 1)
+
+        peer.add('K', 'remote-3', at=timezone.now() + timedelta(minutes=1))
+        self.replicate(peer, 'newer')
+        self.assertEqual(self.value('K'), 'remote-3')
+
+    def test_replicated_values_are_not_echoed(self):
+        peer = FakePeer()
+        peer.add('K', 'v')
+        peer.add('K', None)
+        summary = self.replicate(peer, 'source')
+        self.assertEqual(summary['watermark'], 2)
+        self.assertFalse(EnvironmentVariable.objects.filter(key='K').exists())
+        # 再次同步没有新变更
+        self.assertEqual(self.replicate(peer, 'source')['applied'], 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class EnvFileWriterTests(SystemFilesMixin, TestCase):
+
+    def test_commit_rewrites_both_targets(self):
+        writer = EnvFileWriter()
+        writer.set('A', 'one two').set('B', 'x')
+        written = writer.commit()
+        self.assertEqual(written, [self.env_file, writer.profile_script])
+        self.assertEqual(self.read_env_file(), 'PATH="/usr/bin"\nA="one two"\nB="x"\n')
+
+        EnvFileWriter().unset('A').commit()
+        self.assertEqual(self.read_env_file(), 'PATH="/usr/bin"\nB="x"\n')
+        with open(writer.profile_script) as f:
+            self.assertNotIn('A=', f.read())
+
+    def test_failed_replace_leaves_original(self):
+        writer = EnvFileWriter().set('A', '1')
+        with mock.patch('environment.envfile.os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                writer.commit()
+        self.assertEqual(self.read_env_file(), 'PATH="/usr/bin"\n')
+        # 临时文件已清理
+        self.assertEqual([name for name in os.listdir(self.tmp) if name.startswith('.')], [])
+
+    def test_values_are_quoted(self):
+        value = 'hello "world" $(touch x) `id` it\'s \\ ${HOME}'
+        writer = EnvFileWriter().set('Q', value)
+        writer.commit()
+        self.assertIn('Q="hello \\"world\\" $(touch x) `id` it\'s \\\\ ${HOME}"\n', self.read_env_file())
+
+        # profile 脚本由 shell 执行后得到原值，不执行其中的命令
+        output = subprocess.run(
+            ['sh', '-c', f'. {shlex.quote(writer.profile_script)} && printf %s "$Q"'],
+            cwd=self.tmp, capture_output=True, text=True, check=True,
+        ).stdout
+        self.assertEqual(output, value)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'x')))
+
+        # 监控同步按同样的规则读回
+        for path in (self.env_file, writer.profile_script):
+            with open(path) as f:
+                parsed = dict(filter(None, map(parse_env_line, f)))
+            self.assertEqual(parsed['Q'], value)
+
+    def test_rejects_newline_and_nul(self):
+        for value in ('a\nexport B=1', 'a\rb', 'a\0b'):
+            with self.assertRaises(ValueError):
+                EnvFileWriter().set('Q', value)
+        form = EnvironmentVariableForm(data={'key': 'Q', 'value': 'a\nb', 'description': '', 'scope': 'global'})
+        self.assertIn('value', form.errors)
+
+
+@override_settings(**TEST_SETTINGS)
+class TransferTests(SystemFilesMixin, TestCase):
+
+    VALUES = {
+        'PLAIN': 'value',
+        'QUOTED': 'say "hi" it\'s $HOME `id` \\n',
+        'MULTI': '-----BEGIN-----\nMIIB\n-----END-----\n',
+        'EMPTY': '',
+    }
+
+    def test_round_trip_all_formats(self):
+        for fmt in ('env', 'jsonl', 'shell'):
+            with self.subTest(fmt=fmt):
+                EnvironmentVariable.objects.all().delete()
+                EnvironmentVariable.bulk_apply([(k, v, '') for k, v in self.VALUES.items()], scope=None)
+                exported = ''.join(export_lines(fmt, resolved=False))
+
+                EnvironmentVariable.objects.all().delete()
+                summary = import_entries(iter_entries(io.StringIO(exported), 'auto'))
+                self.assertEqual(summary, {'created': 4, 'updated': 0, 'unchanged': 0})
+                self.assertEqual(dict(EnvironmentVariable.objects.values_full('key', 'value')), self.VALUES)
+
+    def test_counts_keys_once_across_batches(self):
+        EnvironmentVariable.bulk_apply([('OLD', 'same', '')], scope=None)
+        lines = ['A=1\n', 'OLD=same\n', 'A=2\n', 'OLD=same\n', 'B=1\n', 'A=2\n']
+        summary = import_entries(iter_entries(lines), batch_size=2)
+        self.assertEqual(summary, {'created': 2, 'updated': 0, 'unchanged': 1})
+        self.assertEqual(EnvironmentVariable.objects.get(key='A').value, '2')
+
+    def test_error_in_later_batch_rolls_back(self):
+        lines = ['A=1\n', 'B=2\n', 'C=3\n', 'not a line\n']
+        with self.assertRaisesMessage(ValueError, '第 4 行'):
+            import_entries(iter_entries(lines), batch_size=1)
+        self.assertFalse(EnvironmentVariable.objects.exists())
+        self.assertFalse(VariableRevision.objects.exists())
+
+        with self.assertRaisesMessage(ValueError, '第 2 行: 引号未闭合'):
+            list(iter_entries(['A=1\n', "export B='open\n", 'more\n']))
+
+    def test_import_applies_to_system_once(self):
+        summary = import_entries(iter_entries(['A="x y"\n', 'B=1\n', 'A=z\n']), batch_size=1, scope='global')
+        self.assertEqual(summary['created'], 2)
+        content = self.read_env_file()
+        self.assertIn('A="z"', content)
+        self.assertIn('B="1"', content)
+        self.assertNotIn('x y', content)
+
+        # 多行值不能写入系统文件，整个导入回滚
+        with self.assertRaises(ValueError):
+            import_entries(iter_entries(['C=1\n', 'D="a\\nb"\n']), scope='global')
+        self.assertFalse(EnvironmentVariable.objects.filter(key='C').exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class AuthCacheTests(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = User.objects.create_user('staff', password='x')
+        self.group = Group.objects.create(name='editors')
+        self.user.groups.add(self.group)
+        self.perm = Permission.objects.get(codename='change_environmentvariable')
+        self.backend = CachedModelBackend()
+
+    def test_cache_holds_no_password(self):
+        self.backend.get_user(self.user.pk)
+        data = caches['shared'].get(f'auth:user:{self.user.pk}')
+        self.assertNotIn('password', data['fields'])
+        self.assertNotIn(self.user.password, repr(data))
+
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.user.pk)
+            self.assertEqual(user.username, 'staff')
+            self.assertFalse(user.has_perm('environment.change_environmentvariable'))
+        self.assertEqual(user.get_session_auth_hash(), self.user.get_session_auth_hash())
+
+        # 保存缓存中取出的用户不会清空密码
+        user.first_name = 'S'
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('x'))
+
+    def test_group_permission_change_invalidates(self):
+        self.backend.get_user(self.user.pk)
+        self.group.permissions.add(self.perm)
+        self.assertTrue(self.backend.get_user(self.user.pk).has_perm('environment.change_environmentvariable'))
+        self.user.groups.remove(self.group)
+        self.assertFalse(self.backend.get_user(self.user.pk).has_perm('environment.change_environmentvariable'))
+
+    def test_session_stays_valid_until_password_changes(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('environment:list')).status_code, 403)
+        self.user.user_permissions.add(self.perm)
+        self.assertEqual(self.client.get(reverse('environment:probe')).status_code, 200)
+
+        self.user.set_password('y')
+        self.user.save()
+        response = self.client.get(reverse('environment:probe'))
+        self.assertEqual(response.status_code, 302)
+
+
+class LogPipeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sender, self.receiver = socket.socketpair()
+        self.addCleanup(self.sender.close)
+        self.addCleanup(self.receiver.close)
+
+    def test_records_round_trip_as_json(self):
+        handler = CollectorHandler('/nonexistent')
+        record = logging.makeLogRecord({
+            'name': 'environment', 'levelno': logging.INFO, 'levelname': 'INFO',
+            'msg': '修改 %s', 'args': ('A',), 'request': object(),
+        })
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            error = logging.makeLogRecord({'msg': 'boom', 'exc_info': sys.exc_info()})
+        self.sender.sendall(handler.serialize(record) + handler.serialize(error))
+        self.sender.close()
+
+        first, second = list(read_records(self.receiver))
+        self.assertEqual(logging.makeLogRecord(first).getMessage(), '修改 A')
+        self.assertTrue(first['request'].startswith('<object'))
+        self.assertIn('ZeroDivisionError', second['exc_text'])
+
+    def test_rejects_pickle_and_oversized_payloads(self):
+        payload = pickle.dumps({'msg': 'x'})
+        self.sender.sendall(struct.pack('>L', len(payload)) + payload)
+        self.sender.close()
+        self.assertEqual(list(read_records(self.receiver)), [])
+
+        sender, receiver = socket.socketpair()
+        self.addCleanup(receiver.close)
+        with sender:
+            sender.sendall(struct.pack('>L', 1 << 30) + b'{}')
+        self.assertEqual(list(read_records(receiver)), [])
+
+
+@override_settings(**TEST_SETTINGS)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        override = override_settings(METRICS_DIR=tmp, METRICS_TOKEN='')
+        override.enable()
+        self.addCleanup(override.disable)
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_requires_token_or_staff(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        self.client.force_login(User.objects.create_user('viewer'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_records_requests_per_view(self):
+        user = User.objects.create_user('ops', is_staff=True)
+        user.user_permissions.add(Permission.objects.get(codename='change_environmentvariable'))
+        self.client.force_login(user)
+        self.client.get(reverse('environment:probe'))
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('django_requests_total{view="environment:probe",method="GET",status="200"} 1', body)
+        self.assertIn('django_request_db_queries_count{view="environment:probe"}', body)
+
+
+class GapTrackerTests(TestCase):
+
+    def test_gaps_are_tracked_until_filled_or_expired(self):
+        tail = GapTracker()
+        self.assertFalse(tail.seen(1))
+        self.assertFalse(tail.seen(5))  # 2..4 尚未提交
+        self.assertEqual((tail.position, tail.gaps), (5, 1))
+        self.assertTrue(tail.seen(3))
+        self.assertEqual(tail.gaps, 2)  # 剩下 2 和 4
+        self.assertFalse(tail.seen(3))
+
+        EnvironmentChange.objects.bulk_create([EnvironmentChange(id=i, key=f'G{i}') for i in range(1, 8)])
+        pending = EnvironmentChange.objects.filter(tail.pending()).order_by('id')
+        self.assertEqual(list(pending.values_list('id', flat=True)), [2, 4, 6, 7])
+
+        with override_settings(ENV_LOG_GAP_TIMEOUT=-1):
+            tail.expire()
+        self.assertEqual(tail.gaps, 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class PropagationTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def change(self, pk, key, value, **kwargs):
+        return EnvironmentChange.objects.create(
+            id=pk, key=key, operation='set' if value is not None else 'delete', value=value,
+            origin='other:1', **kwargs,
+        )
+
+    def test_bootstrap_replays_latest_and_sync_applies_late_commits(self):
+        self.change(1, 'PROP_A', 'old')
+        self.change(2, 'PROP_A', 'new')
+        self.change(3, 'PROP_B', 'b')
+        self.change(4, 'PROP_B', None)
+        propagator = Propagator()
+        propagator.bootstrap()
+        self.assertEqual(os.environ['PROP_A'], 'new')
+        self.assertNotIn('PROP_B', os.environ)
+
+        # id 6 先提交，5 晚到：照样应用并计入 late_applied
+        self.change(6, 'PROP_C', 'c')
+        self.assertEqual(propagator.sync(), 1)
+        self.change(5, 'PROP_D', 'd')
+        self.assertEqual(propagator.sync(), 1)
+        self.assertEqual((os.environ['PROP_C'], os.environ['PROP_D']), ('c', 'd'))
+        state = propagator.state()
+        self.assertEqual((state['version'], state['gaps'], state['late_applied'], state['remote_applied']),
+                         (6, 0, 1, 2))
+        self.assertEqual(propagator.sync(), 0)
+
+    def test_prune_keeps_latest_per_key(self):
+        old = timezone.now() - timedelta(days=30)
+        for pk, key in ((1, 'PRUNE_A'), (2, 'PRUNE_A'), (3, 'PRUNE_B')):
+            self.change(pk, key, 'v')
+        EnvironmentChange.objects.update(created_at=old)
+        self.change(4, 'PRUNE_B', 'v')
+        self.assertEqual(prune_changes(days=7), 2)
+        self.assertEqual(list(EnvironmentChange.objects.values_list('id', flat=True).order_by('id')), [2, 4])
+
+
+@override_settings(**TEST_SETTINGS)
+class WatcherTests(SystemFilesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.profile = os.path.join(self.profile_dir, 'custom_environment.sh')
+        self.write(self.env_file, 'SHARED="etc"\nONLY_ETC="1"\n')
+        self.write(self.profile, "export SHARED='profile'\n")
+        self.sync = EnvFileSync()
+
+    def write(self, path, content):
+        # 与 EnvFileWriter 一样写临时文件后原子替换
+        with open(path + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    def test_profile_overrides_and_only_merged_changes_apply(self):
+        self.assertEqual(self.sync.load(), {'SHARED': 'profile', 'ONLY_ETC': '1'})
+
+        # 被 profile.d 覆盖的键在 /etc/environment 中变化，合并值不变
+        self.write(self.env_file, 'SHARED="etc2"\nONLY_ETC="1"\n')
+        self.assertEqual(self.sync.changes_for([self.env_file]), ({}, []))
+
+        # 删除 profile.d 中的覆盖后回落到 /etc/environment 的值
+        os.remove(self.profile)
+        self.assertEqual(self.sync.changes_for([self.profile]), ({'SHARED': 'etc2'}, []))
+
+        self.write(self.env_file, 'SHARED="etc2"\n')
+        sets, deleted = self.sync.changes_for([self.env_file])
+        self.assertEqual((sets, deleted), ({}, ['ONLY_ETC']))
+
+        EnvironmentVariable.bulk_apply([('ONLY_ETC', '1', '')], scope=None)
+        results, removed = self.sync.apply({'SHARED': 'etc2'}, deleted)
+        self.assertEqual((results, removed), ({'SHARED': 'created'}, 1))
+        self.assertEqual(list(EnvironmentVariable.objects.values_list('key', 'value')), [('SHARED', 'etc2')])
+
+    def assert_detects_replace(self, watcher):
+        self.addCleanup(watcher.close)
+        self.write(self.profile, "export SHARED='changed'\n")
+        self.write(os.path.join(self.profile_dir, 'other.txt'), 'ignored')
+        self.assertEqual(watcher.wait(1), {self.profile})
+
+    def test_polling_watcher_detects_replaced_file(self):
+        self.assert_detects_replace(PollingWatcher(self.sync.list_files, 0))
+
+    def test_inotify_watcher_detects_replaced_file(self):
+        try:
+            watcher = InotifyWatcher([self.tmp, self.profile_dir], self.sync.is_relevant)
+        except (OSError, AttributeError) as e:
+            self.skipTest(f'inotify 不可用: {e}')
+        self.assert_detects_replace(watcher)
+
+
+@override_settings(**TEST_SETTINGS, ENV_BUNDLE_TOKEN='agent', ENV_BUNDLE_RECHECK=60)
+class BundleTests(TestCase):
+
+    def setUp(self):
+        bundle_cache._entry = None
+        bundle_cache.invalidate()
+        self.addCleanup(bundle_cache.invalidate)
+        EnvironmentVariable.bulk_apply([('BUNDLE_A', 'a b', ''), ('BUNDLE_B', '2', '')], scope=None)
+
+    def get(self, **headers):
+        return self.client.get(reverse('environment:bundle'), HTTP_AUTHORIZATION='Bearer agent', **headers)
+
+    def test_conditional_get_and_precompressed_variants(self):
+        self.assertEqual(self.client.get(reverse('environment:bundle')).status_code, 403)
+        builds = bundle_cache.builds
+        response = self.get()
+        self.assertEqual(response.content, b'BUNDLE_A="a b"\nBUNDLE_B="2"\n')
+        etag = response['ETag']
+
+        compressed = self.get(HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+        self.assertEqual(compressed['ETag'], etag[:-1] + '-gzip"')
+
+        # 缓存有效期内 304 不查询数据库，任一编码变体的 ETag 都算命中
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=compressed['ETag']).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(bundle_cache.builds, builds + 1)
+
+    def test_change_invalidates_bundle(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            EnvironmentVariable.bulk_apply([('BUNDLE_B', '3', '')], scope=None)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'BUNDLE_B="3"', response.content)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_choose_encoding(self):
+        variants = {'identity': b'', 'gzip': b''}
+        self.assertEqual(choose_encoding('br, gzip', variants), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0', variants), 'identity')
+        self.assertEqual(choose_encoding('*', variants), 'gzip')
+        self.assertEqual(choose_encoding(None, variants), 'identity')
+
+
+@override_settings(**TEST_SETTINGS, ENV_BUNDLE_TOKEN='agent', ENV_FEED_POLL=5, ENV_FEED_BUFFER=3,
+                   ENV_FEED_QUEUE=10, ENV_FEED_HEARTBEAT=0.05, ENV_FEED_MAX_AGE=5)
+class ChangeFeedTests(TestCase):
+
+    async def start(self, feed, last_id=None):
+        stream = feed.stream(last_id)
+        self.assertTrue((await anext(stream)).startswith('retry: '))
+        return stream
+
+    async def write(self, feed, *keys):
+        await sync_to_async(EnvironmentVariable.bulk_apply)([(key, 'v', '') for key in keys], scope=None)
+        feed.notify()
+
+    async def next_event(self, stream):
+        while True:
+            chunk = await anext(stream)
+            if not chunk.startswith(': ping'):
+                return chunk
+
+    async def test_delivers_replays_and_resets(self):
+        feed = ChangeFeed()
+        stream = await self.start(feed)
+        try:
+            await self.write(feed, 'FEED_A')
+            chunk = await self.next_event(stream)
+            self.assertIn('event: change', chunk)
+            self.assertIn('"key":"FEED_A"', chunk)
+            first = feed.version
+
+            # 重连时从缓冲区补发 Last-Event-ID 之后的事件
+            await self.write(feed, 'FEED_B')
+            await self.next_event(stream)
+            replay = await self.start(feed, last_id=first)
+            self.assertIn('"key":"FEED_B"', await anext(replay))
+            await replay.aclose()
+
+            # 缺口超出缓冲区时发送 reset
+            await self.write(feed, 'FEED_C', 'FEED_D', 'FEED_E')
+            for _ in range(3):
+                await self.next_event(stream)
+            reset = await self.start(feed, last_id=first)
+            self.assertTrue((await anext(reset)).startswith('event: reset'))
+            await reset.aclose()
+        finally:
+            await stream.aclose()
+            feed._task.cancel()
+
+    async def test_slow_consumer_gets_reset(self):
+        feed = ChangeFeed()
+        with self.settings(ENV_FEED_QUEUE=2):
+            stream = await self.start(feed)
+        try:
+            queue = next(iter(feed._subscribers))
+            for version in range(3):
+                feed._deliver(queue, {'version': version, 'key': 'K', 'operation': 'set'})
+            self.assertEqual(feed.stats()['subscribers'], 0)
+            self.assertTrue((await self.next_event(stream)).startswith('event: reset'))
+        finally:
+            await stream.aclose()
+            feed._task.cancel()
+
+    def test_view_requires_agent_token(self):
+        self.assertEqual(self.client.get(reverse('environment:feed')).status_code, 403)
+        response = self.client.get(reverse('environment:feed'), HTTP_AUTHORIZATION='Bearer agent')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        response.close()
+
+
+class StaticStorageTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        source = os.path.join(tmp, 'static')
+        self.root = os.path.join(tmp, 'root')
+        os.makedirs(os.path.join(source, 'css'))
+        os.makedirs(os.path.join(source, 'js'))
+        with open(os.path.join(source, 'css', 'bootstrap-icons.css'), 'w') as f:
+            # 公共规则足够长，裁剪后仍超过压缩阈值
+            f.write('.bi::before { display: inline-block; vertical-align: -.125em; }\n' * 20)
+            f.write('.bi-gear::before { content: "\\f3e5"; }\n.bi-unused-icon::before { content: "\\f000"; }\n')
+        with open(os.path.join(source, 'js', 'app.js'), 'w') as f:
+            f.write('button.className = "bi bi-gear";\n')
+        override = override_settings(
+            STATICFILES_DIRS=[source],
+            STATIC_ROOT=self.root,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'helloDjango.staticfiles.CompressedManifestStaticFilesStorage'},
+            },
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_trim_keeps_used_icons(self):
+        css = '.bi-gear::before { content: "a"; }\n.bi-x::before { content: "b"; }\n'
+        self.assertEqual(trim_icon_css(css, {'gear'}), '.bi-gear::before { content: "a"; }\n')
+
+    def test_collectstatic_hashes_trims_and_precompresses(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(self.root, 'staticfiles.json')) as f:
+            name = json.load(f)['paths']['css/bootstrap-icons.css']
+        path = os.path.join(self.root, name)
+        with open(path, 'rb') as f:
+            css = f.read()
+        self.assertIn(b'.bi-gear::before', css)
+        self.assertNotIn(b'unused-icon', css)
+        with open(path + '.gz', 'rb') as f:
+            self.assertEqual(gzip.decompress(f.read()), css)
+
+        factory = RequestFactory()
+        response = serve_static(factory.get('/', HTTP_ACCEPT_ENCODING='gzip'), name)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], IMMUTABLE)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), css)
+
+        plain = serve_static(factory.get('/'), 'css/bootstrap-icons.css')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(plain['Cache-Control'], IMMUTABLE)
+        cached = serve_static(factory.get('/', HTTP_IF_MODIFIED_SINCE=plain['Last-Modified']), name)
+        self.assertEqual(cached.status_code, 304)
+
+        with self.assertRaises(Http404):
+            serve_static(factory.get('/'), 'css/missing.css')
+        with self.assertRaises(SuspiciousFileOperation):
+            serve_static(factory.get('/'), '../../etc/passwd')
+
+
+@override_settings(**TEST_SETTINGS)
+class BaselineMigrationTests(TransactionTestCase):
+    """已有部署只记录了 0001_initial（只有 EnvironmentVariable 表），升级到最新迁移"""
+
+    def test_upgrade_from_baseline(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('environment', '0001_initial')])
+        old_apps = executor.loader.project_state([('environment', '0001_initial')]).apps
+        Variable = old_apps.get_model('environment', 'EnvironmentVariable')
+        big = 'line\n' * 2000
+        Variable.objects.create(key='BASE_BIG', value=big)
+        Variable.objects.create(key='BASE_SMALL', value='v')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        stored = EnvironmentVariable.objects.values('value_data', 'value_hash').get(key='BASE_BIG')
+        self.assertIsNotNone(stored['value_data'])
+        self.assertEqual(stored['value_hash'], hashlib.md5(big.encode()).hexdigest())
+        self.assertEqual(EnvironmentVariable.objects.get(key='BASE_BIG').value, big)
+        self.assertEqual(EnvironmentVariable.objects.get(key='BASE_SMALL').value, 'v')
+        self.assertEqual(VariableRevision.objects.count(), 0)
+
+        # 回退到压缩存储之前：完整值还原到 value 列
+        executor = MigrationExecutor(connection)
+        executor.migrate([('environment', '0003_replication')])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT value FROM environment_environmentvariable WHERE key = 'BASE_BIG'")
+            self.assertEqual(cursor.fetchone()[0], big)
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
@@ -0,0 +1,174 @@
+import json
+import shlex
+
+from django.conf import settings
+from django.db import transaction
+
+from .envfile import quote_dotenv, unquote_dotenv
+from .models import EnvironmentVariable
+from .propagation import record_changes
+
+EXPORT_FORMATS = {
+    'env': ('text/plain; charset=utf-8', 'environment.env'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'environment.jsonl'),
+    'shell': ('text/x-shellscript; charset=utf-8', 'environment.sh'),
+    'md5': ('text/plain; charset=utf-8', 'environment.md5'),  # KEY=md5(原值)，用于比较，不能导入
+}
+
+
+def format_line(key, value, description, fmt):
+    if fmt == 'jsonl':
+        return json.dumps({'key': key, 'value': value, 'description': description},
+                          ensure_ascii=False) + '\n'
+    if fmt == 'shell':
+        return f'export {key}={shlex.quote(value)}\n'
+    return f'{key}={quote_dotenv(value)}\n'
+
+
+def resolved_lookup(resolved=None):
+    """导出时取值的函数：启用插值时返回解析后的值，resolved=False 时导出原值（用于备份后再导入）"""
+    if resolved is None:
+        resolved = settings.ENV_INTERPOLATION
+    if not resolved:
+        return None
+    from .interpolation import get_resolver
+    resolver = get_resolver()
+
+    def lookup(key, value):
+        result = resolver.resolve(key)
+        return value if result is None else result
+    return lookup
+
+
+def export_lines(fmt='env', queryset=None, chunk_size=2000, resolved=None):
+    """逐行生成导出内容，底层用 iterator(chunk_size) 分批读取，内存占用与总行数无关"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    if queryset is None:
+        queryset = EnvironmentVariable.objects.all()
+    if fmt == 'md5':
+        # 只读取写入时保存的哈希，不读取值本身；两个实例的输出可以直接 diff
+        rows = queryset.order_by('key').values_list('key', 'value_hash')
+        for key, digest in rows.iterator(chunk_size=chunk_size):
+            yield f'{key}={digest}\n'
+        return
+    lookup = resolved_lookup(resolved)
+    rows = queryset.order_by('key').values_full('key', 'value', 'description', chunk_size=chunk_size)
+    if fmt == 'shell':
+        yield '#!/bin/sh\n'
+    for key, value, description in rows:
+        if lookup is not None:
+            value = lookup(key, value)
+        yield format_line(key, value, description, fmt)
+
+
+def parse_line(line, fmt='auto'):
+    """解析一行导入内容，返回 (key, value, description)，空行和注释返回 None
+
+    description 为 None 表示保留数据库中原有描述。
+    """
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#'):
+        return None
+    if fmt == 'jsonl' or (fmt == 'auto' and stripped.startswith('{')):
+        item = json.loads(stripped)
+        if not isinstance(item, dict):
+            raise ValueError(f'应为 JSON 对象: {stripped[:50]}')
+        return str(item['key']), str(item['value']), item.get('description')
+
+    if stripped.startswith('export '):
+        stripped = stripped[len('export '):].lstrip()
+    if '=' not in stripped:
+        raise ValueError(f'格式错误，应为 KEY=value: {stripped[:50]}')
+    key, raw = stripped.split('=', 1)
+    key, raw = key.strip(), raw.strip()
+    if fmt == 'shell' or raw.startswith("'"):
+        try:
+            parts = shlex.split(raw)
+        except ValueError:
+            raise IncompleteLine(f'引号未闭合: {stripped[:50]}')
+        value = parts[0] if parts else ''
+    else:
+        value = unquote_dotenv(raw)
+    return key, value, None
+
+
+class IncompleteLine(ValueError):
+    """单引号值跨行（shell 导出的多行值），需要与后续行拼接后再解析"""
+
+
+def iter_entries(lines, fmt='auto', max_length=1 << 20):
+    """增量解析可迭代的行（文件对象、上传文件、stdin），bytes 按 utf-8 解码
+
+    shell 格式中跨行的单引号值与后续行拼接，单条记录最长 max_length 个字符。
+    """
+    buffered, first = '', None
+    for lineno, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if buffered:
+            line = buffered + line
+            buffered = ''
+        try:
+            entry = parse_line(line, fmt)
+        except IncompleteLine:
+            if len(line) > max_length:
+                raise ValueError(f'第 {first or lineno} 行: 引号未闭合')
+            buffered, first = line, first or lineno
+            continue
+        except (ValueError, KeyError) as e:
+            raise ValueError(f'第 {first or lineno} 行: {e}')
+        if entry is None:
+            continue
+        key = entry[0]
+        if not key.isidentifier() or len(key) > 100:
+            raise ValueError(f'第 {first or lineno} 行: 变量名无效 {key[:100]}')
+        first = None
+        yield entry
+    if buffered:
+        raise ValueError(f'第 {first} 行: 引号未闭合')
+
+
+def _batches(entries, size):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_entries(entries, batch_size=1000, scope=None):
+    """边解析边在一个事务中分批 upsert；scope 为 None 时只写数据库不应用到系统
+
+    entries 可以是 iter_entries 返回的生成器，内存中只保留当前一批和已出现的键。
+    任一行格式错误或中途出错时抛出异常，整个导入回滚。
+    返回 created/updated/unchanged 计数，同一个键多次出现只计一次。
+    """
+    statuses = {}
+    with transaction.atomic():
+        for batch in _batches(entries, batch_size):
+            results = EnvironmentVariable.bulk_apply(batch, scope=None, batch_size=batch_size)
+            for key, status in results.items():
+                # 先新建后更新仍算新建，任一次变化都不算未变
+                if statuses.get(key, 'unchanged') == 'unchanged':
+                    statuses[key] = status
+        changed = sorted(key for key, status in statuses.items() if status != 'unchanged')
+        if scope is not None and changed:
+            # 所有批次写库成功后一次性应用到系统（值从库中读回），失败时整个导入回滚
+            variables = []
+            for start in range(0, len(changed), batch_size):
+                rows = EnvironmentVariable.objects.filter(key__in=changed[start:start + batch_size])
+                variables.extend(
+                    EnvironmentVariable(key=key, value=value) for key, value in rows.values_full('key', 'value')
+                )
+            values = EnvironmentVariable.system_values(variables)
+            if not EnvironmentVariable.apply_batch_to_system(variables, [], scope=scope, values=values):
+                raise PermissionError("需要sudo权限来修改系统环境变量文件")
+            record_changes(list(values.items()), scope=scope)
+    summary = {'created': 0, 'updated': 0, 'unchanged': 0}
+    for status in statuses.values():
+        summary[status] += 1
+    return summary
@@ -7,6 +7,21 @@ urlpatterns = [
     path('', views.environment_list, name='list'),
     path('add/', views.environment_edit, name='add'),
     path('edit/<int:pk>/', views.environment_edit, name='edit'),
+    path('bulk/', views.environment_bulk_edit, name='bulk'),
+    path('export/', views.environment_export, name='export'),
+    path('bundle/', views.environment_bundle, name='bundle'),
+    path('feed/', views.environment_feed, name='feed'),
+    path('import/', views.environment_import, name='import'),
+    path('value/<int:pk>/', views.environment_value, name='value'),
     path('delete/<int:pk>/', views.environment_delete, name='delete'),
+    path('history/', views.environment_history, name='history'),
+    path('history/state/', views.environment_history_state, name='history_state'),
+    path('history/changes/', views.environment_changes, name='changes'),
+    path('history/<int:pk>/', views.environment_revision, name='revision'),
+    path('history/rollback/', views.environment_rollback, name='rollback'),
     path('refresh/', views.environment_list, name='refresh'),
+    path('drift/', views.environment_drift, name='drift'),
+    path('probe/', views.environment_probe, name='probe'),
+    path('db-pool/', views.environment_db_pool, name='db_pool'),
+    path('propagation/', views.environment_propagation, name='propagation'),
 ]
\ No newline at end of file
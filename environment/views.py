@@ -1,105 +1,254 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import asyncio
+import hmac
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseNotModified,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_protect
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from .models import EnvironmentVariable
-from .forms import EnvironmentVariableForm
-import os
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET, require_POST
+from helloDjango.dbpool import pool_stats
 
+from .aio import aget_object_or_404, aiter_chunks, async_permission_required
+from .bundle import BUNDLE_FORMATS, bundle_cache, choose_encoding, etag_matches, variant_etag
+from .drift import compute_drift
+from .feed import change_feed
+from .forms import EnvironmentVariableForm, BulkEditForm, BulkVariableFormSet, RollbackForm
+from .fragments import fragment_key, get_fragment, set_fragment, table_version
+from .history import resolve_revision, revision_value, rollback_to, state_at
+from .models import EnvironmentVariable, VariableRevision
+from .pagination import InvalidCursor, KeysetPaginator, acached_count, decode_cursor
+from .probe import probe
+from .propagation import propagator
+from .replication import MAX_PAGE, ReplicationError, changes_page, snapshot_page
+from .search import search_variables
+from .transfer import EXPORT_FORMATS, export_lines, import_entries, iter_entries
 
-from django.http import HttpResponseForbidden
 
 def check_sudo_permission(view_func):
-    """检查是否有sudo权限的装饰器"""
+    """检查是否有sudo权限的装饰器（使用按进程缓存的探测结果，不读写磁盘）"""
+    if asyncio.iscoroutinefunction(view_func):
+        async def async_wrapper(request, *args, **kwargs):
+            if not probe.is_writable():
+                return HttpResponseForbidden("没有足够的权限修改系统环境变量")
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
     def wrapper(request, *args, **kwargs):
-        # 检查是否有写入系统文件的权限
-        test_file = '/etc/environment.test'
-        try:
-            with open(test_file, 'w') as f:
-                f.write('test')
-            os.remove(test_file)
-            return view_func(request, *args, **kwargs)
-        except PermissionError:
+        if not probe.is_writable():
             return HttpResponseForbidden("没有足够的权限修改系统环境变量")
+        return view_func(request, *args, **kwargs)
     return wrapper
 
 
-@check_sudo_permission
 @login_required
 @permission_required('environment.change_environmentvariable', raise_exception=True)
-def environment_list(request):
-    """环境变量列表（带分页和搜索）"""
+def environment_probe(request):
+    """当前进程的系统文件权限探测状态"""
+    return JsonResponse(probe.state())
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_db_pool(request):
+    """当前 worker 的数据库连接池指标（未启用连接池时为空）"""
+    return JsonResponse({'pid': os.getpid(), 'pools': pool_stats()})
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_propagation(request):
+    """当前 worker 的跨进程同步状态：已应用版本号和传播延迟，以及变更推送的连接数"""
+    return JsonResponse({**propagator.state(), 'feed': change_feed.stats()})
+
+
+def _agent_authorized(request):
+    """部署代理使用 Authorization: Bearer <ENV_BUNDLE_TOKEN>，浏览器使用登录会话（打包和变更推送共用）"""
+    token = settings.ENV_BUNDLE_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer '):
+        return hmac.compare_digest(header[len('Bearer '):].strip(), token)
+    return request.user.has_perm('environment.view_environmentvariable')
+
+
+@require_GET
+def environment_bundle(request):
+    """全部变量的 .env / JSON 打包，?format=env|json
+
+    内容预先生成并缓存在内存中，带强 ETag；If-None-Match 命中时返回 304，
+    按 Accept-Encoding 直接返回预压缩的 br / gzip 版本。
+    """
+    if not _agent_authorized(request):
+        return HttpResponseForbidden('没有权限读取环境变量')
+    fmt = request.GET.get('format', 'env')
+    if fmt not in BUNDLE_FORMATS:
+        return HttpResponseBadRequest(f'不支持的格式: {fmt}')
+
+    entry = bundle_cache.get()
+    bundle = entry['formats'][fmt]
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), bundle['variants'])
+
+    if etag_matches(request.headers.get('If-None-Match'), bundle['etag']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(bundle['variants'][encoding], content_type=BUNDLE_FORMATS[fmt])
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+    response['ETag'] = variant_etag(bundle['etag'], encoding)
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = 'private, no-cache'
+    response['X-Env-Revision'] = str(entry['revision'])
+    return response
+
+
+async def environment_feed(request):
+    """变更事件推送（Server-Sent Events，需运行在 ASGI 下）
+
+    每条事件包含 key、operation 和全局递增的 version（即 SSE 的 id），
+    重连时按 Last-Event-ID 从缓冲区补发错过的事件；缺口超出缓冲区时发送 reset 事件，
+    客户端应重新拉取 /bundle/。
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not await sync_to_async(_agent_authorized)(request):
+        return HttpResponseForbidden('没有权限读取环境变量')
+
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    response = StreamingHttpResponse(change_feed.stream(last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx 不缓冲，事件立即送达
+    return response
+
+
+@check_sudo_permission
+@async_permission_required('environment.change_environmentvariable')
+async def environment_list(request):
+    """环境变量列表（带分页和搜索，异步视图）"""
     # 从系统加载最新值
     if request.GET.get('refresh'):
-        EnvironmentVariable.load_from_system()
-        messages.success(request, '已从系统刷新环境变量')
+        summary = await sync_to_async(EnvironmentVariable.load_from_system)()
+        messages.success(
+            request,
+            f'已从系统刷新环境变量：新增 {summary["inserted"]} 个，'
+            f'更新 {summary["changed"]} 个，未变 {summary["unchanged"]} 个'
+        )
         return redirect('environment:refresh')
 
     # 获取搜索参数
     search_query = request.GET.get('search', '')
 
-    # 获取所有变量并排序
+    # 获取所有变量；搜索时按相关度排序。只读取值的前缀和长度，完整值在编辑页或“查看”时读取
     if search_query:
-        variables_list = EnvironmentVariable.objects.filter(
-            key__icontains=search_query
-        ).order_by('key')
+        variables_list = search_variables(EnvironmentVariable.objects.with_preview(), search_query)
+        ordering = ('-rank', 'key')
     else:
-        variables_list = EnvironmentVariable.objects.all().order_by('key')
+        variables_list = EnvironmentVariable.objects.with_preview()
+        ordering = ('key',)
 
-    # 分页设置
-    paginator = Paginator(variables_list, 10)  # 每页显示10条
-    page = request.GET.get('page')
+    # 无效游标按第一页处理，也不作为缓存键的一部分
+    cursor = request.GET.get('cursor') or ''
+    if cursor:
+        try:
+            decode_cursor(cursor, len(ordering))
+        except InvalidCursor:
+            cursor = ''
+
+    # 表格和分页片段按 表版本号 + 游标 + 搜索词 缓存；任何变量修改都会更新版本号
+    # 版本号在共享缓存中（文件或 Redis），放到线程中读取
+    version = await sync_to_async(table_version)()
+    key = fragment_key('list', version, cursor, search_query)
+    fragment = get_fragment(key)
+    if fragment is None:
+        # 游标分页：按排序键定位，深页与第一页开销相同
+        paginator = KeysetPaginator(variables_list, 10, ordering)  # 每页显示10条
+        variables = await paginator.apage(cursor or None)
+        total_count, count_estimated = await acached_count(variables_list, search_query, version)
+        fragment = {
+            'table_html': render_to_string('environment/list_table.html', {
+                'variables': variables,
+                'total_count': total_count,
+                'count_estimated': count_estimated,
+                'search_query': search_query,
+            }),
+            'total_count': total_count,
+            'count_estimated': count_estimated,
+        }
+        set_fragment(key, fragment)
+
+    return render(request, 'environment/list.html', {**fragment, 'search_query': search_query})
 
-    try:
-        variables = paginator.page(page)
-    except PageNotAnInteger:
-        variables = paginator.page(1)
-    except EmptyPage:
-        variables = paginator.page(paginator.num_pages)
-
-    return render(request, 'environment/list.html', {
-        'variables': variables,
-        'system_env': dict(os.environ),
-        'search_query': search_query
-    })
+
+def _value_etag(request, pk):
+    return EnvironmentVariable.objects.filter(pk=pk).values_list('value_hash', flat=True).first()
 
 
 @login_required
-@permission_required('environment.add_environmentvariable', raise_exception=True)
-@csrf_protect
-def environment_edit(request, pk=None):
-    """编辑环境变量 - 修正版本"""
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+@condition(etag_func=_value_etag)
+def environment_value(request, pk):
+    """单个变量的完整值（列表页只显示前缀）；ETag 为内容哈希，未变化时不读取值本身"""
+    variable = get_object_or_404(EnvironmentVariable, pk=pk)
+    return HttpResponse(variable.value, content_type='text/plain; charset=utf-8')
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_drift(request):
+    """系统环境与数据库的差异面板，列表页按需异步加载"""
+    drift = compute_drift()
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse(drift)
+    return render(request, 'environment/drift_panel.html', drift)
+
+
+@async_permission_required('environment.add_environmentvariable')
+async def environment_edit(request, pk=None):
+    """编辑环境变量（异步视图，CSRF 由 CsrfViewMiddleware 校验）"""
     if pk:
-        variable = get_object_or_404(EnvironmentVariable, pk=pk)
+        variable = await aget_object_or_404(EnvironmentVariable, pk=pk)
+        original_key = variable.key  # 表单校验时会修改 instance
     else:
         variable = None
+        original_key = None
 
     if request.method == 'POST':
         form = EnvironmentVariableForm(request.POST, instance=variable)
-        if form.is_valid():
+        # 唯一性校验需要查库
+        if await sync_to_async(form.is_valid)():
+            var = form.save(commit=False)
+            scope = form.cleaned_data['scope']
+            renamed = original_key is not None and original_key != var.key
             try:
-                var = form.save(commit=False)
-                scope = form.cleaned_data['scope']
-                
-                # 应用到系统
-                success = var.apply_to_system(scope)
-                
-                if success or scope == 'session':
-                    var.save()
-                    messages.success(request, f'环境变量 {var.key} 已{"更新" if pk else "创建"}并应用到{scope}范围')
-                    
-                    if scope == 'global':
-                        messages.info(request, '全局环境变量修改已写入系统文件，部分服务可能需要重启才能生效')
-                    
-                    return redirect('environment:refresh')
-                else:
-                    messages.error(request, '应用到系统失败，可能需要sudo权限或检查文件路径')
-                    
+                # 写库、历史版本、变更通知和系统文件在 bulk_apply 的一个事务中完成，任一步失败整体回滚；
+                # 改名时旧变量同时从库、系统文件和各 worker 的进程环境中删除
+                await sync_to_async(EnvironmentVariable.bulk_apply)(
+                    [(var.key, var.value, var.description)],
+                    scope=scope,
+                    removed_keys=[original_key] if renamed else (),
+                )
             except PermissionError as e:
-                messages.error(request, f'权限不足: {e}')
+                probe.invalidate()
+                messages.error(request, f'应用到系统失败，未保存: {e}')
             except Exception as e:
                 messages.error(request, f'操作失败: {e}')
+            else:
+                messages.success(request, f'环境变量 {var.key} 已{"更新" if pk else "创建"}并应用到{scope}范围')
+                if scope == 'global':
+                    messages.info(request, '全局环境变量修改已写入系统文件，部分服务可能需要重启才能生效')
+                return redirect('environment:refresh')
     else:
         form = EnvironmentVariableForm(instance=variable)
 
@@ -110,30 +259,246 @@ def environment_edit(request, pk=None):
 
 
 @login_required
-@permission_required('environment.delete_environmentvariable', raise_exception=True)
-def environment_delete(request, pk):
-    """删除环境变量"""
-    variable = get_object_or_404(EnvironmentVariable, pk=pk)
+@permission_required(
+    ['environment.add_environmentvariable', 'environment.change_environmentvariable'],
+    raise_exception=True
+)
+@csrf_protect
+def environment_bulk_edit(request):
+    """批量编辑：表格和粘贴内容一起校验，一个事务写库、一次写系统文件"""
+    results = None
+    wants_json = 'application/json' in request.headers.get('Accept', '')
 
     if request.method == 'POST':
-        key = variable.key
-        variable.delete()
+        form = BulkEditForm(request.POST)
+        formset = BulkVariableFormSet(request.POST, prefix='rows')
+        if form.is_valid() and formset.is_valid():
+            entries = [
+                (row['key'], row['value'], row['description'] or None)
+                for row in formset.cleaned_data if row.get('key')
+            ] + form.cleaned_data['payload']
+            scope = form.cleaned_data['scope']
+
+            if not entries:
+                form.add_error(None, '没有需要保存的变量')
+            else:
+                try:
+                    results = EnvironmentVariable.bulk_apply(entries, scope=scope)
+                except PermissionError as e:
+                    probe.invalidate()
+                    form.add_error(None, f'权限不足: {e}')
+                except Exception as e:
+                    form.add_error(None, f'操作失败: {e}')
+
+        if wants_json:
+            if results is None:
+                errors = dict(form.errors)
+                errors['rows'] = [row_errors for row_errors in formset.errors if row_errors]
+                return JsonResponse({'ok': False, 'errors': errors}, status=400)
+            return JsonResponse({'ok': True, 'results': results})
 
-        # 从系统中移除（可选）
+        if results is not None:
+            changed = sum(1 for status in results.values() if status != 'unchanged')
+            messages.success(request, f'已处理 {len(results)} 个变量，其中 {changed} 个有变化并已应用到{scope}范围')
+            form = BulkEditForm(initial={'scope': scope})
+            formset = BulkVariableFormSet(prefix='rows')
+    else:
+        form = BulkEditForm()
+        formset = BulkVariableFormSet(prefix='rows')
+
+    return render(request, 'environment/bulk_edit.html', {
+        'form': form,
+        'formset': formset,
+        'results': sorted(results.items()) if results else None,
+    })
+
+
+@async_permission_required('environment.change_environmentvariable')
+async def environment_export(request):
+    """流式导出全部变量，?format=env|jsonl|shell；启用插值时导出解析后的值，?resolved=0 导出原值"""
+    fmt = request.GET.get('format', 'env')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'不支持的导出格式: {fmt}')
+    content_type, filename = EXPORT_FORMATS[fmt]
+    resolved = False if request.GET.get('resolved') == '0' else None
+    response = StreamingHttpResponse(aiter_chunks(export_lines(fmt, resolved=resolved)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@permission_required(
+    ['environment.add_environmentvariable', 'environment.change_environmentvariable'],
+    raise_exception=True
+)
+@require_POST
+@csrf_protect
+def environment_import(request):
+    """上传 .env / JSON Lines / shell 文件，在一个事务中边解析边分批 upsert，任一行出错整体回滚"""
+    upload = request.FILES.get('file')
+    scope = request.POST.get('scope') or None
+    wants_json = 'application/json' in request.headers.get('Accept', '')
+
+    error = None
+    if upload is None:
+        error = '请选择要导入的文件'
+    elif scope not in (None, 'global', 'session'):
+        error = f'无效的生效范围: {scope}'
+    else:
         try:
-            env_file = '/etc/environment'
-            if os.path.exists(env_file) and os.access(env_file, os.W_OK):
-                with open(env_file, 'r') as f:
-                    lines = f.readlines()
-
-                with open(env_file, 'w') as f:
-                    for line in lines:
-                        if not line.startswith(f'{key}='):
-                            f.write(line)
-        except:
-            pass
+            summary = import_entries(iter_entries(upload, request.POST.get('format', 'auto')), scope=scope)
+        except ValueError as e:
+            error = f'导入失败: {e}'
+        except PermissionError as e:
+            probe.invalidate()
+            error = f'权限不足: {e}'
+
+    if wants_json:
+        if error:
+            return JsonResponse({'ok': False, 'error': error}, status=400)
+        return JsonResponse({'ok': True, 'summary': summary})
+    if error:
+        messages.error(request, error)
+    else:
+        messages.success(
+            request,
+            f'导入完成：新建 {summary["created"]} 个，更新 {summary["updated"]} 个，未变 {summary["unchanged"]} 个'
+        )
+    return redirect('environment:bulk')
+
+
+@async_permission_required('environment.delete_environmentvariable')
+async def environment_delete(request, pk):
+    """删除环境变量（异步视图）"""
+    variable = await aget_object_or_404(EnvironmentVariable, pk=pk)
+
+    if request.method == 'POST':
+        key = variable.key
+        try:
+            # 删除、历史版本、变更通知和系统文件在一个事务中完成，系统文件写入失败时不删除
+            await sync_to_async(EnvironmentVariable.bulk_apply)([], removed_keys=[key], scope='global')
+        except PermissionError as e:
+            probe.invalidate()
+            messages.error(request, f'从系统文件中移除 {key} 失败，未删除: {e}')
+            return redirect('environment:list')
+        except Exception as e:
+            messages.error(request, f'删除失败: {e}')
+            return redirect('environment:list')
 
         messages.success(request, f'环境变量 {key} 已删除')
         return redirect('environment:list')
 
-    return render(request, 'environment/delete_confirm.html', {'variable': variable})
\ No newline at end of file
+    return render(request, 'environment/delete_confirm.html', {'variable': variable})
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_history(request):
+    """历史版本列表（按版本号倒序游标分页），?key= 只看单个变量"""
+    key = request.GET.get('key', '')
+    revisions = VariableRevision.objects.defer('payload')
+    if key:
+        revisions = revisions.filter(key=key)
+    paginator = KeysetPaginator(revisions, 20, ('-id',))
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
+
+    return render(request, 'environment/history.html', {
+        'revisions': page,
+        'key': key,
+        'form': RollbackForm(),
+    })
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_history_state(request):
+    """重建某一版本号或时间点的全部变量，?revision= 或 ?at=（ISO 时间）"""
+    form = RollbackForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'ok': False, 'errors': form.errors}, status=400)
+    at, revision = form.cleaned_data['at'], form.cleaned_data['revision']
+    state = state_at(at, revision)
+    return JsonResponse({
+        'ok': True,
+        'revision': resolve_revision(at, revision),
+        'variables': {key: {'value': value, 'description': description}
+                      for key, (value, description) in sorted(state.items())},
+    })
+
+
+@require_GET
+@gzip_page
+def environment_changes(request):
+    """供其他实例复制的变更日志（Bearer token 或登录会话）
+
+    ?since=<版本号>&limit= 返回其后的变更；
+    ?snapshot=latest|<版本号>&after=<键名>&limit= 分页返回快照，用于首次全量同步。
+    """
+    if not _agent_authorized(request):
+        return HttpResponseForbidden('没有权限读取环境变量')
+    snapshot = request.GET.get('snapshot')
+    try:
+        limit = min(max(int(request.GET.get('limit', settings.ENV_REPLICATION_BATCH)), 1), MAX_PAGE)
+        since = int(request.GET.get('since', 0))
+        revision = None if snapshot in (None, 'latest') else int(snapshot)
+    except ValueError:
+        return HttpResponseBadRequest('参数必须是整数')
+    if snapshot is None:
+        return JsonResponse(changes_page(since, limit))
+    try:
+        return JsonResponse(snapshot_page(revision, request.GET.get('after', ''), limit))
+    except ReplicationError as e:
+        return JsonResponse({'ok': False, 'error': str(e)}, status=404)
+
+
+@login_required
+@permission_required('environment.change_environmentvariable', raise_exception=True)
+def environment_revision(request, pk):
+    """单个历史版本的完整值（列表页只显示元数据）"""
+    try:
+        revision = VariableRevision.objects.get(pk=pk)
+    except VariableRevision.DoesNotExist:
+        return JsonResponse({'ok': False, 'error': '版本不存在'}, status=404)
+    return JsonResponse({
+        'ok': True,
+        'id': revision.pk,
+        'key': revision.key,
+        'operation': revision.operation,
+        'value': revision_value(revision),
+        'description': revision.description,
+        'created_at': revision.created_at.isoformat(),
+    })
+
+
+@login_required
+@permission_required(
+    ['environment.add_environmentvariable', 'environment.change_environmentvariable',
+     'environment.delete_environmentvariable'],
+    raise_exception=True
+)
+@require_POST
+@csrf_protect
+def environment_rollback(request):
+    """回滚到指定版本号或时间点：一个事务写库，批量写入器一次更新系统文件"""
+    form = RollbackForm(request.POST)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(request, error)
+        return redirect('environment:history')
+
+    try:
+        results = rollback_to(
+            form.cleaned_data['at'], form.cleaned_data['revision'], scope=form.cleaned_data['scope']
+        )
+    except PermissionError as e:
+        probe.invalidate()
+        messages.error(request, f'权限不足: {e}')
+        return redirect('environment:history')
+
+    changed = sum(1 for status in results.values() if status != 'unchanged')
+    messages.success(request, f'已回滚，{changed} 个变量有变化')
+    return redirect('environment:history')
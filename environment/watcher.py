@@ -0,0 +1,223 @@
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import struct
+import time
+
+from django.conf import settings
+
+from .envfile import parse_env_line
+from .interpolation import get_resolver
+from .models import EnvironmentVariable
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PATTERN = 'custom_*.sh'
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """通过 libc 的 inotify 监听目录，只返回关注的文件的变更"""
+
+    def __init__(self, directories, is_relevant):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self._dirs = {}
+        for directory in directories:
+            # 监听目录而不是文件：os.replace 原子替换后文件 inode 会变化
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), f'无法监听 {directory}')
+            self._dirs[wd] = directory
+        self._is_relevant = is_relevant
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode()
+            offset += length
+            path = os.path.join(self._dirs.get(wd, ''), name)
+            if name and self._is_relevant(path):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """不支持 inotify 时按 stat 结果（mtime、大小、inode）轮询"""
+
+    def __init__(self, list_files, interval):
+        self._list_files = list_files
+        self._interval = interval
+        self._signatures = self._scan()
+
+    def _scan(self):
+        signatures = {}
+        for path in self._list_files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signatures[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return signatures
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self._interval))
+        current = self._scan()
+        changed = {
+            path for path in set(current) | set(self._signatures)
+            if current.get(path) != self._signatures.get(path)
+        }
+        self._signatures = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class EnvFileSync:
+    """记录每个系统文件解析出的键值，文件变化时只重新解析该文件并把差异写入数据库
+
+    同一个键在多个文件中出现时，profile.d 脚本覆盖 /etc/environment（与登录 shell 的加载顺序一致）。
+    """
+
+    def __init__(self, env_file=None, profile_dir=None):
+        self.env_file = env_file or settings.ENV_SYSTEM_FILE
+        self.profile_dir = profile_dir or settings.ENV_PROFILE_DIR
+        self.files = {}  # path -> {key: value}
+
+    def is_relevant(self, path):
+        if path == self.env_file:
+            return True
+        return (os.path.dirname(path) == self.profile_dir
+                and fnmatch.fnmatch(os.path.basename(path), PROFILE_PATTERN))
+
+    def list_files(self):
+        paths = [self.env_file]
+        if os.path.isdir(self.profile_dir):
+            paths += sorted(
+                os.path.join(self.profile_dir, name)
+                for name in os.listdir(self.profile_dir)
+                if fnmatch.fnmatch(name, PROFILE_PATTERN)
+            )
+        return paths
+
+    @staticmethod
+    def parse(path):
+        values = {}
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    parsed = parse_env_line(line)
+                    if parsed and parsed[0].isidentifier():
+                        values[parsed[0]] = parsed[1]
+        except FileNotFoundError:
+            pass
+        return values
+
+    def _resolve(self, key):
+        """按优先级合并后的值：profile.d 脚本按文件名顺序，后者覆盖前者"""
+        value = self.files.get(self.env_file, {}).get(key)
+        for path in sorted(p for p in self.files if p != self.env_file):
+            if key in self.files[path]:
+                value = self.files[path][key]
+        return value
+
+    def load(self):
+        """建立基线，返回当前合并后的全部键值"""
+        self.files = {path: self.parse(path) for path in self.list_files()}
+        keys = set().union(*self.files.values()) if self.files else set()
+        return {key: self._resolve(key) for key in keys}
+
+    def changes_for(self, paths):
+        """重新解析变化的文件，返回 (sets, deleted)，只包含合并值真正变化的键"""
+        touched = set()
+        before = {}
+        for path in paths:
+            old = self.files.get(path, {})
+            new = self.parse(path)
+            keys = {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+            for key in keys:
+                before.setdefault(key, self._resolve(key))
+            if new:
+                self.files[path] = new
+            else:
+                self.files.pop(path, None)
+            touched |= keys
+
+        sets, deleted = {}, []
+        for key in touched:
+            value = self._resolve(key)
+            if value == before[key]:
+                continue
+            if value is None:
+                deleted.append(key)
+            else:
+                sets[key] = value
+        return sets, deleted
+
+    def apply(self, sets, deleted):
+        """只写数据库，不回写系统文件；写入与删除在同一事务中并记录历史版本
+
+        启用插值时系统文件中是解析后的值：与库中 ${VAR} 模板解析结果相同的键
+        是本应用自己写入的，跳过，不用解析值覆盖模板。
+        """
+        if sets and settings.ENV_INTERPOLATION:
+            resolver = get_resolver()
+            sets = {key: value for key, value in sets.items() if resolver.resolve(key) != value}
+        if not sets and not deleted:
+            return {}, 0
+        results = EnvironmentVariable.bulk_apply(
+            [(key, value, None) for key, value in sets.items()],
+            scope=None,
+            removed_keys=deleted,
+        )
+        removed = sum(1 for status in results.values() if status == 'deleted')
+        return {k: v for k, v in results.items() if v != 'deleted'}, removed
+
+
+def make_watcher(sync, poll_interval, force_poll=False):
+    directories = [os.path.dirname(sync.env_file)]
+    if os.path.isdir(sync.profile_dir):
+        directories.append(sync.profile_dir)
+    if not force_poll:
+        try:
+            return InotifyWatcher(directories, sync.is_relevant), 'inotify'
+        except (OSError, AttributeError) as e:
+            logger.warning('inotify 不可用，改为轮询: %s', e)
+    return PollingWatcher(sync.list_files, poll_interval), 'poll'
+
+
+def collect(watcher, debounce):
+    """等待第一批事件，然后持续合并直到 debounce 秒内没有新事件"""
+    changed = set()
+    while not changed:
+        changed = watcher.wait(60)
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed
+        changed |= more
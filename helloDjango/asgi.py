@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'helloDjango.settings')
 
 application = get_asgi_application()
+
+# 每个 worker 进程启动后台线程，同步其他 worker 对环境变量的修改
+from environment.propagation import start_listener  # noqa: E402
+
+start_listener()
@@ -0,0 +1,156 @@
+"""
+登录用户和权限的缓存。
+
+默认的 ModelBackend 每个请求都要查询用户，首次判断权限时再查询用户权限和用户组权限。
+这里把用户的字段（不含密码哈希）、会话校验哈希和权限集合（ModelBackend 的 _perm_cache 等属性）
+放入共享缓存，命中时认证和权限判断都不查数据库。用户、用户组成员、用户组权限或权限本身变化时，
+由信号清除受影响用户的缓存；AUTH_CACHE_TTL 兜底绕过信号的修改（如直接执行 SQL）。
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+
+def _cache():
+    return caches[settings.AUTH_CACHE_ALIAS]
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+# ModelBackend 计算出的权限集合
+PERM_CACHES = ('_perm_cache', '_user_perm_cache', '_group_perm_cache')
+
+
+def invalidate_users(user_ids):
+    keys = [_user_key(pk) for pk in user_ids]
+    if keys:
+        _cache().delete_many(keys)
+
+
+def _dump(user):
+    """缓存的内容：不含密码哈希的字段值、会话校验哈希和权限集合，只有基本类型"""
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in user._meta.concrete_fields if field.attname != 'password'
+    }
+    return {
+        'fields': fields,
+        'session_hash': user.get_session_auth_hash(),
+        **{attr: getattr(user, attr) for attr in PERM_CACHES},
+    }
+
+
+def _load(data):
+    """还原用户对象：password 为延迟字段，save() 时不会被覆盖"""
+    fields = data['fields']
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+    for attr in PERM_CACHES:
+        setattr(user, attr, set(data[attr]))
+    # 会话校验（django.contrib.auth.get_user）使用缓存的哈希，不读取密码
+    session_hash = data['session_hash']
+    user.get_session_auth_hash = lambda: session_hash
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend 加缓存：get_user 命中时直接返回带权限集合的用户对象"""
+
+    def get_user(self, user_id):
+        key = _user_key(user_id)
+        data = _cache().get(key)
+        if isinstance(data, dict):
+            user = _load(data)
+            return user if self.user_can_authenticate(user) else None
+        user = super().get_user(user_id)
+        if user is None:
+            return None
+        # 预先计算权限集合，与用户字段一起缓存
+        self.get_all_permissions(user)
+        _cache().set(key, _dump(user), settings.AUTH_CACHE_TTL)
+        return user
+
+
+# ---------- 缓存失效 ----------
+
+def _group_members(group_ids):
+    return list(get_user_model().objects.filter(groups__in=group_ids).values_list('pk', flat=True).distinct())
+
+
+def _user_saved(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+
+def _user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # 正向：instance 是用户；反向：instance 是用户组，pk_set 是用户
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_users(_group_members([instance.pk]))
+    else:
+        invalidate_users(pk_set)
+
+
+def _user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # 正向：instance 是用户；反向：instance 是权限，pk_set 是用户
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_users([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_users(instance.user_set.values_list('pk', flat=True))
+    else:
+        invalidate_users(pk_set)
+
+
+def _group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # 正向：instance 是用户组；反向：instance 是权限，pk_set 是用户组
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_users(_group_members([instance.pk]))
+    elif action == 'pre_clear':
+        invalidate_users(_group_members(instance.group_set.values_list('pk', flat=True)))
+    else:
+        invalidate_users(_group_members(pk_set))
+
+
+def _group_deleted(sender, instance, **kwargs):
+    # 删除前成员关系还在
+    invalidate_users(_group_members([instance.pk]))
+
+
+def _permission_changed(sender, instance, **kwargs):
+    # 超级用户拥有全部权限，新增权限也要清除
+    invalidate_users(
+        get_user_model().objects.filter(
+            Q(is_superuser=True) | Q(user_permissions=instance.pk) | Q(groups__permissions=instance.pk)
+        ).values_list('pk', flat=True).distinct()
+    )
+
+
+def connect_signals():
+    user_model = get_user_model()
+    post_save.connect(_user_saved, sender=user_model, dispatch_uid='authcache_user_save')
+    post_delete.connect(_user_saved, sender=user_model, dispatch_uid='authcache_user_delete')
+    m2m_changed.connect(
+        _user_groups_changed, sender=user_model.groups.through, dispatch_uid='authcache_user_groups'
+    )
+    m2m_changed.connect(
+        _user_permissions_changed, sender=user_model.user_permissions.through,
+        dispatch_uid='authcache_user_permissions',
+    )
+    m2m_changed.connect(
+        _group_permissions_changed, sender=Group.permissions.through, dispatch_uid='authcache_group_permissions'
+    )
+    pre_delete.connect(_group_deleted, sender=Group, dispatch_uid='authcache_group_delete')
+    post_save.connect(_permission_changed, sender=Permission, dispatch_uid='authcache_permission_save')
+    pre_delete.connect(_permission_changed, sender=Permission, dispatch_uid='authcache_permission_delete')
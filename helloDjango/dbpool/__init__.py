@@ -0,0 +1,8 @@
+"""
+进程内 PostgreSQL 连接池数据库后端。
+
+在 DATABASES 中使用 'ENGINE': 'helloDjango.dbpool'，池参数放在 'POOL' 键中：
+MAX_SIZE（每个 worker 的最大连接数）、IDLE_TIMEOUT（空闲连接回收秒数）、
+TIMEOUT（连接用尽时的最长等待秒数）。
+"""
+from .pool import pool_stats  # noqa: F401
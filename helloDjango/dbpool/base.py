@@ -0,0 +1,30 @@
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.base import IsolationLevel
+
+from .pool import get_pool
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+    """从进程内连接池获取连接的 PostgreSQL 后端；close() 把连接归还连接池而不是断开"""
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        connection, reused = self.pool.getconn(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        if reused:
+            # 新建连接时由父类设置，复用时按同样规则恢复
+            isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+            self.isolation_level = (
+                IsolationLevel.READ_COMMITTED if isolation_level is None
+                else IsolationLevel(isolation_level)
+            )
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
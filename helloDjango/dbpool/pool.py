@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2.extensions
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """线程安全的 psycopg2 连接池
+
+    空闲连接后进先出复用，超过 idle_timeout 的空闲连接被关闭；
+    连接数达到 max_size 时调用方等待，最长 timeout 秒。
+    """
+
+    def __init__(self, max_size=10, idle_timeout=300, timeout=30, ping_interval=30):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._idle = deque()  # (connection, returned_at)
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'opens': 0,
+            'closes': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'discarded': 0,
+        }
+
+    def _prune_idle(self, now):
+        while self._idle and now - self._idle[0][1] >= self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._close(conn)
+
+    def _close(self, conn):
+        self._stats['closes'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, connect):
+        """取出一个连接，返回 (connection, reused)；没有空闲连接且未达上限时调用 connect() 新建"""
+        deadline = None
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune_idle(now)
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._in_use += 1
+                    self._stats['checkouts'] += 1
+                    break
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    self._stats['checkouts'] += 1
+                    conn = None
+                    break
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self._stats['waits'] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'{self.timeout} 秒内未能从连接池获取数据库连接')
+                started = time.monotonic()
+                self._cond.wait(remaining)
+                self._stats['wait_seconds'] += time.monotonic() - started
+
+        # 建立连接和健康检查都在锁外进行
+        if conn is not None:
+            if conn.closed or (now - returned_at >= self.ping_interval and not self._ping(conn)):
+                with self._cond:
+                    self._stats['discarded'] += 1
+                self._close(conn)
+            else:
+                return conn, True
+        try:
+            conn = connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['opens'] += 1
+        return conn, False
+
+    def putconn(self, conn):
+        """归还连接；已关闭或事务状态异常且无法回滚的连接直接丢弃"""
+        reusable = not conn.closed
+        if reusable:
+            status = conn.info.transaction_status
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    reusable = False
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._stats['discarded'] += 1
+            self._cond.notify()
+        if not reusable:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._stats,
+                'wait_seconds': round(self._stats['wait_seconds'], 6),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+            }
+
+
+def get_pool(alias, options):
+    """按 (进程, 数据库别名) 获取连接池，fork 出的 worker 不会共享父进程的连接"""
+    key = (os.getpid(), alias)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(
+                    max_size=options.get('MAX_SIZE', 10),
+                    idle_timeout=options.get('IDLE_TIMEOUT', 300),
+                    timeout=options.get('TIMEOUT', 30),
+                    ping_interval=options.get('PING_INTERVAL', 30),
+                )
+    return pool
+
+
+def pool_stats():
+    """当前进程所有连接池的指标"""
+    pid = os.getpid()
+    return {alias: pool.stats() for (owner, alias), pool in list(_pools.items()) if owner == pid}
@@ -0,0 +1,145 @@
+"""
+多 worker 的非阻塞日志管道。
+
+worker 中的 QueueingHandler 只把日志记录放入有界内存队列（满时丢弃并计数），
+由后台线程经 Unix socket 转发给唯一的写入进程（manage.py log_collector），
+写入进程批量写盘并负责轮转，不再有多个进程同时轮转同一个文件。
+记录以 JSON（4 字节长度 + UTF-8 JSON）传输，写入进程不反序列化任意对象。
+写入进程由 manage.py boot 启动并监管，不可用时 worker 退回标准错误输出。
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, SocketHandler
+
+MAX_RECORD_SIZE = 1 << 20  # 写入进程接受的单条记录最大字节数
+
+
+def _count(name):
+    # 延迟导入：日志配置早于 Django 设置加载完成
+    try:
+        from helloDjango.metrics.registry import registry
+        registry.inc(name)
+    except Exception:
+        pass
+
+
+class CollectorHandler(SocketHandler):
+    """通过 Unix socket 把记录发给写入进程；连不上或发送失败时写到标准错误"""
+
+    def __init__(self, address):
+        super().__init__(address, None)
+        self.fallback = logging.StreamHandler(sys.stderr)
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.fallback.setFormatter(fmt)
+
+    def serialize(self, record):
+        """与 SocketHandler.makePickle 相同的字段处理，编码为 JSON；extra 中的对象（如 request）转成字符串"""
+        if record.exc_info:
+            self.format(record)  # 异常文本写入 exc_text
+        data = dict(record.__dict__)
+        data['msg'] = record.getMessage()
+        data['args'] = None
+        data['exc_info'] = None
+        data.pop('message', None)
+        payload = json.dumps(data, ensure_ascii=False, default=str).encode()
+        return struct.pack('>L', len(payload)) + payload
+
+    def send(self, s):
+        # 标准库的 send 会吞掉错误，这里抛出以便退回标准错误
+        if self.sock is None:
+            self.createSocket()
+        if self.sock is None:
+            raise ConnectionError('日志写入进程不可用')
+        try:
+            self.sock.sendall(s)
+        except OSError:
+            self.sock.close()
+            self.sock = None
+            raise
+
+    def emit(self, record):
+        try:
+            self.send(self.serialize(record))
+        except Exception:
+            _count('django_log_forward_errors_total')
+            self.fallback.handle(record)
+
+
+class QueueingHandler(QueueHandler):
+    """请求路径上只做一次 put_nowait；队列满时丢弃记录并计数，不阻塞请求"""
+
+    # 不要给本 handler 设置 formatter：prepare() 只合并 message 和异常文本，完整格式由写入进程负责
+
+    def __init__(self, address, maxsize=10000, fallback_format='{levelname} {asctime} {module} {message}'):
+        super().__init__(queue.Queue(maxsize))
+        self.address = address
+        self.maxsize = maxsize
+        self.fallback_format = fallback_format
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # 预加载后 fork 时主进程不带着转发线程进入 fork：先发完队列并停止，需要时再重新启动
+        os.register_at_fork(before=self._stop_listener)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 后的子进程重新建立队列和转发线程
+            self.queue = queue.Queue(self.maxsize)
+            target = CollectorHandler(self.address)
+            target.setFormatter(logging.Formatter(self.fallback_format, style='{'))
+            self._listener = QueueListener(self.queue, target)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._stop_listener)
+
+    def _stop_listener(self):
+        listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()  # 发送队列中剩余的记录
+        self._pid = None
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            _count('django_log_records_dropped_total')
+
+    def close(self):
+        self._stop_listener()
+        super().close()
+
+
+def read_records(sock):
+    """按 CollectorHandler 的格式（4 字节长度 + JSON）读取记录字典；格式不对或超长时断开连接"""
+    reader = sock.makefile('rb')
+    while True:
+        header = reader.read(4)
+        if len(header) < 4:
+            return
+        size = struct.unpack('>L', header)[0]
+        if size > MAX_RECORD_SIZE:
+            return
+        payload = reader.read(size)
+        if len(payload) < size:
+            return
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if isinstance(data, dict):
+            yield data
@@ -0,0 +1,8 @@
+"""
+请求级性能指标。
+
+RequestMetricsMiddleware 按 view 记录墙钟耗时、数据库查询次数和耗时、模板渲染耗时、
+系统文件读写耗时（热点路径用 timer('file_io_time') 包裹）。每个 worker 在内存中维护直方图，
+定期写入 METRICS_DIR，/metrics 汇总所有 worker 后以 Prometheus 文本格式输出。
+"""
+from .registry import timer  # noqa: F401
@@ -0,0 +1,28 @@
+from django.template.backends.django import DjangoTemplates
+
+from .registry import timer
+
+
+class TimedTemplate:
+    """包装后端模板对象，render 的耗时计入当前请求"""
+
+    def __init__(self, template):
+        self.template = template
+
+    @property
+    def origin(self):
+        return self.template.origin
+
+    def render(self, context=None, request=None):
+        with timer('template_time'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """与 Django 模板后端相同，额外统计渲染耗时（include 的子模板计入外层）"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
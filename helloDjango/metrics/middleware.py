@@ -0,0 +1,112 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .registry import (
+    begin_request, db_execute_wrapper, end_request, ensure_flusher, registry, resume_request,
+)
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    """connection_created 回调；连接池复用时同一个包装对象会再次触发，避免重复安装"""
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+connection_created.connect(install_db_wrapper, dispatch_uid='metrics_db_wrapper')
+
+
+def _stream(content, stats, finish):
+    """逐块输出流式响应，生成每一块时（查库、渲染）计入该请求；输出结束或连接断开时记录"""
+    iterator = iter(content)
+    try:
+        while True:
+            token = resume_request(stats)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                end_request(token)
+            yield chunk
+    finally:
+        finish()
+
+
+async def _astream(content, stats, finish):
+    """_stream 的异步版本（ASGI 下的异步迭代器）"""
+    iterator = content.__aiter__()
+    try:
+        while True:
+            token = resume_request(stats)
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                end_request(token)
+            yield chunk
+    finally:
+        finish()
+
+
+def _view_name(request, response):
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name or match._func_path
+    return 'unmatched' if response.status_code == 404 else 'unknown'
+
+
+class RequestMetricsMiddleware:
+    """按 view 记录每个请求的墙钟耗时、查询次数和耗时、模板渲染耗时、系统文件读写耗时
+
+    同时支持同步和异步请求链；流式响应统计到响应体输出完毕为止，输出过程中的查询同样计入。
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # 中间件加载前已建立的连接（如启动时的检查）也要安装
+        for connection in connections.all(initialized_only=True):
+            install_db_wrapper(None, connection)
+
+    def _record(self, request, response, stats, started):
+        def finish():
+            stats.wall = time.perf_counter() - started
+            registry.observe_request(_view_name(request, response), request.method, response.status_code, stats)
+            ensure_flusher()
+
+        if not response.streaming:
+            finish()
+        elif response.is_async:
+            response.streaming_content = _astream(response.streaming_content, stats, finish)
+        else:
+            response.streaming_content = _stream(response.streaming_content, stats, finish)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, token = begin_request()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        self._record(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        stats, token = begin_request()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        self._record(request, response, stats, started)
+        return response
@@ -0,0 +1,246 @@
+import bisect
+import contextvars
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# 秒级耗时和每请求查询数的桶上界（Prometheus 的 le 标签）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMS = {
+    # 名称: (说明, 桶, RequestStats 中的字段)
+    'django_request_duration_seconds': ('请求总耗时（墙钟）', DURATION_BUCKETS, 'wall'),
+    'django_request_db_queries': ('每个请求的数据库查询次数', COUNT_BUCKETS, 'db_queries'),
+    'django_request_db_duration_seconds': ('每个请求的数据库耗时', DURATION_BUCKETS, 'db_time'),
+    'django_request_template_duration_seconds': ('每个请求的模板渲染耗时', DURATION_BUCKETS, 'template_time'),
+    'django_request_file_io_duration_seconds': ('每个请求的系统文件读写耗时', DURATION_BUCKETS, 'file_io_time'),
+}
+REQUESTS_TOTAL = 'django_requests_total'
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """单个请求内累计的耗时，随 contextvars 传入 sync_to_async 和 IO 线程"""
+    __slots__ = ('db_queries', 'db_time', 'template_time', 'file_io_time', 'wall')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.file_io_time = 0.0
+        self.wall = 0.0
+
+
+def begin_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def resume_request(stats):
+    """流式响应输出期间重新进入请求的统计上下文，返回 end_request 用的 token"""
+    return _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current_stats():
+    return _current.get()
+
+
+@contextmanager
+def timer(field):
+    """热点路径计时，累加到当前请求的 field（如 'file_io_time'）；不在请求中时只执行不记录"""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, field, getattr(stats, field) + time.perf_counter() - started)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """安装在每个数据库连接上的 execute_wrapper，统计当前请求的查询次数和耗时"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+class Registry:
+    """本 worker 的直方图：每个 (指标, view) 一组桶计数，observe 只做一次二分查找和加法"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}  # (name, view) -> [bucket counts..., sum, count]
+        self.requests = {}    # (view, method, status) -> count
+        self.counters = {}    # name -> count（如日志丢弃数）
+        self._dirty = False
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            self._dirty = True
+
+    def observe_request(self, view, method, status, stats):
+        with self._lock:
+            for name, (_, buckets, field) in HISTOGRAMS.items():
+                value = getattr(stats, field)
+                series = self.histograms.get((name, view))
+                if series is None:
+                    series = self.histograms[(name, view)] = [0] * (len(buckets) + 1) + [0.0, 0]
+                series[bisect.bisect_left(buckets, value)] += 1
+                series[-2] += value
+                series[-1] += 1
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._dirty = True
+
+    def snapshot(self):
+        with self._lock:
+            self._dirty = False
+            return {
+                'histograms': [[name, view, list(series)] for (name, view), series in self.histograms.items()],
+                'requests': [[view, method, status, count] for (view, method, status), count in self.requests.items()],
+                'counters': dict(self.counters),
+            }
+
+    def reset(self):
+        """清空本 worker 的数据（基准测试按场景分别统计）"""
+        with self._lock:
+            self.histograms.clear()
+            self.requests.clear()
+            self.counters.clear()
+            self._dirty = True
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+
+registry = Registry()
+_started_at = int(time.time())
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def _snapshot_path():
+    # pid 加启动时间，pid 被复用时不会覆盖已退出 worker 的数据
+    return os.path.join(settings.METRICS_DIR, f'{os.getpid()}-{_started_at}.json')
+
+
+def flush():
+    """把本 worker 的直方图原子写入共享目录，供任一 worker 汇总"""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    data = json.dumps(registry.snapshot(), separators=(',', ':'))
+    fd, tmp = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        f.write(data)
+    os.replace(tmp, _snapshot_path())
+
+
+def _flush_loop():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        if registry.dirty:
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+def ensure_flusher():
+    """每个 worker 一个后台线程，按 METRICS_FLUSH_INTERVAL 秒写出有变化的数据
+
+    在记录第一个请求时启动：预加载后 fork 的主进程只构建中间件、不处理请求，不会创建线程。
+    """
+    global _flusher
+    if _flusher is not None and _flusher.is_alive():
+        return
+    with _flusher_lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+            _flusher.start()
+
+
+def aggregate():
+    """汇总所有 worker（含已退出但未过期的 worker，保证计数器单调）的数据"""
+    histograms, requests, counters = {}, {}, {}
+    cutoff = time.time() - settings.METRICS_RETENTION
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                continue
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, view, series in data.get('histograms', ()):
+            total = histograms.get((name, view))
+            if total is None:
+                histograms[(name, view)] = series
+            elif len(total) == len(series):
+                histograms[(name, view)] = [a + b for a, b in zip(total, series)]
+        for view, method, status, count in data.get('requests', ()):
+            requests[(view, method, status)] = requests.get((view, method, status), 0) + count
+        for name, count in data.get('counters', {}).items():
+            counters[name] = counters.get(name, 0) + count
+    return histograms, requests, counters
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Prometheus 文本格式（0.0.4）"""
+    flush()  # 先写出本 worker 的最新数据
+    histograms, requests, counters = aggregate()
+    lines = [
+        f'# HELP {REQUESTS_TOTAL} 请求总数',
+        f'# TYPE {REQUESTS_TOTAL} counter',
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(
+            f'{REQUESTS_TOTAL}{{view="{_label(view)}",method="{_label(method)}",status="{status}"}} {count}'
+        )
+    for name, count in sorted(counters.items()):
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {count}')
+    for name, (help_text, buckets, _) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, view), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            view_label = f'view="{_label(view)}"'
+            cumulative = 0
+            for bound, count in zip(buckets, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{view_label},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{view_label},le="+Inf"}} {series[-1]}')
+            lines.append(f'{name}_sum{{{view_label}}} {_number(series[-2])}')
+            lines.append(f'{name}_count{{{view_label}}} {series[-1]}')
+    return '\n'.join(lines) + '\n'
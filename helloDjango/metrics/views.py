@@ -0,0 +1,23 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .registry import render_prometheus
+
+
+def _bearer(request):
+    header = request.headers.get('Authorization', '')
+    return header[len('Bearer '):].strip() if header.startswith('Bearer ') else ''
+
+
+def metrics_view(request):
+    """Prometheus 抓取接口，汇总所有 worker
+
+    需要 Bearer METRICS_TOKEN 或已登录的管理员；未设置 METRICS_TOKEN 时只有管理员能访问。
+    """
+    token = settings.METRICS_TOKEN
+    user = getattr(request, 'user', None)
+    if not (token and hmac.compare_digest(_bearer(request), token)) and not (user and user.is_staff):
+        return HttpResponseForbidden('forbidden')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,137 @@
+"""
+预加载后 fork 的 uvicorn 多进程模式。
+
+uvicorn --workers 用 spawn 启动 worker，每个 worker 都要重新导入 Django、加载路由和编译模板。
+这里在主进程中完成这些工作并绑定端口，再 fork 出 worker：worker 通过写时复制共享已加载的模块，
+端口在 fork 前已开始监听，新连接在 worker 就绪前排队而不是被拒绝。
+后台线程（环境变量同步、日志转发、指标写出）都在 worker 中按进程启动：
+环境变量同步随 worker 导入 helloDjango.asgi 启动，指标写出在处理第一个请求时启动，
+主进程预加载时产生的日志转发线程在每次 fork 前停止（logpipe 的 fork 钩子）。
+日志写入进程等辅助服务同样由主进程 fork 并在退出后重启；停止时先停 worker，再停服务。
+"""
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+RESPAWN_DELAY = 1  # worker 启动即崩溃时重启前等待的秒数，避免忙循环
+
+
+def preload():
+    """加载中间件、全部路由（导入所有视图）、模板和静态文件清单"""
+    from django.contrib.staticfiles.storage import staticfiles_storage
+    from django.core.asgi import get_asgi_application
+    from django.db import connections
+    from django.template import engines
+    from django.urls import get_resolver
+
+    get_asgi_application()
+    get_resolver().reverse_dict  # 触发路由解析器加载
+
+    templates = 0
+    for engine in engines.all():
+        for directory in engine.template_dirs:
+            for path in Path(directory).rglob('*.html'):
+                engine.get_template(str(path.relative_to(directory)))  # 编译并放入缓存加载器
+                templates += 1
+
+    # 清单存储在首次访问时读取 staticfiles.json
+    getattr(staticfiles_storage, 'hashed_files', None)
+
+    # 不把数据库连接带入子进程
+    connections.close_all()
+    return {'templates': templates}
+
+
+class Prefork:
+    """主进程只负责 fork、转发信号和重启意外退出的 worker 和服务"""
+
+    def __init__(self, app, host, port, workers):
+        import uvicorn
+
+        self.uvicorn = uvicorn
+        self.config = uvicorn.Config(app, host=host, port=port, lifespan='off', proxy_headers=True)
+        self.workers = workers
+        self.services = {}  # 名称 -> 在子进程中执行的函数
+        self.children = {}  # pid -> 服务名称，worker 为 None
+        self.stopping = None  # 收到的停止信号
+        self.socket = None
+
+    def bind(self):
+        self.socket = self.config.bind_socket()
+
+    def add_service(self, name, target):
+        """立即 fork 一个由主进程监管的辅助进程（如日志写入进程），退出后与 worker 一样重启"""
+        self.services[name] = target
+        self._spawn(name)
+
+    def _spawn(self, name=None):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = name
+            return
+        # 子进程：恢复默认信号处理，由 uvicorn / 服务自己处理 SIGINT / SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            if name is None:
+                self.uvicorn.Server(self.config).run(sockets=[self.socket])
+            else:
+                self.services[name]()
+        except BaseException:
+            logger.exception('%s %s 异常退出', name or 'worker', os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def start(self):
+        for _ in range(self.workers):
+            self._spawn()
+
+    def _signal(self, signum, services):
+        for pid, name in list(self.children.items()):
+            if (name is not None) == services:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    self.children.pop(pid, None)
+
+    def _stop(self, signum, frame):
+        self.stopping = signum
+        self._signal(signum, services=False)
+        self._stop_services()
+
+    def _stop_services(self):
+        # worker 全部退出后再停服务，worker 退出前的日志仍能写入
+        if self.stopping and None not in self.children.values():
+            self._signal(self.stopping, services=True)
+
+    def shutdown(self, signum=signal.SIGTERM):
+        """启动阶段出错时停止已启动的服务并等待其退出"""
+        self._stop(signum, None)
+        self.wait()
+
+    def wait(self):
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            if pid not in self.children:
+                continue
+            name = self.children.pop(pid)
+            if self.stopping:
+                self._stop_services()
+                continue
+            logger.warning('%s %s 退出（状态 %s），重新启动', name or 'worker', pid, status)
+            time.sleep(RESPAWN_DELAY)
+            if not self.stopping:
+                self._spawn(name)
+        if self.socket is not None:
+            self.socket.close()
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'helloDjango.metrics.middleware.RequestMetricsMiddleware',  # 放在最前，统计完整的请求耗时
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,7 +64,7 @@ ROOT_URLCONF = 'helloDjango.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'helloDjango.metrics.backends.TimedDjangoTemplates',  # 统计模板渲染耗时
         'DIRS': [BASE_DIR / 'templates']
         ,
         'APP_DIRS': True,
@@ -84,26 +85,92 @@ WSGI_APPLICATION = 'helloDjango.wsgi.application'
 # ==================== 数据库配置 ====================
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
-if DEBUG:
+# DB_ENGINE=sqlite 使用本地 SQLite（运行测试、env_bench 基准），默认 DEBUG 时 SQLite、否则 PostgreSQL
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite' if DEBUG else 'postgresql')
+
+if DB_ENGINE == 'sqlite':
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
         }
     }
 else:
+    # 连接管理：
+    # DB_POOL=true 时每个 uvicorn worker 使用进程内连接池（ASGI 下每个请求的同步 ORM 调用可能在新线程中执行，
+    # 线程级的持久连接无法复用，推荐开启连接池）；否则使用 Django 持久连接 + 健康检查
+    DB_POOL = os.getenv('DB_POOL', 'false').lower() in ('1', 'true', 'yes')
+
     # 数据库配置
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': 'helloDjango.dbpool' if DB_POOL else 'django.db.backends.postgresql',
             'NAME': os.environ['POSTGRES_DB'],
-            'HOST': 'postgres',
-            'PORT': 5432,
+            'HOST': os.getenv('DB_HOST', 'postgres'),
+            'PORT': int(os.getenv('DB_PORT', 5432)),
             'USER': os.environ['POSTGRES_USER'],
-            'PASSWORD': os.environ['POSTGRES_PASSWORD']
+            'PASSWORD': os.environ['POSTGRES_PASSWORD'],
+            # 连接池模式下每个请求结束即归还连接
+            'CONN_MAX_AGE': 0 if DB_POOL else int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes'),
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            },
+            'POOL': {
+                'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),            # 每个 worker 的最大连接数
+                'IDLE_TIMEOUT': int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),   # 空闲连接回收秒数
+                'TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 30)),              # 连接用尽时最长等待秒数
+                'PING_INTERVAL': int(os.getenv('DB_POOL_PING_INTERVAL', 30)),  # 空闲超过该秒数的连接复用前先 SELECT 1
+            },
         }
     }
 
+# ==================== 缓存配置 ====================
+# default：进程内缓存（列表总数、权限等只读热点，零网络开销）
+# shared：所有 worker 共享的缓存，保存会话和登录用户，退出登录、修改权限后各 worker 立即一致。
+#   CACHE_SHARED_BACKEND=file（默认，同一容器内的 worker 共享 CACHE_FILE_DIR 目录）
+#   CACHE_SHARED_BACKEND=redis（多台主机，需安装 redis 包并设置 CACHE_REDIS_URL）
+#   CACHE_SHARED_BACKEND=locmem（单 worker 或开发环境）
+CACHE_SHARED_BACKEND = os.getenv('CACHE_SHARED_BACKEND', 'file').lower()
+CACHE_FILE_DIR = os.getenv('CACHE_FILE_DIR', '/tmp/django_cache')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://redis:6379/1')
+
+if CACHE_SHARED_BACKEND == 'redis':
+    _shared_cache = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    }
+elif CACHE_SHARED_BACKEND == 'locmem':
+    _shared_cache = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shared',
+    }
+else:
+    _shared_cache = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_FILE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_FILE_MAX_ENTRIES', 10000))},
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_LOCMEM_MAX_ENTRIES', 5000))},
+    },
+    'shared': {**_shared_cache, 'KEY_PREFIX': 'hello'},
+}
+
+# 会话先读共享缓存，未命中再查数据库（写入时两者都写）
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+
+# 登录用户和其权限集合一起缓存在共享缓存中，命中时认证不查数据库；
+# 用户、用户组或权限变化时由信号清除受影响用户的缓存
+AUTHENTICATION_BACKENDS = ['helloDjango.authcache.CachedModelBackend']
+AUTH_CACHE_ALIAS = 'shared'
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 300))  # 用户和权限缓存秒数（兜底绕过信号的修改）
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -139,14 +206,26 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 STATIC_URL = 'static/'
 
+# 源文件始终在 static/ 中，collectstatic 输出到单独的 STATIC_ROOT（不再与源文件混在同一目录）
+STATICFILES_DIRS = [
+    os.path.join(BASE_DIR, "static"),
+]
+STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
+
 if DEBUG:
     # 开发模式下文件服务配置
-    STATICFILES_DIRS = [
-        os.path.join(BASE_DIR, "static"),
-    ]
+    STATICFILES_STORAGE_BACKEND = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 else:
-    # 生产模式下文件服务配置
-    STATIC_ROOT = os.path.join(BASE_DIR, 'static')
+    # 生产模式：哈希文件名 + 清单，并预压缩 .gz / .br 副本（见 helloDjango/staticfiles.py）
+    STATICFILES_STORAGE_BACKEND = 'helloDjango.staticfiles.CompressedManifestStaticFilesStorage'
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': STATICFILES_STORAGE_BACKEND},
+}
+STATIC_SERVE = os.getenv('STATIC_SERVE', 'true').lower() in ('1', 'true', 'yes')  # 前面没有 nginx 时由 Django 分发静态文件
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', 3600))  # 非哈希文件名的缓存秒数（哈希文件名按 immutable 缓存一年）
+STATIC_ICONS_KEEP = [name for name in os.getenv('STATIC_ICONS_KEEP', '').split(',') if name]  # 动态拼接、模板中扫描不到的图标名
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -157,6 +236,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # ==================== 日志配置 ====================
 import logging.config
 
+# 生产环境：worker 把日志放入有界队列（满时丢弃并计数），经 Unix socket 交给唯一的写入进程
+LOG_FILE = os.getenv('LOG_FILE', os.path.join(BASE_DIR, 'django.log'))
+LOG_COLLECTOR_SOCKET = os.getenv('LOG_COLLECTOR_SOCKET', '/tmp/django_log.sock')
+LOG_COLLECTOR_ENABLED = not DEBUG  # manage.py boot 是否启动并监管日志写入进程（生产环境的日志经它写盘）
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))        # 每个 worker 内存队列的最大记录数
+LOG_BATCH_SIZE = int(os.getenv('LOG_BATCH_SIZE', 200))          # 写入进程攒够多少条写一次盘
+LOG_FLUSH_INTERVAL = float(os.getenv('LOG_FLUSH_INTERVAL', 1))  # 写入进程最长多少秒写一次盘
+LOG_MAX_BYTES = 1024 * 1024 * 5  # 5 MB
+LOG_BACKUP_COUNT = 5
+
 # 开发环境日志配置
 if DEBUG:
     LOGGING = {
@@ -202,22 +291,21 @@ else:
             },
         },
         'handlers': {
-            'file': {
+            # 请求路径上只入队；由 log_collector 进程统一写入 LOG_FILE 并轮转
+            'queue': {
                 'level': 'INFO',
-                'class': 'logging.handlers.RotatingFileHandler',
-                'filename': os.path.join(BASE_DIR, 'django.log'),
-                'maxBytes': 1024 * 1024 * 5,  # 5 MB
-                'backupCount': 5,
-                'formatter': 'verbose',
+                '()': 'helloDjango.logpipe.QueueingHandler',
+                'address': LOG_COLLECTOR_SOCKET,
+                'maxsize': LOG_QUEUE_SIZE,
             },
         },
         'root': {
-            'handlers': ['file'],
+            'handlers': ['queue'],
             'level': 'INFO',
         },
         'loggers': {
             'django': {
-                'handlers': ['file'],
+                'handlers': ['queue'],
                 'level': os.getenv('DJANGO_LOG_LEVEL', 'INFO'),
                 'propagate': False,
             },
@@ -228,10 +316,55 @@ else:
 logging.config.dictConfig(LOGGING)
 
 
+# ==================== 启动配置（manage.py boot） ====================
+BOOT_REPORT = os.getenv('BOOT_REPORT', '/tmp/startup_report.json')            # 各阶段启动耗时报告
+BOOT_MIGRATE_LOCK = os.getenv('BOOT_MIGRATE_LOCK', '/tmp/django_migrate.lock')  # 非 PostgreSQL 时的迁移文件锁
+BOOT_SUPERUSER_USERNAME = os.getenv('DJANGO_SUPERUSER_USERNAME', 'admin')       # 留空则不创建管理员
+BOOT_SUPERUSER_EMAIL = os.getenv('DJANGO_SUPERUSER_EMAIL', 'admin@example.com')
+BOOT_SUPERUSER_PASSWORD = os.getenv('DJANGO_SUPERUSER_PASSWORD', '1234')
+
 # ==============================配置子路径=======================================
 BASE_URL = os.getenv('BASE_URL')              # nginx location路径: /app/
 STATIC_URL = os.getenv('STATIC_URL')          # nginx location路径: /app/static/
 
+# ==================== 系统环境变量文件配置 ====================
+ENV_SYSTEM_FILE = os.getenv('ENV_SYSTEM_FILE', '/etc/environment')  # 全局环境变量文件
+ENV_PROFILE_DIR = os.getenv('ENV_PROFILE_DIR', '/etc/profile.d')    # profile 脚本目录
+ENV_PROBE_TTL = int(os.getenv('ENV_PROBE_TTL', 300))                # 写权限探测结果缓存秒数
+ENV_WRITE_LOCK = os.getenv('ENV_WRITE_LOCK', '/tmp/environment.lock')  # 多 worker 写系统文件时的锁文件
+ENV_PROPAGATION_ENABLED = os.getenv('ENV_PROPAGATION_ENABLED', 'true').lower() in ('1', 'true', 'yes')  # 跨 worker 同步
+ENV_PROPAGATION_POLL = float(os.getenv('ENV_PROPAGATION_POLL', 2))   # 非 PostgreSQL 时的轮询间隔秒数
+ENV_CHANGE_RETENTION_DAYS = int(os.getenv('ENV_CHANGE_RETENTION_DAYS', 7))  # 跨 worker 变更日志保留天数（每个键的最新一条始终保留）
+ENV_LOG_GAP_TIMEOUT = float(os.getenv('ENV_LOG_GAP_TIMEOUT', 60))   # 日志 id 出现空洞时等待晚提交事务的秒数，超过视为已回滚
+ENV_COUNT_CACHE_TTL = int(os.getenv('ENV_COUNT_CACHE_TTL', 30))     # 列表总数缓存秒数
+ENV_COUNT_ESTIMATE_THRESHOLD = int(os.getenv('ENV_COUNT_ESTIMATE_THRESHOLD', 10000))  # 超过该行数时使用统计估算
+ENV_FRAGMENT_CACHE_TTL = int(os.getenv('ENV_FRAGMENT_CACHE_TTL', 600))  # 列表页表格片段缓存秒数（修改后按版本号立即失效）
+ENV_INTERPOLATION = os.getenv('ENV_INTERPOLATION', 'false').lower() in ('1', 'true', 'yes')  # 解析值中的 ${VAR} 引用（$$ 转义）
+ENV_VALUE_COMPRESS_THRESHOLD = int(os.getenv('ENV_VALUE_COMPRESS_THRESHOLD', 4096))  # 超过该字节数的变量值压缩存储（只保留前缀供预览和搜索）
+ENV_VALUE_PREVIEW_CHARS = int(os.getenv('ENV_VALUE_PREVIEW_CHARS', 200))  # 列表页从数据库读取的值前缀字符数
+ENV_HISTORY_COMPRESS_THRESHOLD = int(os.getenv('ENV_HISTORY_COMPRESS_THRESHOLD', 1024))  # 历史版本中超过该字节数的值压缩存储
+ENV_SNAPSHOT_INTERVAL = int(os.getenv('ENV_SNAPSHOT_INTERVAL', 500))  # 每累计多少条历史版本自动生成一次快照
+ENV_BUNDLE_TOKEN = os.getenv('ENV_BUNDLE_TOKEN', '')                # 部署代理读取打包接口的 Bearer token，留空则只允许登录用户
+ENV_BUNDLE_RECHECK = float(os.getenv('ENV_BUNDLE_RECHECK', 2))      # 打包缓存检查其他 worker 修改的间隔秒数
+ENV_BUNDLE_MAX_AGE = float(os.getenv('ENV_BUNDLE_MAX_AGE', 300))    # 打包缓存兜底重建间隔秒数
+ENV_FEED_POLL = float(os.getenv('ENV_FEED_POLL', 1))                # 变更推送发现其他 worker 修改的轮询秒数
+ENV_FEED_BUFFER = int(os.getenv('ENV_FEED_BUFFER', 1000))           # 断线重放的环形缓冲区事件数
+ENV_FEED_QUEUE = int(os.getenv('ENV_FEED_QUEUE', 100))              # 单个连接允许积压的事件数，超过后要求客户端全量刷新
+ENV_FEED_HEARTBEAT = float(os.getenv('ENV_FEED_HEARTBEAT', 15))     # 空闲连接保活间隔秒数
+ENV_FEED_MAX_AGE = float(os.getenv('ENV_FEED_MAX_AGE', 300))        # 单个连接最长保持秒数，到期后客户端自动重连
+ENV_FEED_RETRY = float(os.getenv('ENV_FEED_RETRY', 3))              # 建议客户端的重连间隔秒数
+ENV_REPLICATION_PEER = os.getenv('ENV_REPLICATION_PEER', '')        # 复制来源实例的 environment 地址，如 http://app1:8000/o/app/env/
+ENV_REPLICATION_TOKEN = os.getenv('ENV_REPLICATION_TOKEN', '')      # 对端的 ENV_BUNDLE_TOKEN
+ENV_REPLICATION_CONFLICT = os.getenv('ENV_REPLICATION_CONFLICT', 'source')  # 冲突规则：source / local / newer
+ENV_REPLICATION_BATCH = int(os.getenv('ENV_REPLICATION_BATCH', 500))  # 每页拉取并在一个事务中应用的变更条数
+ENV_REPLICATION_TIMEOUT = float(os.getenv('ENV_REPLICATION_TIMEOUT', 10))  # 请求对端的超时秒数
+
+# ==================== 性能指标配置 ====================
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/django_metrics')              # 各 worker 指标快照的共享目录
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))     # worker 写出指标快照的间隔秒数
+METRICS_RETENTION = int(os.getenv('METRICS_RETENTION', 86400))             # 已退出 worker 的快照保留秒数
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')                             # /metrics 的 Bearer token，留空则只允许已登录的管理员访问
+
 # ==================== 跨域和 CSRF 配置 ====================
 # 允许所有源进行跨域请求
 CORS_ALLOW_ALL_ORIGINS = True
@@ -0,0 +1,189 @@
+"""
+静态文件构建与分发。
+
+collectstatic 使用 CompressedManifestStaticFilesStorage：
+1. 裁剪 bootstrap-icons.css，只保留模板和脚本中用到的图标规则；
+2. 生成带内容哈希的文件名和 staticfiles.json 清单（{% static %} 输出哈希后的 URL）；
+3. 为哈希后的文本类文件预先生成 .gz 和 .br（安装 brotli 时）压缩副本。
+
+哈希文件名随内容变化，可以按 immutable 长期缓存；nginx 用 gzip_static / brotli_static
+直接发送压缩副本，没有 nginx 时由 serve_static 视图按 Accept-Encoding 选择副本。
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.template.utils import get_app_template_dirs
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # 未安装时只生成 gzip 副本
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 值得压缩的文本类文件；woff / woff2 / 图片本身已压缩
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ttf', '.otf', '.eot')
+COMPRESS_MIN_SIZE = 256
+
+# Django 哈希文件名：name.<12 位 md5>.ext
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[A-Za-z0-9]+$')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+ICON_CSS = ('css/bootstrap-icons.css',)
+ICON_RULE = re.compile(r'^\.bi-([a-z0-9-]+)::before\s*\{[^}]*\}\s*\n?', re.MULTILINE)
+ICON_USAGE = re.compile(r'\bbi-([a-z0-9-]+)')
+
+
+def used_icons():
+    """模板和脚本中出现过的 bi-* 图标名，外加 STATIC_ICONS_KEEP 中动态拼接的图标"""
+    dirs = []
+    for engine in settings.TEMPLATES:
+        dirs.extend(Path(d) for d in engine.get('DIRS', ()))
+    dirs.extend(Path(d) for d in get_app_template_dirs('templates'))
+    dirs.extend(Path(d) for d in settings.STATICFILES_DIRS)
+
+    icons = set(settings.STATIC_ICONS_KEEP)
+    for directory in dirs:
+        for path in directory.rglob('*'):
+            if path.suffix in ('.html', '.txt', '.js') and not path.name.endswith('.min.js'):
+                icons.update(ICON_USAGE.findall(path.read_text(encoding='utf-8', errors='ignore')))
+    return icons
+
+
+def trim_icon_css(css, icons):
+    """删除未使用图标的 .bi-*::before 规则，@font-face 和公共规则保持不变"""
+    return ICON_RULE.sub(lambda m: m.group(0) if m.group(1) in icons else '', css)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def hashed_name(self, name, content=None, filename=None):
+        # 第三方 CSS / JS 中引用了未随包发布的文件（如 sourceMappingURL 指向的 .map），
+        # 保留原引用，不让整个 collectstatic 失败
+        if content is None and not self.exists(filename or name.split('?', 1)[0].split('#', 1)[0]):
+            logger.warning('静态文件引用的 %s 不存在，保留原路径', name)
+            return name
+        return super().hashed_name(name, content, filename)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            self._trim_icons(paths)
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            self._compress(set(self.hashed_files.values()))
+
+    def _trim_icons(self, paths):
+        targets = [name for name in ICON_CSS if name in paths]
+        if not targets:
+            return
+        icons = used_icons()
+        for name in targets:
+            storage, path = paths[name]
+            with storage.open(path) as f:
+                css = f.read().decode('utf-8')
+            trimmed = trim_icon_css(css, icons)
+            # 用裁剪后的副本替换收集到的文件，之后按裁剪后的内容计算哈希
+            self.delete(name)
+            self._save(name, ContentFile(trimmed.encode('utf-8')))
+            paths[name] = (self, name)
+            logger.info('%s 裁剪后 %d -> %d 字节（保留 %d 个图标）', name, len(css), len(trimmed), len(icons))
+
+    def _compress(self, names):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = self.path(name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            if len(data) < COMPRESS_MIN_SIZE:
+                continue
+            variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants['.br'] = brotli.compress(data, quality=11)
+            for suffix, compressed in variants.items():
+                # 压缩收益不足 5% 时不生成副本
+                if len(compressed) < len(data) * 0.95:
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+
+
+# ---------- 没有 nginx 时由 Django 分发 ----------
+
+def _cache_control(name):
+    if HASHED_NAME.search(name):
+        return IMMUTABLE
+    return f'public, max-age={settings.STATIC_MAX_AGE}'
+
+
+def serve_static(request, path):
+    """分发 STATIC_ROOT 中的文件：优先发送预压缩副本，哈希文件名按 immutable 缓存"""
+    from environment.bundle import choose_encoding
+
+    name = posixpath.normpath(path).lstrip('/')
+    fullpath = safe_join(settings.STATIC_ROOT, name)  # 越出 STATIC_ROOT 时抛出 SuspiciousFileOperation（400）
+    if not os.path.isfile(fullpath):
+        raise Http404('静态文件不存在')
+
+    stat = os.stat(fullpath)
+    cache_control = _cache_control(name)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = HttpResponseNotModified()
+        response['Cache-Control'] = cache_control
+        return response
+
+    variants = {'identity': fullpath}
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if os.path.isfile(fullpath + suffix):
+            variants[encoding] = fullpath + suffix
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'), variants)
+
+    content_type, _ = mimetypes.guess_type(fullpath)
+    # 静态文件都不大，一次读入：ASGI 下 FileResponse 的同步迭代器会被整体搬到线程里读取
+    with open(variants[encoding], 'rb') as f:
+        response = HttpResponse(f.read(), content_type=content_type or 'application/octet-stream')
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    if len(variants) > 1:
+        response['Vary'] = 'Accept-Encoding'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    return response
+
+
+def nginx_map():
+    """哈希文件名（内容变化即换名）长期缓存，其余文件短期缓存；放在 server 之外（http 上下文），所有应用共用"""
+    return f'''map $uri $static_cache_control {{
+    "~\\.[0-9a-f]{{12}}\\.[A-Za-z0-9]+$" "{IMMUTABLE}";
+    default "public, max-age={settings.STATIC_MAX_AGE}";
+}}
+'''
+
+
+def nginx_location(location, alias):
+    """静态文件的 location 配置，放在 server 中；依赖 nginx_map() 定义的变量"""
+    location = '/' + location.strip('/') + '/'
+    alias = alias.rstrip('/') + '/'
+    return f'''location {location} {{
+    alias {alias};
+    gzip_static on;      # 直接发送 collectstatic 生成的 .gz 副本
+    # brotli_static on;  # 安装 ngx_brotli 模块后启用，发送 .br 副本
+    add_header Cache-Control $static_cache_control;
+    add_header Vary Accept-Encoding;
+    access_log off;
+    autoindex off;
+    try_files $uri =404;
+}}
+'''
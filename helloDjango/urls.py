@@ -14,21 +14,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 from helloDjango.settings import BASE_URL
+from helloDjango.metrics.views import metrics_view
+from helloDjango.staticfiles import serve_static
 
 
 def prefixed_path(route, view, BASE_URL = BASE_URL, name=None):
     """自动添加BASE_URL前缀的辅助函数"""
     BASE_URL_stripped = BASE_URL.strip('/')
     full_route = f'{BASE_URL_stripped}/{route}' if BASE_URL_stripped else route
-    print(f"路由:{full_route}")
     return path(full_route, view, name=name)
 
 urlpatterns = [
     prefixed_path('admin/', admin.site.urls),
     prefixed_path('env/', include('environment.urls')),
-] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
+    prefixed_path('metrics', metrics_view, name='metrics'),
+]
+
+if settings.DEBUG:
+    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+elif settings.STATIC_SERVE and settings.STATIC_URL:
+    # 没有 nginx 时分发 collectstatic 的输出（预压缩副本 + immutable 缓存头）
+    urlpatterns.append(
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_static, name='static')
+    )
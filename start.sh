@@ -1,25 +1,10 @@
 #!/bin/sh
 
-# 安装依赖
-pip install --no-index --find-links=/code/python_packages/ -r requirements.txt
+# 启动计时起点（manage.py boot 的启动报告从这里算起）
+export BOOT_T0=$(date +%s.%N)
 
-# 收集静态文件
-python manage.py collectstatic --noinput
+# 依赖和静态文件已在镜像构建时安装和收集，迁移文件随代码提交（见 Dockerfile）
 
-# 生成新的迁移文件
-python manage.py makemigrations
-
-# 创建数据库和应用迁移
-python manage.py migrate
-
-# 创建管理员账户（超级用户）
-echo "
-from django.contrib.auth.models import User
-if not User.objects.filter(username='admin').exists():
-    User.objects.create_superuser('admin', 'admin@example.com', '1234')
-else:
-    print('用户 admin 已存在，跳过创建。')
-" | python manage.py shell
-
-# 启动 Django 开发服务器
-uvicorn helloDjango.asgi:application --host 0.0.0.0 --port 8000 --workers 10
\ No newline at end of file
+# 在同一个进程中：启动并监管日志写入进程，按需执行迁移（咨询锁）、创建管理员、预加载应用，
+# 然后 fork 出 uvicorn worker；各阶段耗时写入 /tmp/startup_report.json
+exec python manage.py boot --host 0.0.0.0 --port 8000 --workers ${UVICORN_WORKERS:-10}